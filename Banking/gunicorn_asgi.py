@@ -0,0 +1,21 @@
+"""
+Gunicorn settings for serving the ASGI application with uvicorn workers.
+
+    gunicorn Banking.asgi:application -c Banking/gunicorn_asgi.py
+
+Each worker is one process with an event loop, so it keeps many requests in flight while
+they wait on the database or cnb.cz, instead of one request per sync worker.
+"""
+import multiprocessing
+import os
+
+worker_class = 'uvicorn_worker.UvicornWorker'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+# An async worker answers the heartbeat between requests, a stuck one is restarted after this.
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then, so slow leaks do not build up.
+max_requests = 10000
+max_requests_jitter = 1000
@@ -68,7 +68,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'bank.staticMiddleWare.AsyncWhiteNoiseMiddleware',
 ]
 
 MESSAGE_TAGS = {
@@ -121,11 +121,61 @@ else:
         }
     }
 
-CELERY_BROKER_URL = 'redis://localhost:6379'
-CELERY_RESULT_BACKEND = 'redis://localhost:6379'
+# Redis of the cache and of Celery, e.g. the one the host provisions for the app.
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379')
+
+# Cache shared by all workers and hosts, for the exchange-rate table, the rate matrix and the fragment versions.
+# Redis also keeps the version counters atomic.
+if 'test' in sys.argv:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+
+# How long a worker trusts its in-memory copy of the rate table before re-reading the shared cache.
+RATES_LOCAL_TTL = 300
+# How long to wait before asking CNB again after a failed fetch.
+RATES_RETRY_SECONDS = 60
+# Timeouts of requests to cnb.cz in seconds, for connecting and for each read of the response.
+CNB_CONNECT_TIMEOUT = 3.05
+CNB_READ_TIMEOUT = 10
+# After this many failed requests in a row, cnb.cz is not asked again for CNB_BREAKER_RESET_SECONDS.
+CNB_BREAKER_FAILURES = 3
+CNB_BREAKER_RESET_SECONDS = 5 * 60
+# Where the rate table comes from, in order of preference; see bank.utils.rateSources. A source that
+# fails or has not answered within RATE_HEDGE_DELAY seconds is raced against the next one.
+RATE_SOURCES = [
+    {'BACKEND': 'bank.utils.rateSources.CnbTextSource'},
+    {'BACKEND': 'bank.utils.rateSources.CnbXmlSource'},
+]
+RATE_HEDGE_DELAY = 0.5
+
+# Largest batch accepted by the bulk transfer endpoint.
+BULK_TRANSFER_MAX_ROWS = 10000
+
+# How long a response stored for an Idempotency-Key is replayed, in seconds.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# How many account numbers a worker reserves at once.
+ACCOUNT_NUMBER_BLOCK_SIZE = 50
+
+# How long a passed OTP check is trusted before the session has to verify again, in seconds.
+OTP_REVERIFY_SECONDS = 12 * 60 * 60
+
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
+CELERY_TIMEZONE = 'Europe/Prague'
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -167,8 +217,18 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 CELERY_BEAT_SCHEDULE = {
     'update_rates': {
-        'task': 'Banking.tasks.update_currency_rates',
-        'schedule': crontab(hour=15, minute=0, day_of_week='mon-fri'),
+        'task': 'bank.tasks.update_currency_rates',
+        # CNB publishes at 14:30 Prague time, refresh right after so web workers find a warm cache.
+        'schedule': crontab(hour=14, minute=35, day_of_week='mon-fri'),
+    },
+    'snapshot_balances': {
+        'task': 'bank.tasks.snapshot_balances',
+        # Snapshot days are UTC days, so run once the previous UTC day has ended in Prague.
+        'schedule': crontab(hour=2, minute=30),
+    },
+    'purge_idempotency_keys': {
+        'task': 'bank.tasks.purge_idempotency_keys',
+        'schedule': crontab(minute=0),
     },
 }
 # Default primary key field type
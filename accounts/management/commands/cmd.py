@@ -1,8 +1,8 @@
 from django.core.management import BaseCommand
 
-from bank.utils.cnbCurrencies import getRates
+from bank.utils.rateSources import rate_provider
 
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
-        getRates()
\ No newline at end of file
+        rate_provider().get()
\ No newline at end of file
@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from bank.models import BankAccount, CurrencyRate, UserAccount, Transaction
+from bank.models import BankAccount, CurrencyRate, UserAccount, Transaction, CurrencyRateHistory
 
 
 # Register your models here.
@@ -15,6 +15,13 @@ class CurrencyRateAdmin(admin.ModelAdmin):
     list_display = ('currency', 'rate', 'updated_at')
 
 
+@admin.register(CurrencyRateHistory)
+class CurrencyRateHistoryAdmin(admin.ModelAdmin):
+    list_display = ('currency', 'valid_date', 'amount', 'rate')
+    list_filter = ('currency',)
+    date_hierarchy = 'valid_date'
+
+
 @admin.register(UserAccount)
 class UserAccountAdmin(admin.ModelAdmin):
     list_display = ('user', 'otp_enabled', 'bank_accounts_summary', 'primary_bank_account')
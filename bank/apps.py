@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save
+from django.test.signals import setting_changed
 
 
 class BankConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bank'
+
+    def ready(self):
+        from bank.twoFactorMiddleWare import forget_otp_state
+        from bank.utils.conversion import invalidate_rate_matrix
+        from bank.utils.rateSources import reset_rate_provider
+        user_logged_in.connect(forget_otp_state, dispatch_uid='bank.forget_otp_state')
+        for signal in (post_save, post_delete):
+            signal.connect(invalidate_rate_matrix, sender='bank.CurrencyRate',
+                           dispatch_uid=f'bank.invalidate_rate_matrix.{signal is post_save}')
+        setting_changed.connect(reset_rate_provider, dispatch_uid='bank.reset_rate_provider')
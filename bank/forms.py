@@ -1,10 +1,9 @@
-import random
-
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 
 from bank.models import BankAccount, UserAccount, CurrencyRate
+from bank.utils.accountNumbers import allocate_account_number, is_valid_account_number
 
 
 class ChangePrimaryBankAccountForm(forms.Form):
@@ -16,15 +15,34 @@ class ChangePrimaryBankAccountForm(forms.Form):
             self.fields['bank_account'].queryset = BankAccount.objects.filter(user_account__user=user)
 
 
+class AccountNumberField(forms.ModelChoiceField):
+    """
+    An account entered by its number. A number that is not found and fails the check digit is
+    reported as mistyped; the numbers issued before the check digit are still found as they are.
+    """
+
+    def to_python(self, value):
+        try:
+            return super().to_python(value)
+        except forms.ValidationError:
+            if not is_valid_account_number(str(value).strip()):
+                raise forms.ValidationError('Wrong account number.', code='wrong_account_number')
+            raise
+
+
 class TransactionForm(forms.Form):
-    target_account = forms.ModelChoiceField(queryset=BankAccount.objects.none(), empty_label=None)
+    # Entered as an account number and looked up with a single query instead of listing every account.
+    target_account = AccountNumberField(queryset=BankAccount.objects.none(), to_field_name='account_number',
+                                        widget=forms.TextInput(attrs={'list': 'recipientOptions',
+                                                                      'autocomplete': 'off'}))
     amount = forms.DecimalField(max_digits=15, decimal_places=2)
     currency = forms.ModelChoiceField(queryset=CurrencyRate.objects.all())
 
-    def __init__(self, *args, target_accounts=None, **kwargs):
+    def __init__(self, *args, user_account=None, **kwargs):
         super().__init__(*args, **kwargs)
-        if target_accounts:
-            self.fields['target_account'].queryset = target_accounts
+        if user_account:
+            self.fields['target_account'].queryset = BankAccount.objects.select_related('currency').exclude(
+                user_account=user_account)
 
 
 class WithdrawalForm(forms.Form):
@@ -65,15 +83,8 @@ class BankAccountForm(forms.ModelForm):
     def save(self, commit=True):
         instance = super().save(commit=False)
         instance.balance = self.cleaned_data.get('starting_amount')
-        instance.account_number = self.generate_account_number()
+        instance.account_number = allocate_account_number()
         if commit:
             instance.save()
         return instance
 
-    @staticmethod
-    def generate_account_number():
-        while True:
-            number = random.randint(10 ** 10, 10 ** 11 - 1)
-            if not BankAccount.objects.filter(account_number=number).exists():
-                return number
-
@@ -0,0 +1,27 @@
+import requests
+from django.core.management import BaseCommand
+
+from bank.utils.rateHistory import CNB_YEARLY_RATES_URL, backfill_rates
+
+
+class Command(BaseCommand):
+    help = 'Load historical CNB exchange rates from the yearly rok.txt files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('years', nargs='*', type=int, help='Years to download from cnb.cz.')
+        parser.add_argument('--file', action='append', default=[], dest='files',
+                            help='Read a local rok.txt file instead of downloading it. Can be repeated.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for path in options['files']:
+            with open(path, encoding='utf-8') as lines:
+                count = backfill_rates(lines, options['batch_size'])
+            self.stdout.write(f'{path}: {count} rates')
+
+        for year in options['years']:
+            with requests.get(CNB_YEARLY_RATES_URL.format(year=year), stream=True, timeout=(5, 60)) as response:
+                response.raise_for_status()
+                response.encoding = 'utf-8'
+                count = backfill_rates(response.iter_lines(decode_unicode=True), options['batch_size'])
+            self.stdout.write(f'{year}: {count} rates')
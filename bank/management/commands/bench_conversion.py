@@ -0,0 +1,63 @@
+import json
+import random
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management import BaseCommand
+
+from bank.models import CurrencyRate
+from bank.utils.conversion import CENT, RateMatrix
+
+# Used when the database holds no rates yet.
+SAMPLE_RATES = [('EUR', 1, 24.525), ('USD', 1, 22.681), ('GBP', 1, 28.742), ('JPY', 100, 15.112),
+                ('HUF', 100, 6.331), ('PLN', 1, 5.676), ('CHF', 1, 25.374)]
+
+
+class Command(BaseCommand):
+    help = 'Time conversions with the rate matrix against the Decimal(float) arithmetic the views used before.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversions', type=int, default=100000)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rates = list(CurrencyRate.objects.values_list('currency', 'amount', 'rate')) or SAMPLE_RATES
+        started = time.perf_counter()
+        matrix = RateMatrix(rates)
+        build_seconds = time.perf_counter() - started
+
+        rng = random.Random(options['seed'])
+        codes = sorted(matrix.units)
+        conversions = [(Decimal(rng.randint(1, 10 ** 7)) / 100, rng.choice(codes), rng.choice(codes))
+                       for _ in range(options['conversions'])]
+        floats = {code: rate / amount for code, amount, rate in rates}
+        floats.setdefault('CZK', 1.0)
+
+        started = time.perf_counter()
+        legacy = [(amount * Decimal(floats[source]) / Decimal(floats[target])).quantize(CENT)
+                  for amount, source, target in conversions]
+        legacy_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        exact = [matrix.convert(amount, source, target) for amount, source, target in conversions]
+        matrix_seconds = time.perf_counter() - started
+
+        by_pair = defaultdict(list)
+        for amount, source, target in conversions:
+            by_pair[source, target].append(amount)
+        started = time.perf_counter()
+        for (source, target), amounts in by_pair.items():
+            matrix.convert_many(amounts, source, target)
+        many_seconds = time.perf_counter() - started
+
+        self.stdout.write(json.dumps({
+            'conversions': len(conversions),
+            'currencies': len(codes),
+            'matrix_build_seconds': round(build_seconds, 6),
+            'decimal_float_seconds': round(legacy_seconds, 4),
+            'matrix_convert_seconds': round(matrix_seconds, 4),
+            'matrix_convert_many_seconds': round(many_seconds, 4),
+            'matrix_convert_per_second': round(len(conversions) / matrix_seconds) if matrix_seconds else None,
+            'results_differing_from_float': sum(1 for old, new in zip(legacy, exact) if old != new),
+        }, indent=2))
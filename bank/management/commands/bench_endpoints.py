@@ -0,0 +1,43 @@
+import json
+
+from django.db import connection
+from django.core.management import BaseCommand
+
+from bank.utils.benchmarking import endpoint_requests, isolated_cache, run_client_benchmark, run_http_benchmark, \
+    seed_dataset, temporary_database
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway database and measure latency, queries per request and throughput of the dashboard, '
+            'transaction, withdraw and recharge views.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--accounts', type=int, default=2, help='Accounts per user.')
+        parser.add_argument('--transactions', type=int, default=10000)
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Threads of the HTTP load generator.')
+        parser.add_argument('--no-http', action='store_true', help='Only measure through the test client.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file instead of standard output.')
+
+    def handle(self, *args, **options):
+        with temporary_database(verbosity=options['verbosity']), isolated_cache():
+            user_ids = seed_dataset(options['users'], options['accounts'], options['transactions'], options['seed'])
+            planned = endpoint_requests(user_ids, options['requests'], options['seed'])
+            report = {
+                'seed': options['seed'],
+                'database': connection.vendor,
+                'dataset': {'users': options['users'], 'accounts_per_user': options['accounts'],
+                            'transactions': options['transactions']},
+                'client': run_client_benchmark(planned),
+            }
+            if not options['no_http']:
+                report['http'] = run_http_benchmark(planned, options['concurrency'])
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,35 @@
+import json
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from bank.utils.bulkTransfers import BatchError, parse_batch, execute_batch
+
+
+class Command(BaseCommand):
+    help = 'Apply a CSV or JSON batch of transfers between accounts given by account number.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV with source_account,target_account,amount,currency columns or JSON.')
+        parser.add_argument('--format', choices=('csv', 'json'), help='Defaults to the file extension.')
+        parser.add_argument('--output', help='Write the per-row results as JSON to this file.')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('csv' if options['path'].lower().endswith('.csv') else 'json')
+        with open(options['path'], encoding='utf-8') as file:
+            try:
+                rows = parse_batch(file.read(), fmt)
+            except BatchError as e:
+                raise CommandError(e)
+
+        started = time.perf_counter()
+        results = execute_batch(rows)
+        elapsed = time.perf_counter() - started
+
+        failed = [result for result in results if result['status'] != 'ok']
+        for result in failed:
+            self.stderr.write(f"row {result['row']}: {result['error']}")
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+        self.stdout.write(f'{len(results) - len(failed)} transfers applied, {len(failed)} failed in {elapsed:.2f} s')
@@ -0,0 +1,34 @@
+from django.core.management import BaseCommand, CommandError
+
+from bank.models import BankAccount
+from bank.utils.statements import FORMATS, parse_date_range, statement_rows
+
+
+class Command(BaseCommand):
+    help = 'Write the statement of a bank account as CSV or JSON Lines.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('account_number')
+        parser.add_argument('--start', help='First day, YYYY-MM-DD.')
+        parser.add_argument('--end', help='Last day, YYYY-MM-DD.')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', help='File to write to, standard output by default.')
+
+    def handle(self, *args, **options):
+        try:
+            account = BankAccount.objects.select_related('currency').get(account_number=options['account_number'])
+        except BankAccount.DoesNotExist:
+            raise CommandError('Bank account not found.')
+        try:
+            start, end = parse_date_range(options['start'], options['end'])
+        except ValueError:
+            raise CommandError('Invalid date.')
+
+        render_rows, _ = FORMATS[options['format']]
+        chunks = render_rows(statement_rows(account, start, end))
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(chunks)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,34 @@
+import json
+
+from django.core.management import BaseCommand
+
+from bank.utils.customerImport import BATCH_SIZE, import_customers, read_customers
+
+
+class Command(BaseCommand):
+    help = 'Create customers and their bank accounts from a CSV or JSON Lines file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV with username,email,password,accounts columns or JSON Lines.')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--workers', type=int, help='Password hashing processes, one per CPU by default.')
+        parser.add_argument('--output', help='Write the skipped rows and their errors as JSON to this file.')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('csv' if options['path'].lower().endswith('.csv') else 'jsonl')
+        with open(options['path'], encoding='utf-8', newline='') as file:
+            report = import_customers(read_customers(file, fmt), options['batch_size'], options['workers'],
+                                      progress=self.progress if options['verbosity'] else None)
+
+        for error in report['errors']:
+            self.stderr.write(f"row {error['row']}: {error['error']}")
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report['errors'], file, indent=2)
+        self.stdout.write(f"{report['customers']} customers with {report['accounts']} accounts imported, "
+                          f"{len(report['errors'])} rows skipped in {report['seconds']:.2f} s")
+
+    def progress(self, read, report):
+        rate = report['customers'] / report['seconds'] if report['seconds'] else 0
+        self.stdout.write(f"{read} rows read, {report['customers']} customers imported ({rate:.0f}/s)")
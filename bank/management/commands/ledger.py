@@ -0,0 +1,33 @@
+import json
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from bank.utils.ledger import backfill, rebuild, verify
+
+
+class Command(BaseCommand):
+    help = ('Backfill ledger postings for existing data, rebuild account balances from the postings '
+            'or verify the ledger against the balances.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('backfill', 'rebuild', 'verify'))
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['action'] == 'backfill':
+            transactions, accounts = backfill()
+            report = {'transactions': transactions, 'opening_balances': accounts}
+        elif options['action'] == 'rebuild':
+            report = {'balances_updated': rebuild()}
+        else:
+            unbalanced, mismatched = verify()
+            report = {
+                'unbalanced_transactions': unbalanced,
+                'mismatched_accounts': [{'account': account, 'balance': str(balance), 'postings': str(postings)}
+                                        for account, balance, postings in mismatched],
+            }
+        report['seconds'] = round(time.perf_counter() - started, 4)
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['action'] == 'verify' and (report['unbalanced_transactions'] or report['mismatched_accounts']):
+            raise CommandError('The ledger does not match the balances.')
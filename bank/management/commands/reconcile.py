@@ -0,0 +1,29 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+
+from bank.utils.reconciliation import SHARD_SIZE, reconcile
+
+
+class Command(BaseCommand):
+    help = ('Compare every account balance with its transaction history and write the accounts that do not '
+            'match as CSV.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='CSV file for the discrepancies, standard output by default.')
+        parser.add_argument('--shard-size', type=int, default=SHARD_SIZE, help='Accounts per shard.')
+        parser.add_argument('--workers', type=int, help='Processes, one per CPU by default.')
+
+    def handle(self, *args, **options):
+        if options['shard_size'] < 1 or (options['workers'] is not None and options['workers'] < 1):
+            raise CommandError('The shard size and the number of workers must be positive.')
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                summary = reconcile(output, options['shard_size'], options['workers'])
+            self.stdout.write(json.dumps(summary, indent=2))
+        else:
+            summary = reconcile(self.stdout, options['shard_size'], options['workers'])
+            self.stderr.write(json.dumps(summary, indent=2))
+        if summary['discrepancies']:
+            raise CommandError(f'{summary["discrepancies"]} accounts do not match their history.')
@@ -0,0 +1,23 @@
+import json
+
+from django.core.management import BaseCommand, CommandError
+
+from bank.utils.benchmarking import temporary_database, run_transfer_stress
+
+
+class Command(BaseCommand):
+    help = 'Run concurrent transfers in a throwaway test database and check that no update was lost.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8, help='Number of parallel writer threads.')
+        parser.add_argument('--transfers', type=int, default=100, help='Transfers made by each writer.')
+        parser.add_argument('--accounts', type=int, default=4, help='Number of accounts the writers compete for.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with temporary_database(verbosity=options['verbosity']):
+            report = run_transfer_stress(options['writers'], options['transfers'], options['accounts'],
+                                         options['seed'])
+        self.stdout.write(json.dumps(report, indent=2))
+        if report['lost_updates'] or report['recorded_transactions'] != report['succeeded']:
+            raise CommandError('Balances do not match the completed transfers.')
@@ -0,0 +1,39 @@
+import csv
+import json
+import time
+from decimal import Decimal
+
+from django.core.management import BaseCommand, CommandError
+
+from bank.utils.conversion import rate_matrix
+from bank.utils.valuation import bank_valuation
+
+
+class Command(BaseCommand):
+    help = 'Value the accounts of every customer in one currency and write the totals as CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--currency', default='CZK')
+        parser.add_argument('--output', help='CSV file for the per-customer totals, skipped by default.')
+
+    def handle(self, *args, **options):
+        currency = options['currency'].upper()
+        if currency not in rate_matrix():
+            raise CommandError('Unknown currency.')
+
+        started = time.perf_counter()
+        customers, totals = bank_valuation(currency)
+        elapsed = time.perf_counter() - started
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                writer = csv.writer(output)
+                writer.writerow(('user_account', f'total_{currency}'))
+                writer.writerows((customer, Decimal(total).scaleb(-2)) for customer, total in
+                                 zip(customers.tolist(), totals.tolist()))
+        self.stdout.write(json.dumps({
+            'currency': currency,
+            'customers': len(customers),
+            'total': str(Decimal(int(totals.sum())).scaleb(-2)),
+            'seconds': round(elapsed, 4),
+        }, indent=2))
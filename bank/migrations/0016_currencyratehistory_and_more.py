@@ -0,0 +1,27 @@
+# Generated by Django 4.2 on 2026-10-18 09:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0015_transaction_overdraft_fee'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CurrencyRateHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('valid_date', models.DateField()),
+                ('amount', models.PositiveIntegerField(default=1)),
+                ('rate', models.FloatField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='currencyratehistory',
+            constraint=models.UniqueConstraint(fields=('currency', 'valid_date'), name='unique_currency_valid_date'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-18 09:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0017_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['source_account', 'timestamp', 'id'], name='transaction_source_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['destination_account', 'timestamp', 'id'], name='transaction_dest_time_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2 on 2026-10-18 09:44
+
+from django.db import migrations, models
+from django.db.models import F
+
+TRANSFER, WITHDRAWAL, DEPOSIT = 2, 1, 0
+
+
+def fill_account_amounts(apps, schema_editor):
+    """Fill the amounts that are known exactly; cross-currency debits and deposits stay empty."""
+    Transaction = apps.get_model('bank', 'Transaction')
+    Transaction.objects.filter(type__in=[TRANSFER, WITHDRAWAL], currency_id=F('source_account__currency_id')).update(
+        source_amount=F('amount'))
+    # Transfers credited the entered amount to the target account whatever its currency.
+    Transaction.objects.filter(type=TRANSFER).update(destination_amount=F('amount'))
+    Transaction.objects.filter(type=DEPOSIT, currency_id=F('destination_account__currency_id')).update(
+        destination_amount=F('amount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0018_transaction_transaction_source_time_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='destination_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='source_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True),
+        ),
+        migrations.RunPython(fill_account_amounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2 on 2026-10-18 09:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0019_transaction_account_amounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=15)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['timestamp'], name='transaction_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailybalancesnapshot',
+            name='account',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='bank.bankaccount'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailybalancesnapshot',
+            constraint=models.UniqueConstraint(fields=('account', 'date'), name='unique_account_snapshot_date'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0020_dailybalancesnapshot_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='currencyrate',
+            name='amount',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0021_currencyrate_amount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountNumberCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_body', models.BigIntegerField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2 on 2026-10-18 10:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0022_accountnumbercounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('system_account', models.PositiveSmallIntegerField(blank=True, choices=[(0, 'cash'), (1, 'fees'), (2, 'fx clearing'), (3, 'opening balances')], null=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='bank.bankaccount')),
+                ('currency', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='bank.currencyrate')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='postings', to='bank.transaction')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ledgerposting',
+            index=models.Index(fields=['account', 'id'], name='posting_account_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='ledgerposting',
+            constraint=models.CheckConstraint(check=models.Q(('account__isnull', True), ('system_account__isnull', True), _connector='XOR'), name='posting_account_xor_system_account'),
+        ),
+    ]
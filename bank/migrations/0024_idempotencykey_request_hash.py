@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0023_ledgerposting'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='request_hash',
+            field=models.CharField(default='', max_length=64),
+        ),
+    ]
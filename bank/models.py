@@ -4,6 +4,8 @@ from django.db import models
 
 class CurrencyRate(models.Model):
     currency = models.CharField(max_length=3, unique=True)
+    # CZK per ``amount`` units of the currency, as CNB quotes it (e.g. per 100 JPY).
+    amount = models.PositiveIntegerField(default=1)
     rate = models.FloatField()
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -11,6 +13,22 @@ class CurrencyRate(models.Model):
         return f'{self.currency}'
 
 
+class CurrencyRateHistory(models.Model):
+    currency = models.CharField(max_length=3)
+    valid_date = models.DateField()
+    amount = models.PositiveIntegerField(default=1)
+    rate = models.FloatField()
+
+    class Meta:
+        # The unique index on (currency, valid_date) also serves the "rate as of date" lookups.
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'valid_date'], name='unique_currency_valid_date'),
+        ]
+
+    def __str__(self):
+        return f'{self.currency} {self.valid_date}'
+
+
 class UserAccount(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     secret_key = models.CharField(max_length=50, null=True, blank=True)
@@ -52,3 +70,102 @@ class Transaction(models.Model):
     currency = models.ForeignKey(CurrencyRate, on_delete=models.CASCADE)
     type = models.IntegerField(choices=TypeOfTransaction.choices)
     overdraft_fee = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    # Amounts that actually left the source account and reached the destination account, in their currencies.
+    source_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+    destination_amount = models.DecimalField(max_digits=15, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        # Account history is read newest first with (timestamp, id) keyset pagination.
+        indexes = [
+            models.Index(fields=['source_account', 'timestamp', 'id'], name='transaction_source_time_idx'),
+            models.Index(fields=['destination_account', 'timestamp', 'id'], name='transaction_dest_time_idx'),
+            # Balance snapshots read the transactions of whole days across all accounts.
+            models.Index(fields=['timestamp'], name='transaction_time_idx'),
+        ]
+
+
+class LedgerSystemAccount(models.IntegerChoices):
+    CASH = 0, "cash"
+    FEES = 1, "fees"
+    FX = 2, "fx clearing"
+    OPENING = 3, "opening balances"
+
+
+class PostingQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError('Ledger postings are append-only.')
+
+    def delete(self):
+        raise TypeError('Ledger postings are append-only.')
+
+
+class LedgerPosting(models.Model):
+    """
+    One side of a ledger entry: the change of a customer account or of a bank system account.
+
+    The postings of a transaction add up to zero in every currency.
+
+    Postings are never deleted, so neither is anything they refer to: deleting a user, bank
+    account, transaction or currency that has postings raises ``ProtectedError``; an account with
+    history is emptied and kept. ``SET_NULL`` is no alternative, a posting without an account or
+    a transaction would read as a system or opening posting.
+    """
+    transaction = models.ForeignKey(Transaction, on_delete=models.PROTECT, null=True, blank=True,
+                                    related_name='postings')
+    # Indexed together with the id below.
+    account = models.ForeignKey(BankAccount, on_delete=models.PROTECT, null=True, blank=True,
+                                related_name='postings', db_index=False)
+    system_account = models.PositiveSmallIntegerField(choices=LedgerSystemAccount.choices, null=True, blank=True)
+    currency = models.ForeignKey(CurrencyRate, on_delete=models.PROTECT)
+    amount = models.DecimalField(max_digits=15, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = PostingQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(check=models.Q(account__isnull=True) ^ models.Q(system_account__isnull=True),
+                                   name='posting_account_xor_system_account'),
+        ]
+        indexes = [
+            # Balances are summed per account in primary-key ranges.
+            models.Index(fields=['account', 'id'], name='posting_account_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError('Ledger postings are append-only.')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError('Ledger postings are append-only.')
+
+
+class AccountNumberCounter(models.Model):
+    # A single row with the next unallocated account number (without its check digit), reserved in blocks.
+    next_body = models.BigIntegerField()
+
+
+class IdempotencyKey(models.Model):
+    # SHA-256 of the user, the path and the Idempotency-Key header.
+    key = models.CharField(max_length=64, unique=True)
+    # SHA-256 of the request body, to refuse a key reused for a different request.
+    request_hash = models.CharField(max_length=64, default='')
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class DailyBalanceSnapshot(models.Model):
+    account = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name='balance_snapshots')
+    date = models.DateField()
+    # Balance at the end of the day.
+    balance = models.DecimalField(max_digits=15, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'date'], name='unique_account_snapshot_date'),
+        ]
+
+    def __str__(self):
+        return f'{self.account} {self.date}'
@@ -0,0 +1,47 @@
+"""
+WhiteNoise for async middleware chains.
+
+WhiteNoise 6.4 only has a sync middleware, and one sync middleware is enough for Django to
+handle every ASGI request on a thread. Static files are looked up in WhiteNoise's in-memory
+table and served as before, every other request goes on to the async handler. The file is
+read in chunks by an async generator, Django would otherwise read a sync file response into
+memory before sending it.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Scans the static directories on every request, keep it off the event loop.
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            response = self.serve(static_file, request)
+            # HEAD requests and 304s carry no file.
+            if getattr(response, 'file_to_stream', None) is not None:
+                response.streaming_content = read_file(response.file_to_stream, response.block_size)
+            return response
+        return await self.get_response(request)
+
+
+async def read_file(file, block_size):
+    """Yield the file in blocks read off the event loop; the response still closes it."""
+    read = sync_to_async(file.read, thread_sensitive=False)
+    while block := await read(block_size):
+        yield block
@@ -1,11 +1,41 @@
 from celery import shared_task
-from .models import CurrencyRate
-from .views import getRates
 
-@shared_task
+from bank.utils.balances import take_snapshots
+from bank.utils.cnbCurrencies import ingestRates
+from bank.utils.idempotency import purge_expired_keys
+from bank.utils.rateCache import cnb_today, store_rates
+from bank.utils.rateHistory import record_rate_history
+from bank.utils.rateSources import NoRatesAvailable, rate_provider
+
+
+class OutdatedTable(Exception):
+    pass
+
+
+@shared_task(autoretry_for=(NoRatesAvailable, OutdatedTable), retry_backoff=True, retry_backoff_max=600,
+             max_retries=6)
 def update_currency_rates():
-    rates = getRates()
-    for rate in rates:
-        currency, created = CurrencyRate.objects.get_or_create(name=rate.name)
-        currency.rate = rate.rate
-        currency.save()
\ No newline at end of file
+    """
+    Ingest today's CNB table and return the number of changed ``CurrencyRate`` rows.
+
+    A source may still serve the previous table when CNB publishes late, e.g. with a ``304``; it
+    is retried instead of being cached until the next publication.
+    """
+    rates = rate_provider().fetch()
+    today = cnb_today()
+    if any(rate.valid_date != today for rate in rates):
+        raise OutdatedTable(f'The rate table is not valid for {today}.')
+    changed = ingestRates(rates)
+    record_rate_history(rates)
+    store_rates(rates)
+    return changed
+
+
+@shared_task
+def purge_idempotency_keys():
+    return purge_expired_keys()
+
+
+@shared_task
+def snapshot_balances():
+    return take_snapshots()
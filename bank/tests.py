@@ -1,22 +1,80 @@
+import asyncio
+import csv
+import io
+import json
+import threading
 import unittest
+import warnings
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from decimal import Decimal
 
 from django.contrib import auth
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+import httpx
+import pyotp
+import qrcode
 import requests
-from django.test import RequestFactory
+from celery.exceptions import Retry
+from asgiref.sync import sync_to_async
+from django.db import connection
+from django.db.models import ProtectedError
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from django.test import TestCase, Client
+from django.test import TestCase, Client, TransactionTestCase
 from django.test import TestCase
 from django.contrib.auth.models import User
-from bank.forms import ChangePrimaryBankAccountForm, WithdrawalForm, RechargeForm, NewUserForm
-from bank.twoFactorMiddleWare import TwoFactorAuthMiddleware
-from bank.views import is_valid_amount, calculate_overdraft_fee
-from .models import CurrencyRate, UserAccount, BankAccount, TypeOfTransaction
+from bank.forms import ChangePrimaryBankAccountForm, WithdrawalForm, RechargeForm, NewUserForm, TransactionForm, \
+    BankAccountForm
+from bank.twoFactorMiddleWare import TwoFactorAuthMiddleware, OTP_ENABLED_SESSION_KEY, OTP_VERIFIED_SESSION_KEY, \
+    EXEMPT_URL_NAMES
+from bank.utils.accountNumbers import AccountNumberAllocator, luhn_check_digit, is_valid_account_number
+from bank.utils.balances import balance_as_of, take_snapshots
+from bank.utils.benchmarking import run_transfer_stress, seed_dataset, endpoint_requests, run_client_benchmark, \
+    run_http_benchmark, isolated_cache
+from bank.utils.bulkTransfers import BatchError, parse_batch, execute_batch
+from bank.utils.customerImport import import_customers, read_customers
+from bank.utils.ledger import backfill, opening_postings, rebuild, verify
+from bank.utils.reconciliation import REPORT_FIELDS, reconcile
+from bank.utils.conversion import RateMatrix, UnknownCurrency, rate_matrix
+from bank.utils.statements import statement_rows
+from bank.utils.transactionHistory import history_page, decode_cursor
+from bank.utils.valuation import bank_valuation, user_valuation
+from bank.utils.transfers import is_valid_amount, calculate_overdraft_fee, transfer, withdraw, deposit, \
+    InsufficientFunds
+from .models import CurrencyRate, UserAccount, BankAccount, TypeOfTransaction, CurrencyRateHistory, Transaction, \
+    IdempotencyKey, DailyBalanceSnapshot, LedgerPosting, LedgerSystemAccount
+from . import views
+from .tasks import purge_idempotency_keys
 import time
-from unittest.mock import patch
+from unittest.mock import AsyncMock, Mock, patch
 
-from .utils.cnbCurrencies import Currency, getRates
+from .tasks import OutdatedTable, update_currency_rates
+from .utils.cnbCurrencies import CircuitOpen, CnbClient, Currency, MalformedTable, ingestRates, parseRates, \
+    parseXmlRates
+from .utils.rateCache import RATES_CACHE_KEY, aget_rates, cnb_today, get_rates, clear_rates_cache, next_publication
+from .utils.rateHistory import parse_yearly_rates, backfill_rates, rate_as_of, record_rate_history
+from .utils.rateSources import CnbXmlSource, FileRateSource, HedgedRateProvider, NoRatesAvailable, rate_provider
+
+
+def verified_login(client, user):
+    """Log the user in with the 2FA state a finished OTP login leaves in the session."""
+    client.force_login(user)
+    session = client.session
+    session[OTP_ENABLED_SESSION_KEY] = True
+    session[OTP_VERIFIED_SESSION_KEY] = time.time()
+    session.save()
+
+
+def stub_provider(rates, stale=False):
+    """A rate provider returning ``rates``, to patch ``rate_provider`` with."""
+    return Mock(get=Mock(return_value=rates), aget=AsyncMock(return_value=rates), stale=stale)
 
 
 class CurrencyRateModelTest(TestCase):
@@ -60,12 +118,12 @@ class TestCurrency(unittest.TestCase):
 
 
 class TestGetRates(unittest.TestCase):
-    @patch('bank.utils.cnbCurrencies.requests.get')
+    @patch('bank.utils.cnbCurrencies.requests.Session.get')
     def test_get_rates(self, mock_get):
         mock_response = mock_get.return_value
         mock_response.text = 'header1\nheader2\nUSA|USD|1|usd|1,234\n'
 
-        rates = getRates()
+        rates = CnbClient().get()
 
         self.assertEqual(len(rates), 1)
         self.assertIsInstance(rates[0], Currency)
@@ -75,15 +133,241 @@ class TestGetRates(unittest.TestCase):
         self.assertEqual(rates[0].code, 'usd')
         self.assertEqual(rates[0].rate, 1.234)
 
-    @patch('bank.utils.cnbCurrencies.requests.get')
+    @patch('bank.utils.cnbCurrencies.requests.Session.get')
     def test_get_rates_connection_error(self, mock_get):
         mock_get.side_effect = requests.exceptions.ConnectionError
 
-        rates = getRates()
+        rates = CnbClient().get()
 
         self.assertEqual(rates, tuple())
 
 
+CNB_TABLE = ('30.05.2023 #103\n'
+             'země|měna|množství|kód|kurz\n'
+             'EMU|euro|1|EUR|23,790\n'
+             'Japonsko|jen|100|JPY|15,812\n')
+
+CNB_XML_TABLE = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<kurzy banka="CNB" datum="30.05.2023" poradi="103"><tabulka typ="XML_TYP_CNB_KURZY_DEVIZOVEHO_TRHU">'
+                 '<radek kod="EUR" mena="euro" mnozstvi="1" kurz="23,790" zeme="EMU"/>'
+                 '<radek kod="JPY" mena="jen" mnozstvi="100" kurz="15,812" zeme="Japonsko"/>'
+                 '<radek kod="USD" mena="dolar" mnozstvi="1" zeme="USA"/>'
+                 '</tabulka></kurzy>')
+
+
+class StubCnbHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        stub = self.server
+        stub.received.append(self.headers)
+        time.sleep(stub.delay)
+        if stub.status != 200:
+            self.send_response(stub.status)
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == stub.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = stub.body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', stub.etag)
+        self.send_header('Last-Modified', 'Tue, 30 May 2023 12:35:00 GMT')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CnbClientTest(unittest.TestCase):
+    """The client against a local stand-in for cnb.cz."""
+
+    def setUp(self):
+        self.stub = ThreadingHTTPServer(('127.0.0.1', 0), StubCnbHandler)
+        self.stub.daemon_threads = True
+        self.stub.received, self.stub.delay, self.stub.status = [], 0, 200
+        self.stub.body, self.stub.etag = CNB_TABLE, '"103"'
+        threading.Thread(target=self.stub.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.stub.server_close)
+        self.addCleanup(self.stub.shutdown)
+        self.client = CnbClient(f'http://127.0.0.1:{self.stub.server_port}/denni_kurz.txt', connect_timeout=1,
+                                read_timeout=0.2, failure_threshold=2, reset_seconds=0.3)
+
+    def test_unchanged_table_is_revalidated(self):
+        rates = self.client.get()
+        self.assertEqual([(rate.code, rate.amount, rate.rate) for rate in rates], [('EUR', 1, 23.79),
+                                                                                  ('JPY', 100, 15.812)])
+        self.assertEqual(rates[0].valid_date, date(2023, 5, 30))
+
+        self.assertIs(self.client.get(), rates)
+        self.assertEqual(self.stub.received[1]['If-None-Match'], '"103"')
+        self.assertEqual(self.stub.received[1]['If-Modified-Since'], 'Tue, 30 May 2023 12:35:00 GMT')
+        self.assertFalse(self.client.stale)
+
+    def test_slow_upstream_serves_last_good_table(self):
+        rates = self.client.get()
+        self.stub.delay = 1
+        started = time.perf_counter()
+        self.assertIs(self.client.get(), rates)
+        self.assertLess(time.perf_counter() - started, 0.8)
+        self.assertTrue(self.client.stale)
+        with self.assertRaises(requests.exceptions.Timeout):
+            self.client.fetch()
+
+    def test_circuit_opens_after_failures_and_probes_later(self):
+        self.stub.status = 503
+        for _ in range(3):
+            self.assertEqual(self.client.get(), ())
+        # The third call did not reach the server.
+        self.assertEqual(len(self.stub.received), 2)
+        with self.assertRaises(CircuitOpen):
+            self.client.fetch()
+
+        time.sleep(0.35)
+        self.stub.status = 200
+        self.assertEqual(len(self.client.get()), 2)
+        self.assertEqual(len(self.stub.received), 3)
+
+    def test_damaged_lines_are_skipped(self):
+        self.stub.body = CNB_TABLE + 'Kanada|dolar|1|CAD\nUSA|dolar|jeden|USD|22,162\nBroken|line\n'
+        self.assertEqual([rate.code for rate in self.client.get()], ['EUR', 'JPY'])
+
+        self.stub.body, self.stub.etag = '<html>Maintenance</html>', '"maintenance"'
+        with self.assertRaises(MalformedTable):
+            self.client.fetch()
+        self.assertEqual(len(self.client.get()), 2)
+        self.assertTrue(self.client.stale)
+
+    def test_async_fetch_shares_the_table(self):
+        rates = asyncio.run(self.client.aget())
+        self.assertEqual(len(rates), 2)
+        self.assertIs(asyncio.run(self.client.aget()), rates)
+        self.assertEqual(self.stub.received[1]['If-None-Match'], '"103"')
+
+        self.stub.delay = 1
+        self.assertIs(asyncio.run(self.client.aget()), rates)
+        self.assertTrue(self.client.stale)
+
+    def test_cancelled_probe_lets_the_next_call_probe(self):
+        self.client.failure_threshold = 1
+        self.stub.status = 503
+        self.assertEqual(self.client.get(), ())
+
+        time.sleep(0.35)
+        self.stub.status, self.stub.delay = 200, 1
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(asyncio.wait_for(self.client.afetch(), 0.1))
+
+        self.stub.delay = 0
+        self.assertEqual(len(asyncio.run(self.client.afetch())), 2)
+
+    def test_xml_source(self):
+        self.stub.body = CNB_XML_TABLE
+        source = CnbXmlSource(url=f'http://127.0.0.1:{self.stub.server_port}/denni_kurz.xml', read_timeout=0.2)
+        rates = source.fetch()
+        self.assertEqual([(rate.country, rate.code, rate.amount, rate.rate) for rate in rates],
+                         [('EMU', 'EUR', 1, 23.79), ('Japonsko', 'JPY', 100, 15.812)])
+        self.assertIs(asyncio.run(source.afetch()), rates)
+
+
+class StubSource:
+    def __init__(self, rates=(), delay=0, error=None):
+        self.rates, self.delay, self.error = rates, delay, error
+        self.cancelled = False
+
+    def fetch(self):
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.rates
+
+    async def afetch(self):
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error:
+            raise self.error
+        return self.rates
+
+
+class RateSourcesTest(unittest.TestCase):
+    def setUp(self):
+        self.rates = parseRates(CNB_TABLE)
+        self.other_rates = (Currency('USA', 'dolar', 1, 'USD', 22.1),)
+
+    def test_xml_and_text_tables_give_the_same_rates(self):
+        self.assertEqual([vars(rate) for rate in parseXmlRates(CNB_XML_TABLE)], [vars(rate) for rate in self.rates])
+        with self.assertRaises(MalformedTable):
+            parseXmlRates('30.05.2023 #103')
+        with self.assertRaises(MalformedTable):
+            parseXmlRates('<kurzy datum="30.05.2023"><tabulka/></kurzy>')
+
+    def test_file_source_reads_both_formats(self):
+        directory = Path(self.enterContext(TemporaryDirectory()))
+        (directory / 'rates.txt').write_text(CNB_TABLE, encoding='utf-8')
+        (directory / 'rates.xml').write_text(CNB_XML_TABLE, encoding='utf-8')
+        for name in ('rates.txt', 'rates.xml'):
+            self.assertEqual([rate.code for rate in FileRateSource(directory / name).fetch()], ['EUR', 'JPY'])
+        with self.assertRaises(OSError):
+            FileRateSource(directory / 'missing.txt').fetch()
+
+    def test_slow_source_is_hedged(self):
+        provider = HedgedRateProvider([StubSource(self.rates, delay=1), StubSource(self.other_rates)], 0.05)
+        started = time.perf_counter()
+        self.assertIs(provider.fetch(), self.other_rates)
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+    def test_failing_source_fails_over_without_waiting(self):
+        provider = HedgedRateProvider([StubSource(error=requests.exceptions.ConnectionError('refused')),
+                                       StubSource(self.rates, delay=0.05)], 10)
+        started = time.perf_counter()
+        self.assertIs(provider.fetch(), self.rates)
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+    def test_last_table_served_when_every_source_fails(self):
+        source = StubSource(self.rates)
+        provider = HedgedRateProvider([source, StubSource(error=MalformedTable('empty'))], 0.01)
+        self.assertEqual(provider.get(), self.rates)
+
+        source.error = httpx.ConnectTimeout('timed out')
+        with self.assertRaisesRegex(NoRatesAvailable, 'ConnectTimeout.*MalformedTable|MalformedTable.*ConnectTimeout'):
+            provider.fetch()
+        self.assertIs(provider.get(), self.rates)
+        self.assertTrue(provider.stale)
+        self.assertEqual(HedgedRateProvider([source], 0.01).get(), ())
+
+    def test_unexpected_source_errors_fail_over(self):
+        directory = Path(self.enterContext(TemporaryDirectory()))
+        (directory / 'rates.txt').write_bytes('30.05.2023 #103\nEMU|euro|1|EUR|23,790\nČína|'.encode('cp1250'))
+        provider = HedgedRateProvider([FileRateSource(directory / 'rates.txt'), StubSource(error=RuntimeError('bug'))],
+                                      0.01)
+        with self.assertRaisesRegex(NoRatesAvailable, 'UnicodeDecodeError'):
+            provider.fetch()
+        self.assertEqual(provider.get(), ())
+        self.assertEqual(asyncio.run(provider.aget()), ())
+
+    def test_async_hedge_cancels_the_slower_request(self):
+        slow = StubSource(self.rates, delay=1)
+        provider = HedgedRateProvider([slow, StubSource(self.other_rates)], 0.05)
+        self.assertIs(asyncio.run(provider.aget()), self.other_rates)
+        self.assertTrue(slow.cancelled)
+        self.assertFalse(provider.stale)
+
+    def test_provider_built_from_settings(self):
+        directory = Path(self.enterContext(TemporaryDirectory()))
+        (directory / 'rates.xml').write_text(CNB_XML_TABLE, encoding='utf-8')
+        sources = [{'BACKEND': 'bank.utils.rateSources.FileRateSource', 'OPTIONS': {'path': directory / 'rates.xml'}}]
+        with override_settings(RATE_SOURCES=sources, RATE_HEDGE_DELAY=0.1):
+            provider = rate_provider()
+            self.assertIs(rate_provider(), provider)
+            self.assertEqual(len(provider.get()), 2)
+        self.assertIsNot(rate_provider(), provider)
+
+
 class MockRate:
     def __init__(self, code, rate):
         self.code = code
@@ -118,6 +402,31 @@ class TwoFactorAuthMiddlewareTest(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.url, reverse('bank:setup_otp'))
 
+    def test_exempt_paths_are_reversed_once(self):
+        middleware = TwoFactorAuthMiddleware(get_response=None)
+        with patch('bank.twoFactorMiddleWare.reverse', wraps=reverse) as mock_reverse:
+            for _ in range(3):
+                request = self.factory.get(reverse('bank:login'))
+                self.assertIsNone(middleware.process_view(request, None, None, None))
+        self.assertEqual(mock_reverse.call_count, len(EXEMPT_URL_NAMES))
+
+    def test_otp_status_is_kept_in_session(self):
+        user = User.objects.create_user(username='pepa', password='842653971lL/')
+        UserAccount.objects.create(user=user, otp_enabled=True)
+        middleware = TwoFactorAuthMiddleware(get_response=None)
+        session = self.client.session
+        session[OTP_VERIFIED_SESSION_KEY] = time.time()
+
+        request = self.factory.get(reverse('bank:dashboard'))
+        request.user, request.session = user, session
+        self.assertIsNone(middleware.process_view(request, None, None, None))
+        self.assertTrue(session[OTP_ENABLED_SESSION_KEY])
+
+        request = self.factory.get(reverse('bank:dashboard'))
+        request.user, request.session = User.objects.get(pk=user.pk), session
+        with self.assertNumQueries(0):
+            self.assertIsNone(middleware.process_view(request, None, None, None))
+
     def test_process_view_authenticated_user_with_2fa_setup(self):
         # Create a user with UserAccount and 2FA setup
         user = User.objects.create_user(username='pepa', password='842653971lL/')
@@ -126,10 +435,11 @@ class TwoFactorAuthMiddlewareTest(TestCase):
         # Set up the middleware
         middleware = TwoFactorAuthMiddleware(get_response=None)
 
-        # Create a request to a protected URL
+        # Create a request to a protected URL from a session that passed the OTP check
         url = reverse('bank:dashboard')
         request = self.factory.get(url)
         request.user = user
+        request.session = {OTP_VERIFIED_SESSION_KEY: time.time()}
 
         # Process the view
         response = middleware.process_view(request, view_func=None, view_args=None, view_kwargs=None)
@@ -137,6 +447,61 @@ class TwoFactorAuthMiddlewareTest(TestCase):
         # Assert that the response is not a redirect
         self.assertEqual(response, None)
 
+    def test_process_view_authenticated_user_not_verified(self):
+        user = User.objects.create_user(username='pepa', password='842653971lL/')
+        UserAccount.objects.create(user=user, otp_enabled=True)
+        middleware = TwoFactorAuthMiddleware(get_response=None)
+
+        for session in ({}, {OTP_VERIFIED_SESSION_KEY: time.time() - settings.OTP_REVERIFY_SECONDS - 1}):
+            request = self.factory.get(reverse('bank:dashboard'))
+            request.user, request.session = user, session
+            response = middleware.process_view(request, view_func=None, view_args=None, view_kwargs=None)
+            self.assertEqual(response.url, reverse('bank:verify_otp'))
+
+    def test_verify_otp_marks_session_until_next_login(self):
+        user = User.objects.create_user(username='pepa', password='842653971lL/')
+        user_account = UserAccount.objects.create(user=user, otp_enabled=True, secret_key='JBSWY3DPEHPK3PXP')
+        self.client.force_login(user)
+        self.assertRedirects(self.client.get(reverse('bank:transactions')), reverse('bank:verify_otp'),
+                             fetch_redirect_response=False)
+
+        code = pyotp.TOTP(user_account.secret_key).now()
+        self.client.post(reverse('bank:verify_otp'), {'otp': code})
+        self.assertIn(OTP_VERIFIED_SESSION_KEY, self.client.session)
+        self.assertEqual(self.client.get(reverse('bank:transactions')).status_code, 404)
+
+        self.client.force_login(user)
+        self.assertNotIn(OTP_VERIFIED_SESSION_KEY, self.client.session)
+
+
+class SetupOtpQrCodeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='pepa', password='842653971lL/', email='pepa@example.com')
+        self.user_account = UserAccount.objects.create(user=self.user, secret_key='JBSWY3DPEHPK3PXP')
+        self.client.force_login(self.user)
+
+    def test_qr_code_is_rendered_once_per_secret(self):
+        with patch('bank.views.qrcode.make', wraps=qrcode.make) as mock_make:
+            first = self.client.get(reverse('bank:setup_otp')).context['qr_code']
+            self.assertEqual(self.client.get(reverse('bank:setup_otp')).context['qr_code'], first)
+            self.assertEqual(mock_make.call_count, 1)
+
+            self.user_account.secret_key = 'KRSXG5CTMVRXEZLU'
+            self.user_account.save()
+            self.assertNotEqual(self.client.get(reverse('bank:setup_otp')).context['qr_code'], first)
+            self.assertEqual(mock_make.call_count, 2)
+
+    def test_enabled_2fa_cannot_be_set_up_again(self):
+        self.user_account.otp_enabled = True
+        self.user_account.save()
+        code = pyotp.TOTP(self.user_account.secret_key).now()
+
+        self.assertRedirects(self.client.get(reverse('bank:setup_otp')), reverse('bank:verify_otp'))
+        self.assertRedirects(self.client.post(reverse('bank:setup_otp'), {'otp': code}), reverse('bank:verify_otp'))
+        self.assertNotIn(OTP_VERIFIED_SESSION_KEY, self.client.session)
+        self.assertRedirects(self.client.get(reverse('bank:dashboard')), reverse('bank:verify_otp'))
+
 
 class TestChangePrimaryBankAccountForm(TestCase):
     def setUp(self):
@@ -310,5 +675,1059 @@ class BankLoginViewTest(TestCase):
         self.assertEqual(response.status_code, 302)  # Successful login should redirect
 
 
+class RateCacheTest(TestCase):
+    def setUp(self):
+        clear_rates_cache()
+        self.rates = (Currency('USA', 'dolar', 1, 'USD', 22.5), Currency('EMU', 'euro', 1, 'EUR', 24.5))
+
+    def tearDown(self):
+        clear_rates_cache()
+
+    def test_next_publication_same_day(self):
+        now = datetime(2023, 5, 30, 8, 0, tzinfo=dt_timezone.utc)  # Tuesday, 10:00 in Prague
+        self.assertEqual(next_publication(now).date(), now.date())
+        self.assertEqual(next_publication(now).hour, 14)
+
+    def test_next_publication_skips_weekend(self):
+        now = datetime(2023, 6, 2, 15, 0, tzinfo=dt_timezone.utc)  # Friday after publication
+        self.assertEqual(next_publication(now).date(), datetime(2023, 6, 5).date())
+
+    @patch('bank.utils.rateCache.rate_provider')
+    def test_stale_table_is_not_cached_until_next_publication(self, mock_provider):
+        mock_provider.return_value = stub_provider(self.rates, stale=True)
+        with patch('bank.utils.rateCache.ingestRates') as mock_ingest_rates:
+            self.assertEqual(get_rates(), self.rates)
+        mock_ingest_rates.assert_not_called()
+        self.assertIsNone(cache.get(RATES_CACHE_KEY))
+
+    @patch('bank.utils.rateCache.rate_provider')
+    def test_rates_fetched_once(self, mock_provider):
+        mock_provider.return_value = stub_provider(self.rates)
+
+        self.assertEqual(get_rates(), self.rates)
+        self.assertEqual(get_rates(), self.rates)
+
+        mock_provider.return_value.get.assert_called_once()
+        self.assertEqual(CurrencyRate.objects.get(currency='EUR').rate, 24.5)
+
+    @patch('bank.utils.rateCache.rate_provider')
+    async def test_concurrent_async_lookups_fetch_once(self, mock_provider):
+        async def slow_fetch():
+            await asyncio.sleep(0.05)
+            return self.rates
+
+        mock_provider.return_value = stub_provider(self.rates)
+        mock_provider.return_value.aget.side_effect = slow_fetch
+        with patch('bank.utils.rateCache.ingestRates') as mock_ingest_rates:
+            results = await asyncio.gather(*(aget_rates() for _ in range(5)))
+
+        self.assertEqual(results, [self.rates] * 5)
+        mock_provider.return_value.aget.assert_awaited_once()
+        mock_ingest_rates.assert_called_once_with(self.rates)
+
+    @patch('bank.utils.rateCache.rate_provider')
+    def test_shared_cache_used_by_other_process(self, mock_provider):
+        mock_provider.return_value = stub_provider(self.rates)
+        get_rates()
+        # Simulate a fresh worker process that only shares the Django cache.
+        with patch.dict('bank.utils.rateCache._local', {'rates': None, 'expires': None}):
+            self.assertEqual(len(get_rates()), 2)
+
+        mock_provider.return_value.get.assert_called_once()
+
+    @patch('bank.utils.rateCache.rate_provider')
+    def test_dashboard_does_not_fetch_or_write_rates(self, mock_provider):
+        mock_provider.return_value = stub_provider(self.rates)
+        user = User.objects.create_user(username='pepa', password='842653971lL/')
+        UserAccount.objects.create(user=user, otp_enabled=True)
+        verified_login(self.client, user)
+
+        self.client.get(reverse('bank:dashboard'))
+        with patch('bank.utils.rateCache.ingestRates') as mock_ingest_rates:
+            response = self.client.get(reverse('bank:dashboard'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'EUR')
+        mock_provider.return_value.aget.assert_awaited_once()
+        mock_ingest_rates.assert_not_called()
+
+
+class IngestRatesTest(TestCase):
+    def setUp(self):
+        clear_rates_cache()
+        self.rates = (Currency('USA', 'dolar', 1, 'USD', 22.5), Currency('EMU', 'euro', 1, 'EUR', 24.5))
+
+    def tearDown(self):
+        clear_rates_cache()
+
+    def test_ingest_inserts_all_rates_including_czk(self):
+        self.assertEqual(ingestRates(self.rates), 3)
+        self.assertEqual(CurrencyRate.objects.get(currency='CZK').rate, 1)
+        self.assertEqual(CurrencyRate.objects.get(currency='USD').rate, 22.5)
+
+    def test_ingest_is_idempotent(self):
+        ingestRates(self.rates)
+        with self.assertNumQueries(1):
+            self.assertEqual(ingestRates(self.rates), 0)
+
+    def test_ingest_writes_only_changed_rates_in_one_query(self):
+        ingestRates(self.rates)
+        changed = (Currency('USA', 'dolar', 1, 'USD', 21.9), Currency('EMU', 'euro', 1, 'EUR', 24.5))
+        with self.assertNumQueries(2):
+            self.assertEqual(ingestRates(changed), 1)
+        self.assertEqual(CurrencyRate.objects.get(currency='USD').rate, 21.9)
+
+    @patch('bank.tasks.rate_provider')
+    def test_task_reports_changes_and_warms_cache(self, mock_provider):
+        for rate in self.rates:
+            rate.valid_date = cnb_today()
+        mock_provider.return_value.fetch.return_value = self.rates
+
+        self.assertEqual(update_currency_rates(), 3)
+        self.assertEqual(update_currency_rates(), 0)
+
+        with patch('bank.utils.rateCache.rate_provider') as mock_cache_provider:
+            self.assertEqual(get_rates(), self.rates)
+        mock_cache_provider.assert_not_called()
+
+    @patch('bank.tasks.rate_provider')
+    def test_task_retries_previous_days_table(self, mock_provider):
+        yesterday = cnb_today() - timedelta(days=1)
+        mock_provider.return_value.fetch.return_value = (Currency('EMU', 'euro', 1, 'EUR', 24.5, yesterday),)
+
+        with self.assertRaises(Retry) as retry, patch('bank.tasks.ingestRates') as mock_ingest_rates:
+            update_currency_rates.apply(throw=True)
+        self.assertIsInstance(retry.exception.exc, OutdatedTable)
+        mock_ingest_rates.assert_not_called()
+        self.assertIsNone(cache.get(RATES_CACHE_KEY))
+
+
+class RateMatrixTest(TestCase):
+    def setUp(self):
+        self.matrix = RateMatrix([('EUR', 1, 24.5), ('JPY', 100, 16.251), ('USD', 1, 22.1)])
+
+    def test_conversion_is_exact_and_uses_the_unit(self):
+        self.assertEqual(self.matrix.convert(Decimal('1000'), 'JPY', 'CZK'), Decimal('162.51'))
+        self.assertEqual(self.matrix.convert(Decimal('24.50'), 'CZK', 'EUR'), Decimal('1.00'))
+        self.assertEqual(self.matrix.convert(Decimal('0.3'), 'USD', 'CZK'), Decimal('6.63'))
+        # 0.1 EUR is 2.45 CZK exactly; Decimal(24.5 * 0.1) would carry binary noise.
+        self.assertEqual(self.matrix.convert(Decimal('0.1'), 'EUR', 'CZK'), Decimal('2.45'))
+
+    def test_rounds_half_up(self):
+        matrix = RateMatrix([('EUR', 1, 0.5)])
+        self.assertEqual(matrix.convert(Decimal('0.01'), 'EUR', 'CZK'), Decimal('0.01'))
+        self.assertEqual(matrix.convert(Decimal('0.03'), 'EUR', 'CZK'), Decimal('0.02'))
+
+    def test_convert_many_matches_convert(self):
+        amounts = [Decimal(value) / 7 for value in range(1, 50)]
+        self.assertEqual(self.matrix.convert_many(amounts, 'EUR', 'JPY'),
+                         [self.matrix.convert(amount, 'EUR', 'JPY') for amount in amounts])
+
+    def test_matrix_is_immutable_and_rejects_unknown_currencies(self):
+        with self.assertRaises(AttributeError):
+            self.matrix.version = 'x'
+        with self.assertRaises(TypeError):
+            self.matrix.units['EUR'] = Decimal(1)
+        with self.assertRaises(UnknownCurrency):
+            self.matrix.convert(Decimal('1'), 'EUR', 'GBP')
+
+    def test_stored_matrix_is_rebuilt_only_after_rates_change(self):
+        CurrencyRate.objects.create(currency='EUR', rate=24.5)
+        matrix = rate_matrix()
+        with self.assertNumQueries(0):
+            self.assertIs(rate_matrix(), matrix)
+
+        ingestRates((Currency('Japonsko', 'jen', 100, 'JPY', 16.251),))
+        self.assertEqual(rate_matrix().convert(Decimal('100'), 'JPY', 'CZK'), Decimal('16.25'))
+        self.assertEqual(CurrencyRate.objects.get(currency='JPY').amount, 100)
+
+    def test_transfer_credits_target_in_its_own_currency(self):
+        czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        eur = CurrencyRate.objects.create(currency='EUR', rate=24.5)
+        user = User.objects.create_user(username='pepa', password='842653971lL/')
+        user_account = UserAccount.objects.create(user=user, otp_enabled=True)
+        source = BankAccount.objects.create(user_account=user_account, balance=Decimal('1000'), currency=czk)
+        user_account.primary_bank_account = source
+        user_account.save()
+        target = BankAccount.objects.create(user_account=UserAccount.objects.create(user=User.objects.create(
+            username='other')), balance=Decimal('0'), currency=eur, account_number='20000000001')
+        verified_login(self.client, user)
+
+        response = self.client.post(reverse('bank:transaction'), {'target_account': '20000000001',
+                                                                  'amount': '49.00', 'currency': czk.pk})
+        self.assertEqual(response.json(), {"success": "Transaction complete."})
+        target.refresh_from_db()
+        self.assertEqual(target.balance, Decimal('2.00'))
+
+
+class ValuationTest(TestCase):
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.eur = CurrencyRate.objects.create(currency='EUR', rate=24.5)
+        self.jpy = CurrencyRate.objects.create(currency='JPY', amount=100, rate=16.0)
+        self.user = User.objects.create_user(username='pepa', password='842653971lL/')
+        self.user_account = UserAccount.objects.create(user=self.user, otp_enabled=True)
+        for number, (balance, currency) in enumerate([('100.00', self.czk), ('2.00', self.eur), ('1000', self.jpy)]):
+            BankAccount.objects.create(user_account=self.user_account, balance=Decimal(balance), currency=currency,
+                                       account_number=f'1000000000{number}')
+        self.other = UserAccount.objects.create(user=User.objects.create(username='other'))
+        BankAccount.objects.create(user_account=self.other, balance=Decimal('-24.50'), currency=self.czk)
+        rate_matrix()
+
+    def test_user_total_in_one_query(self):
+        with self.assertNumQueries(1):
+            valuation = user_valuation(self.user_account, 'CZK')
+        self.assertEqual(valuation['total'], '309.00')
+        self.assertEqual([account['value'] for account in valuation['accounts']], ['100.00', '49.00', '160.00'])
+        self.assertEqual(user_valuation(self.user_account, 'EUR')['total'], '12.61')
+
+    def test_endpoint(self):
+        verified_login(self.client, self.user)
+        response = self.client.get(reverse('bank:valuation'), {'currency': 'eur'})
+        self.assertEqual(response.json()['currency'], 'EUR')
+        self.assertEqual(self.client.get(reverse('bank:valuation'), {'currency': 'XYZ'}).status_code, 400)
+
+    def test_bank_valuation_matches_user_valuation(self):
+        with self.assertNumQueries(1):
+            customers, totals = bank_valuation('EUR')
+        self.assertEqual(customers.tolist(), [self.user_account.pk, self.other.pk])
+        self.assertEqual(totals.tolist(), [1261, -100])
+
+        output = io.StringIO()
+        call_command('value_bank', '--currency', 'CZK', stdout=output)
+        self.assertEqual(json.loads(output.getvalue())['total'], '284.50')
+
+
+class AccountNumberAllocatorTest(TestCase):
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.user_account = UserAccount.objects.create(user=User.objects.create(username='pepa'))
+
+    def test_luhn_check_digit(self):
+        self.assertEqual(luhn_check_digit('7992739871'), '3')
+        self.assertTrue(is_valid_account_number('79927398713'))
+        self.assertFalse(is_valid_account_number('79927398714'))
+        self.assertFalse(is_valid_account_number('7992739871'))
+
+    def test_numbers_come_from_reserved_blocks(self):
+        allocator = AccountNumberAllocator(block_size=5)
+        first = allocator.allocate()[0]
+        with self.assertNumQueries(0):
+            rest = allocator.allocate(4)
+        numbers = [first] + rest
+        self.assertEqual(len(set(numbers)), 5)
+        self.assertTrue(all(is_valid_account_number(number) for number in numbers))
+        self.assertFalse(set(AccountNumberAllocator(block_size=5).allocate(5)) & set(numbers))
+
+    def test_taken_numbers_are_skipped(self):
+        taken = f'{10 ** 9 + 1}{luhn_check_digit(str(10 ** 9 + 1))}'
+        BankAccount.objects.create(user_account=self.user_account, balance=Decimal('0'), currency=self.czk,
+                                   account_number=taken)
+        numbers = AccountNumberAllocator(block_size=3).allocate(3)
+        self.assertNotIn(taken, numbers)
+        self.assertEqual(len(numbers), 3)
+
+    def test_form_assigns_allocated_number(self):
+        form = BankAccountForm({'currency': self.czk.pk})
+        self.assertTrue(form.is_valid())
+        account = form.save(commit=False)
+        account.user_account, account.balance = self.user_account, Decimal('0')
+        account.save()
+        self.assertTrue(is_valid_account_number(account.account_number))
+
+
+class CustomerImportTest(TestCase):
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.eur = CurrencyRate.objects.create(currency='EUR', rate=24.5)
+        User.objects.create(username='taken')
+
+    def test_csv_import_creates_customers_with_primary_accounts(self):
+        lines = io.StringIO('username,email,password,accounts\n'
+                            'jana,jana@example.com,842653971lL/,CZK:1500.00;EUR:20.50\n'
+                            'petr,petr@example.com,842653971lL/,EUR:1.00\n'
+                            'taken,,842653971lL/,CZK:1.00\n'
+                            'karel,,842653971lL/,USD:1.00\n'
+                            'jana,,842653971lL/,CZK:1.00\n')
+        progress = []
+        report = import_customers(read_customers(lines, 'csv'), batch_size=2, workers=2,
+                                  progress=lambda read, _: progress.append(read))
+
+        self.assertEqual((report['customers'], report['accounts']), (2, 3))
+        self.assertEqual([(error['row'], error['error']) for error in report['errors']],
+                         [(3, 'Username already exists.'), (4, 'Unknown currency.'), (5, 'Username already exists.')])
+        self.assertEqual(progress, [2, 4, 5])
+
+        jana = UserAccount.objects.select_related('user', 'primary_bank_account__currency').get(user__username='jana')
+        self.assertTrue(jana.user.check_password('842653971lL/'))
+        self.assertEqual(jana.primary_bank_account.currency, self.czk)
+        self.assertEqual(jana.primary_bank_account.balance, Decimal('1500.00'))
+        self.assertTrue(all(is_valid_account_number(account.account_number)
+                            for account in BankAccount.objects.all()))
+        self.assertEqual(verify(), ([], []))
+
+    def test_jsonl_command(self):
+        path = Path(self.enterContext(TemporaryDirectory())) / 'customers.jsonl'
+        path.write_text('{"username": "jana", "password": "842653971lL/", "accounts": [{"currency": "EUR", '
+                        '"balance": "5.00"}]}\nnot json\n', encoding='utf-8')
+        output = io.StringIO()
+        call_command('import_customers', str(path), '--workers', '1', stdout=output, stderr=io.StringIO())
+        self.assertIn('1 customers with 1 accounts imported, 1 rows skipped', output.getvalue())
+        self.assertEqual(BankAccount.objects.get(user_account__user__username='jana').balance, Decimal('5.00'))
+
+    def test_invalid_rows_are_reported_one_by_one(self):
+        rows = [
+            {'username': 'a', 'accounts': 5},
+            {'username': 'b', 'accounts': 'CZK:1.00'},
+            {'username': 'c', 'accounts': [{'currency': 'CZK', 'balance': '1E+30'}]},
+            {'username': 'd', 'accounts': [{'currency': 'CZK', 'balance': '10000000000000.00'}]},
+            {'username': 'e', 'accounts': [{'currency': 'CZK', 'balance': '-1.00'}]},
+            {'username': 'f' * 151},
+            {'username': 'jana novak'},
+            {'username': 'g', 'email': 'not-an-email'},
+            {'username': 'h', 'email': 'h@example.com', 'accounts': [{'currency': 'CZK', 'balance': '99999999999.99'}]},
+        ]
+        report = import_customers(rows, workers=1)
+
+        self.assertEqual([error['error'] for error in report['errors']], [
+            'Invalid accounts.', 'Invalid accounts.', 'Invalid balance.', 'Invalid balance.', 'Invalid balance.',
+            'Invalid username.', 'Invalid username.', 'Invalid email.'])
+        self.assertEqual(report['customers'], 1)
+        self.assertEqual(BankAccount.objects.get(user_account__user__username='h').balance,
+                         Decimal('99999999999.99'))
+
+
+class RateHistoryTest(TestCase):
+    fixture_path = Path(__file__).resolve().parent / 'testdata' / 'rok.txt'
+
+    def setUp(self):
+        with open(self.fixture_path, encoding='utf-8') as lines:
+            self.count = backfill_rates(lines, batch_size=5)
+
+    def test_parse_handles_repeated_headers(self):
+        with open(self.fixture_path, encoding='utf-8') as lines:
+            rates = list(parse_yearly_rates(lines))
+        self.assertEqual(len(rates), 14)
+        self.assertEqual([rate.currency for rate in rates if rate.valid_date == date(2023, 1, 4)],
+                         ['EUR', 'JPY', 'USD', 'XDR'])
+        jpy = next(rate for rate in rates if rate.currency == 'JPY')
+        self.assertEqual((jpy.amount, jpy.rate), (100, 17.257))
+
+    def test_backfill_is_idempotent(self):
+        call_command('backfill_rates', file=[str(self.fixture_path)], stdout=io.StringIO())
+        self.assertEqual(CurrencyRateHistory.objects.count(), self.count)
+
+    def test_rate_as_of_uses_latest_previous_day(self):
+        self.assertEqual(rate_as_of('EUR', date(2023, 1, 3)).rate, 24.165)
+        # No rates were published on 5 January.
+        self.assertEqual(rate_as_of('EUR', date(2023, 1, 5)).rate, 24.240)
+        self.assertIsNone(rate_as_of('XDR', date(2023, 1, 3)))
+        self.assertEqual(rate_as_of('CZK', date(2023, 1, 3)).rate, 1)
+
+    def test_rate_as_of_is_cached(self):
+        rate_as_of('USD', date(2023, 1, 2))
+        with self.assertNumQueries(0):
+            self.assertEqual(rate_as_of('USD', date(2023, 1, 2)).rate, 22.602)
+
+    def test_missing_rate_is_not_cached(self):
+        self.assertIsNone(rate_as_of('GBP', date(2023, 1, 3)))
+        # Backfilled by another process, which cannot clear this one's cache.
+        CurrencyRateHistory.objects.create(currency='GBP', valid_date=date(2023, 1, 2), amount=1, rate=26.9)
+        self.assertEqual(rate_as_of('GBP', date(2023, 1, 3)).rate, 26.9)
+
+    def test_recorded_table_replaces_cached_rate(self):
+        self.assertEqual(rate_as_of('EUR', date(2023, 1, 3)).rate, 24.165)
+        record_rate_history((Currency('EMU', 'euro', 1, 'EUR', 24.2, date(2023, 1, 3)),))
+        self.assertEqual(rate_as_of('EUR', date(2023, 1, 3)).rate, 24.2)
+
+    @patch('bank.tasks.cnb_today', Mock(return_value=date(2023, 1, 9)))
+    @patch('bank.tasks.rate_provider')
+    def test_task_records_daily_table(self, mock_provider):
+        mock_provider.return_value.fetch.return_value = (Currency('EMU', 'euro', 1, 'EUR', 24.3, date(2023, 1, 9)),)
+        update_currency_rates()
+        self.assertEqual(rate_as_of('EUR', date(2023, 1, 10)).rate, 24.3)
+
+
+class TransferServiceTest(TestCase):
+    def setUp(self):
+        self.currency = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.source = BankAccount.objects.create(user_account=UserAccount.objects.create(user=User.objects.create(
+            username='source')), balance=Decimal('100.00'), currency=self.currency)
+        self.target = BankAccount.objects.create(user_account=UserAccount.objects.create(user=User.objects.create(
+            username='target')), balance=Decimal('0.00'), currency=self.currency)
+
+    def test_transfer_with_overdraft_fee(self):
+        transaction = transfer(self.source, self.target, Decimal('110'), Decimal('110'), Decimal('110'),
+                               self.currency)
+        self.source.refresh_from_db()
+        self.target.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('-11.00'))
+        self.assertEqual(self.target.balance, Decimal('110.00'))
+        self.assertEqual(transaction.overdraft_fee, Decimal('1.00'))
+        self.assertEqual(transaction.type, TypeOfTransaction.TRA)
+
+    def test_transfer_uses_current_balance_not_stale_instance(self):
+        BankAccount.objects.filter(pk=self.source.pk).update(balance=Decimal('10.00'))
+        with self.assertRaises(InsufficientFunds):
+            transfer(self.source, self.target, Decimal('50'), Decimal('50'), Decimal('50'), self.currency)
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.balance, Decimal('0.00'))
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_withdraw_without_overdraft(self):
+        with self.assertRaises(InsufficientFunds):
+            withdraw(self.source, Decimal('100.01'), Decimal('100.01'), self.currency)
+        withdraw(self.source, Decimal('100'), Decimal('100'), self.currency)
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('0.00'))
+
+
+class LedgerTest(TestCase):
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.eur = CurrencyRate.objects.create(currency='EUR', rate=25.0)
+        user_account = UserAccount.objects.create(user=User.objects.create(username='ledger'))
+        self.source = BankAccount.objects.create(user_account=user_account, balance=Decimal('0.00'),
+                                                 currency=self.czk)
+        self.target = BankAccount.objects.create(user_account=user_account, balance=Decimal('0.00'),
+                                                 currency=self.eur)
+
+    def test_operations_post_balanced_entries(self):
+        deposit(self.source, Decimal('100'), Decimal('100'), self.czk)
+        payment = transfer(self.source, self.target, Decimal('105'), Decimal('4.20'), Decimal('105'), self.czk)
+        withdraw(self.target, Decimal('1.20'), Decimal('1.20'), self.eur)
+
+        self.assertEqual(verify(), ([], []))
+        postings = {(posting.account_id, posting.system_account, posting.currency.currency): posting.amount
+                    for posting in payment.postings.select_related('currency')}
+        self.assertEqual(postings, {
+            (self.source.pk, None, 'CZK'): Decimal('-105.50'),
+            (self.target.pk, None, 'EUR'): Decimal('4.20'),
+            (None, LedgerSystemAccount.FEES, 'CZK'): Decimal('0.50'),
+            (None, LedgerSystemAccount.FX, 'CZK'): Decimal('105.00'),
+            (None, LedgerSystemAccount.FX, 'EUR'): Decimal('-4.20'),
+        })
+
+    def test_postings_are_append_only(self):
+        deposit(self.source, Decimal('10'), Decimal('10'), self.czk)
+        posting = LedgerPosting.objects.first()
+        posting.amount = Decimal('20')
+        with self.assertRaises(TypeError):
+            posting.save()
+        with self.assertRaises(TypeError):
+            LedgerPosting.objects.update(amount=0)
+        with self.assertRaises(TypeError):
+            LedgerPosting.objects.all().delete()
+
+    def test_history_cannot_be_deleted_through_cascades(self):
+        deposit(self.source, Decimal('10'), Decimal('10'), self.czk)
+        for instance in (self.source.user_account.user, self.source, self.czk, Transaction.objects.get()):
+            with self.assertRaises(ProtectedError):
+                instance.delete()
+        self.assertEqual(LedgerPosting.objects.count(), 2)
+
+        self.target.delete()
+        self.assertFalse(BankAccount.objects.filter(pk=self.target.pk).exists())
+
+    def test_backfill_and_rebuild(self):
+        BankAccount.objects.filter(pk=self.source.pk).update(balance=Decimal('50.00'))
+        Transaction.objects.create(source_account=self.source, destination_account=self.source, amount=20,
+                                   currency=self.czk, type=TypeOfTransaction.DEP, destination_amount=20)
+        self.assertEqual(verify()[1], [(self.source.pk, Decimal('50.00'), Decimal('0'))])
+
+        self.assertEqual(backfill(), (1, 1))
+        self.assertEqual(verify(), ([], []))
+        self.assertEqual(backfill(), (0, 0))
+
+        # A drifted balance is restored from the postings.
+        BankAccount.objects.filter(pk=self.source.pk).update(balance=Decimal('7.00'))
+        output = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command('ledger', 'verify', stdout=output)
+        self.assertEqual(rebuild(), 1)
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.balance, Decimal('50.00'))
+        call_command('ledger', 'verify', stdout=output)
+
+
+class ReconciliationTest(TestCase):
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.eur = CurrencyRate.objects.create(currency='EUR', rate=25.0)
+        user_account = UserAccount.objects.create(user=User.objects.create(username='audit'))
+        self.accounts = [BankAccount.objects.create(user_account=user_account, balance=Decimal('0.00'),
+                                                    currency=self.czk, account_number=str(number))
+                         for number in range(5)]
+        self.eur_account = BankAccount.objects.create(user_account=user_account, balance=Decimal('100.00'),
+                                                      currency=self.eur, account_number='5')
+        LedgerPosting.objects.bulk_create(opening_postings(self.eur_account, Decimal('100.00')))
+
+    def test_matching_history_has_no_discrepancies(self):
+        deposit(self.accounts[0], Decimal('100'), Decimal('100'), self.czk)
+        transfer(self.accounts[0], self.accounts[4], Decimal('105'), Decimal('105'), Decimal('105'), self.czk)
+        transfer(self.eur_account, self.accounts[1], Decimal('2'), Decimal('50'), Decimal('2'), self.eur)
+        # A row from before the account amounts were recorded, entered in EUR on a CZK account.
+        CurrencyRateHistory.objects.create(currency='EUR', valid_date=date(2000, 1, 1), rate=25.0)
+        CurrencyRateHistory.objects.create(currency='CZK', valid_date=date(2000, 1, 1), rate=1.0)
+        Transaction.objects.create(source_account=self.accounts[2], destination_account=self.accounts[2],
+                                   amount=Decimal('1'), currency=self.eur, type=TypeOfTransaction.DEP)
+        BankAccount.objects.filter(pk=self.accounts[2].pk).update(balance=Decimal('25.00'))
+
+        output = io.StringIO()
+        summary = reconcile(output, shard_size=2, workers=1)
+        self.assertEqual((summary['accounts'], summary['discrepancies'], summary['shards']), (6, 0, 3))
+        self.assertEqual(output.getvalue().splitlines(), [','.join(REPORT_FIELDS)])
+
+    def test_drifted_balances_are_reported(self):
+        deposit(self.accounts[3], Decimal('10'), Decimal('10'), self.czk)
+        BankAccount.objects.filter(pk=self.accounts[3].pk).update(balance=Decimal('12.50'))
+        path = Path(self.enterContext(TemporaryDirectory())) / 'discrepancies.csv'
+        with self.assertRaises(CommandError):
+            call_command('reconcile', '--output', str(path), '--shard-size', '4', '--workers', '1',
+                         stdout=io.StringIO())
+        rows = list(csv.DictReader(path.open(encoding='utf-8')))
+        self.assertEqual([(row['account_number'], row['expected'], row['difference']) for row in rows],
+                         [('3', '10.00', '2.50')])
+
+
+class TransferConcurrencyTest(TransactionTestCase):
+    def test_no_lost_updates_with_parallel_writers(self):
+        report = run_transfer_stress(writers=4, transfers=25, accounts=3)
+        self.assertEqual(report['succeeded'], 100)
+        self.assertEqual(report['recorded_transactions'], 100)
+        self.assertEqual(report['lost_updates'], 0)
+
+
+class EndpointBenchmarkTest(TransactionTestCase):
+    def test_benchmark_reports_every_endpoint(self):
+        with isolated_cache():
+            user_ids = seed_dataset(users=4, accounts_per_user=2, transactions=30, seed=1)
+            self.assertEqual(Transaction.objects.count(), 30)
+            planned = endpoint_requests(user_ids, 3, seed=1)
+            self.assertEqual(planned, endpoint_requests(user_ids, 3, seed=1))
+
+            client = run_client_benchmark(planned)
+            http = run_http_benchmark(planned, concurrency=2)
+
+        for endpoint in ('dashboard', 'transaction', 'withdraw', 'recharge'):
+            self.assertEqual(client[endpoint]['requests'], 3)
+            self.assertGreater(client[endpoint]['queries_per_request'], 0)
+            self.assertLessEqual(client[endpoint]['p50_ms'], client[endpoint]['p99_ms'])
+            self.assertEqual(http[endpoint]['errors'], 0)
+        self.assertEqual(Transaction.objects.filter(type=TypeOfTransaction.DEP).count(), 6)
+
+
+class BulkTransferTest(TestCase):
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.eur = CurrencyRate.objects.create(currency='EUR', rate=25.0)
+        self.user = User.objects.create_user(username='payroll', password='842653971lL/')
+        self.user_account = UserAccount.objects.create(user=self.user, otp_enabled=True)
+        self.payer = BankAccount.objects.create(user_account=self.user_account, balance=Decimal('1000.00'),
+                                                currency=self.czk, account_number='10000000001')
+        other = UserAccount.objects.create(user=User.objects.create(username='employee'))
+        self.employees = [BankAccount.objects.create(user_account=other, balance=Decimal('0.00'), currency=currency,
+                                                     account_number=f'2000000000{index}')
+                          for index, currency in enumerate((self.czk, self.eur))]
+
+    def row(self, target, amount, currency='CZK', source='10000000001'):
+        return {'source_account': source, 'target_account': target, 'amount': amount, 'currency': currency}
+
+    def test_parse_csv_and_json(self):
+        csv_rows = parse_batch(b'source_account,target_account,amount,currency\n1,2,10.00,CZK\n', 'csv')
+        json_rows = parse_batch('{"transfers": [{"source_account": "1", "target_account": "2", "amount": "10.00", '
+                                '"currency": "CZK"}]}', 'json')
+        self.assertEqual(csv_rows, json_rows)
+
+        with self.assertRaisesRegex(BatchError, 'Invalid CSV'):
+            parse_batch('source_account\n"' + 'x' * (csv.field_size_limit() + 1) + '"\n', 'csv')
+
+    def test_batch_applies_valid_rows_and_reports_errors(self):
+        results = execute_batch([
+            self.row('20000000000', '100.00'),
+            self.row('20000000001', '2.00', currency='EUR'),
+            self.row('99999999990', '1.00'),
+            self.row('20000000000', '-5'),
+            self.row('20000000000', '5000.00'),
+            self.row('20000000000', '1E+30'),
+            self.row('20000000000', '10000000000000.00'),
+            self.row('20000000000', 'NaN'),
+        ], user_account=self.user_account)
+
+        self.assertEqual([result['status'] for result in results], ['ok', 'ok'] + ['error'] * 6)
+        self.assertEqual(results[2]['error'], 'Unknown target account.')
+        self.assertEqual(results[4]['error'], 'Insufficient funds.')
+        self.assertEqual({result['error'] for result in results[5:]}, {'Invalid amount.'})
+        self.payer.refresh_from_db()
+        self.assertEqual(self.payer.balance, Decimal('850.00'))
+        self.assertEqual(BankAccount.objects.get(pk=self.employees[1].pk).balance, Decimal('2.00'))
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        rate_matrix()
+        with self.assertNumQueries(8):
+            execute_batch([self.row('20000000000', '1.00') for _ in range(50)])
+        self.assertEqual(Transaction.objects.count(), 50)
+
+    def test_source_must_belong_to_user(self):
+        results = execute_batch([self.row('10000000001', '1.00', source='20000000000')],
+                                user_account=self.user_account)
+        self.assertEqual(results[0]['error'], 'Unknown source account.')
+
+    def test_mistyped_account_numbers_are_reported(self):
+        results = execute_batch([self.row('99999999999', '1.00'),
+                                 self.row('20000000000', '1.00', source='19999999999')], user_account=self.user_account)
+        self.assertEqual([result['error'] for result in results],
+                         ['Wrong target account number.', 'Wrong source account number.'])
+
+    def test_endpoint(self):
+        verified_login(self.client, self.user)
+        response = self.client.post(reverse('bank:bulk_transfer'),
+                                    'source_account,target_account,amount,currency\n'
+                                    '10000000001,20000000000,10.00,CZK\n', content_type='text/csv')
+        self.assertEqual(response.json()['succeeded'], 1)
+        self.assertIn('transaction', response.json()['results'][0])
+
+        response = self.client.post(reverse('bank:bulk_transfer'), 'source_account\nKáťa\n'.encode('cp1250'),
+                                    content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "The batch must be UTF-8 encoded."})
+
+
+class IdempotencyKeyTest(TestCase):
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.user = User.objects.create_user(username='pepa', password='842653971lL/')
+        self.user_account = UserAccount.objects.create(user=self.user, otp_enabled=True)
+        self.account = BankAccount.objects.create(user_account=self.user_account, balance=Decimal('100.00'),
+                                                  currency=self.czk)
+        self.user_account.primary_bank_account = self.account
+        self.user_account.save()
+        verified_login(self.client, self.user)
+
+    def withdraw(self, key):
+        return self.client.post(reverse('bank:withdraw'), {'amount': '10.00', 'currency': self.czk.pk},
+                                HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_is_replayed_without_second_withdrawal(self):
+        first = self.withdraw('retry-1')
+        second = self.withdraw('retry-1')
+
+        self.assertEqual(first.json(), {"success": "Withdrawal was successful."})
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal('90.00'))
+
+    def test_key_reused_for_different_request_is_refused(self):
+        self.withdraw('reused')
+        response = self.client.post(reverse('bank:withdraw'), {'amount': '50.00', 'currency': self.czk.pk},
+                                    HTTP_IDEMPOTENCY_KEY='reused')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(self.withdraw('reused')['Idempotent-Replayed'], 'true')
+
+    def test_retry_with_rotated_csrf_token_is_replayed(self):
+        for token in ('first-token', 'rotated-token'):
+            response = self.client.post(reverse('bank:withdraw'), {'amount': '10.00', 'currency': self.czk.pk,
+                                                                   'csrfmiddlewaretoken': token},
+                                        HTTP_IDEMPOTENCY_KEY='csrf')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_different_keys_are_separate_requests(self):
+        self.withdraw('a')
+        self.withdraw('b')
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_expired_keys_are_purged(self):
+        self.withdraw('old')
+        IdempotencyKey.objects.update(created_at=datetime(2023, 1, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(purge_idempotency_keys(), 1)
+        self.withdraw('old')
+        self.assertEqual(Transaction.objects.count(), 2)
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        clear_rates_cache()
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.eur = CurrencyRate.objects.create(currency='EUR', rate=25.0)
+        self.user = User.objects.create_user(username='pepa', password='842653971lL/')
+        self.user_account = UserAccount.objects.create(user=self.user, otp_enabled=True, secret_key='JBSWY3DPEHPK3PXP')
+        self.account = BankAccount.objects.create(user_account=self.user_account, balance=Decimal('100.00'),
+                                                  currency=self.czk, account_number='1000000001')
+        self.user_account.primary_bank_account = self.account
+        self.user_account.save()
+        verified_login(self.async_client, self.user)
+
+    def test_money_moving_views_are_async(self):
+        for view in (views.HomeView, views.TransactionView, views.WithdrawalView, views.RechargeView):
+            self.assertTrue(asyncio.iscoroutinefunction(view.as_view()), view)
+
+    @patch('bank.utils.rateCache.rate_provider', return_value=stub_provider((Currency('EMU', 'euro', 1, 'EUR', 25.0),)))
+    async def test_dashboard_and_recharge_through_asgi(self, mock_provider):
+        response = await self.async_client.get(reverse('bank:dashboard'))
+        self.assertContains(response, 'EUR')
+        response = await self.async_client.post(reverse('bank:recharge'), {'amount': '2.00', 'currency': self.eur.pk})
+        self.assertEqual(response.json(), {"success": "Recharge successful."})
+        self.assertEqual((await BankAccount.objects.aget(pk=self.account.pk)).balance, Decimal('150.00'))
+        mock_provider.return_value.aget.assert_awaited_once()
+
+    async def test_anonymous_requests_are_redirected_to_login(self):
+        await sync_to_async(self.async_client.logout)()
+        response = await self.async_client.post(reverse('bank:withdraw'), {'amount': '1.00', 'currency': self.czk.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(await Transaction.objects.aexists())
+
+    async def test_idempotent_retry_of_async_view(self):
+        data = {'amount': '10.00', 'currency': self.czk.pk}
+        first = await self.async_client.post(reverse('bank:withdraw'), data, headers={'Idempotency-Key': 'async-1'})
+        second = await self.async_client.post(reverse('bank:withdraw'), data, headers={'Idempotency-Key': 'async-1'})
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(await Transaction.objects.acount(), 1)
+
+    async def test_async_rate_lookup_fetches_once(self):
+        rates = (Currency('EMU', 'euro', 1, 'EUR', 24.5),)
+        with patch('bank.utils.rateCache.rate_provider', return_value=stub_provider(rates)) as mock_provider:
+            self.assertEqual(await aget_rates(), rates)
+            self.assertEqual(await aget_rates(), rates)
+        mock_provider.return_value.aget.assert_awaited_once()
+        self.assertEqual(await CurrencyRate.objects.filter(currency='EUR').values_list('rate', flat=True).aget(), 24.5)
+
+    async def test_unreachable_cnb_gives_empty_table(self):
+        with patch('bank.utils.cnbCurrencies.httpx.AsyncClient.get', side_effect=httpx.ConnectTimeout('timed out')):
+            self.assertEqual(await CnbClient().aget(), ())
+
+    @override_settings(WHITENOISE_AUTOREFRESH=True, WHITENOISE_USE_FINDERS=True)
+    async def test_static_files_stream_asynchronously(self):
+        response = await self.async_client.get('/static/css/style.css')
+        self.assertTrue(response.is_async)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            content = b''.join([chunk async for chunk in response])
+        self.assertEqual(caught, [])
+        with open(settings.BASE_DIR / 'Banking/static/css/style.css', 'rb') as file:
+            self.assertEqual(content, file.read())
+
+
+class TransactionHistoryTest(TestCase):
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.eur = CurrencyRate.objects.create(currency='EUR', rate=25.0)
+        self.user = User.objects.create_user(username='pepa', password='842653971lL/')
+        self.user_account = UserAccount.objects.create(user=self.user, otp_enabled=True)
+        self.account = BankAccount.objects.create(user_account=self.user_account, balance=Decimal('0'),
+                                                  currency=self.czk, account_number='10000000001')
+        self.user_account.primary_bank_account = self.account
+        self.user_account.save()
+        other = BankAccount.objects.create(user_account=UserAccount.objects.create(user=User.objects.create(
+            username='other')), balance=Decimal('0'), currency=self.czk, account_number='20000000001')
+
+        kinds = [(self.account, other, TypeOfTransaction.TRA), (other, self.account, TypeOfTransaction.TRA),
+                 (self.account, self.account, TypeOfTransaction.DEP), (other, other, TypeOfTransaction.DEP)]
+        Transaction.objects.bulk_create(
+            Transaction(source_account=source, destination_account=destination, type=kind, amount=Decimal(index),
+                        currency=self.eur if index % 5 == 0 else self.czk)
+            for index, (source, destination, kind) in enumerate(kinds * 10))
+        # Several rows share a timestamp, so the id has to break ties.
+        for index, transaction in enumerate(Transaction.objects.order_by('pk')):
+            Transaction.objects.filter(pk=transaction.pk).update(
+                timestamp=datetime(2023, 5, 1 + index // 3, tzinfo=dt_timezone.utc))
+        self.expected = list(Transaction.objects.exclude(source_account=other, destination_account=other)
+                             .order_by('-timestamp', '-pk').values_list('pk', flat=True))
+
+    def test_pages_cover_history_in_order(self):
+        seen, cursor = [], None
+        while True:
+            page, next_cursor = history_page(self.account, limit=7, cursor=cursor and decode_cursor(cursor))
+            seen.extend(transaction.pk for transaction in page)
+            if next_cursor is None:
+                break
+            cursor = next_cursor
+        self.assertEqual(seen, self.expected)
+
+    def test_page_cost_is_constant(self):
+        _, cursor = history_page(self.account, limit=5)
+        with self.assertNumQueries(2):
+            page, _ = history_page(self.account, limit=5, cursor=decode_cursor(cursor))
+            [transaction.destination_account.user_account.user for transaction in page]
+
+    def test_endpoint_filters(self):
+        verified_login(self.client, self.user)
+        response = self.client.get(reverse('bank:transactions'), {'type': 'deposit', 'limit': 100})
+        results = response.json()['results']
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(result['type'] == 'deposit' and result['direction'] == 'in' for result in results))
+
+        response = self.client.get(reverse('bank:transactions'), {'currency': 'EUR', 'limit': 100})
+        self.assertTrue(all(result['currency'] == 'EUR' for result in response.json()['results']))
+
+        response = self.client.get(reverse('bank:transactions'), {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_endpoint_rejects_foreign_account(self):
+        verified_login(self.client, self.user)
+        other = BankAccount.objects.get(account_number='20000000001')
+        response = self.client.get(reverse('bank:transactions'), {'account': other.pk})
+        self.assertEqual(response.status_code, 404)
+
+
+class RecipientSearchTest(TestCase):
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.user = User.objects.create_user(username='pepa', password='842653971lL/')
+        self.user_account = UserAccount.objects.create(user=self.user, otp_enabled=True)
+        self.own = BankAccount.objects.create(user_account=self.user_account, balance=Decimal('100'),
+                                              currency=self.czk, account_number='12300000000')
+        other = UserAccount.objects.create(user=User.objects.create(username='other'))
+        for index in range(15):
+            BankAccount.objects.create(user_account=other, balance=Decimal('0'), currency=self.czk,
+                                       account_number=f'123000000{index + 1:02d}')
+        BankAccount.objects.create(user_account=other, balance=Decimal('0'), currency=self.czk,
+                                   account_number='45600000001')
+
+    def test_search_is_bounded_and_excludes_own_accounts(self):
+        verified_login(self.client, self.user)
+        results = self.client.get(reverse('bank:search_accounts'), {'q': '123'}).json()['results']
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0], {'account_number': '12300000001', 'owner': 'other', 'currency': 'CZK'})
+        self.assertNotIn('12300000000', [result['account_number'] for result in results])
+
+        self.assertEqual(self.client.get(reverse('bank:search_accounts'), {'q': '12'}).json()['results'], [])
+        self.assertEqual(self.client.get(reverse('bank:search_accounts'), {'q': 'abc'}).json()['results'], [])
+
+    def test_form_looks_up_target_by_account_number(self):
+        data = {'target_account': '45600000001', 'amount': '10', 'currency': self.czk.pk}
+        with self.assertNumQueries(2):
+            form = TransactionForm(data, user_account=self.user_account)
+            self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['target_account'].account_number, '45600000001')
+
+        form = TransactionForm(dict(data, target_account='12300000000'), user_account=self.user_account)
+        self.assertFalse(form.is_valid())
+
+    def test_form_reports_mistyped_account_number(self):
+        data = {'amount': '10', 'currency': self.czk.pk}
+        form = TransactionForm(dict(data, target_account='45600000008'), user_account=self.user_account)
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors['target_account'], ['Wrong account number.'])
+
+        # A valid number that no one has is not a typo.
+        form = TransactionForm(dict(data, target_account='45600000009'), user_account=self.user_account)
+        self.assertFalse(form.is_valid())
+        self.assertNotEqual(form.errors['target_account'], ['Wrong account number.'])
+
+    def test_search_reports_mistyped_account_number(self):
+        verified_login(self.client, self.user)
+        self.assertEqual(self.client.get(reverse('bank:search_accounts'), {'q': '45600000008'}).json(),
+                         {'results': [], 'error': 'Wrong account number.'})
+        self.assertEqual(len(self.client.get(reverse('bank:search_accounts'), {'q': '45600000001'}).json()['results']),
+                         1)
+
+
+@patch('bank.views.aget_rates', return_value=[])
+class HomeViewQueryBudgetTest(TestCase):
+    # Session, user, user account, currencies, bank accounts and two history reads.
+    QUERY_BUDGET = 7
+
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.user = User.objects.create_user(username='pepa', password='842653971lL/')
+        self.user_account = UserAccount.objects.create(user=self.user, otp_enabled=True, secret_key='JBSWY3DPEHPK3PXP')
+        self.account = BankAccount.objects.create(user_account=self.user_account, balance=Decimal('100'),
+                                                  currency=self.czk, account_number='10000000001')
+        self.user_account.primary_bank_account = self.account
+        self.user_account.save()
+        self.other = BankAccount.objects.create(user_account=UserAccount.objects.create(user=User.objects.create(
+            username='other')), balance=Decimal('0'), currency=self.czk, account_number='20000000001')
+        verified_login(self.client, self.user)
+        cache.clear()
+
+    def add_data(self, count):
+        start = CurrencyRate.objects.count()
+        for index in range(start, start + count):
+            currency = CurrencyRate.objects.create(currency=f'X{index:02d}', rate=1.0 + index)
+            account = BankAccount.objects.create(user_account=self.user_account, balance=Decimal('0'),
+                                                 currency=currency, account_number=f'300000000{index:02d}')
+            for source, destination in [(self.account, self.other), (self.other, self.account), (account, account)]:
+                Transaction.objects.create(source_account=source, destination_account=destination,
+                                           amount=Decimal('1'), currency=currency, type=TypeOfTransaction.TRA)
+
+    def dashboard_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('bank:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_dashboard_stays_within_budget(self, _):
+        self.add_data(2)
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.client.get(reverse('bank:dashboard'))
+
+    def test_query_count_does_not_grow_with_data(self, _):
+        self.add_data(1)
+        small = self.dashboard_queries()
+        self.add_data(12)
+        self.assertEqual(self.dashboard_queries(), small)
+
+    def test_cached_transactions_are_not_read_again(self, _):
+        self.add_data(1)
+        self.client.get(reverse('bank:dashboard'))
+        with self.assertNumQueries(self.QUERY_BUDGET - 2):
+            self.client.get(reverse('bank:dashboard'))
+
+    def test_transfer_invalidates_cached_transactions(self, _):
+        self.assertNotContains(self.client.get(reverse('bank:dashboard')), 'Deposit:')
+        with self.captureOnCommitCallbacks(execute=True):
+            deposit(self.account, Decimal('42.00'), Decimal('42.00'), self.czk)
+        self.assertContains(self.client.get(reverse('bank:dashboard')), 'Deposit:')
+
+    def test_rates_fragment_follows_rate_version(self, mock_get_rates):
+        mock_get_rates.return_value = [Currency('EMU', 'euro', 1, 'EUR', 24.5)]
+        self.assertContains(self.client.get(reverse('bank:dashboard')), '24.5')
+        mock_get_rates.return_value = [Currency('EMU', 'euro', 1, 'EUR', 24.75)]
+        response = self.client.get(reverse('bank:dashboard'))
+        self.assertContains(response, '24.75')
+        self.assertNotContains(response, '24.5<')
+
+
+class StatementExportTest(TestCase):
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.eur = CurrencyRate.objects.create(currency='EUR', rate=25.0)
+        self.user = User.objects.create_user(username='pepa', password='842653971lL/')
+        self.user_account = UserAccount.objects.create(user=self.user, otp_enabled=True)
+        self.account = BankAccount.objects.create(user_account=self.user_account, balance=Decimal('100.00'),
+                                                  currency=self.czk, account_number='10000000001')
+        self.other = BankAccount.objects.create(user_account=UserAccount.objects.create(user=User.objects.create(
+            username='other')), balance=Decimal('0'), currency=self.eur, account_number='20000000001')
+
+        deposit(self.account, Decimal('50'), Decimal('2'), self.eur)
+        transfer(self.account, self.other, Decimal('160'), Decimal('6.40'), Decimal('160'), self.czk)
+        withdraw(self.other, Decimal('1'), Decimal('1'), self.eur)
+        transfer(self.other, self.account, Decimal('2'), Decimal('50'), Decimal('2'), self.eur)
+        self.account.refresh_from_db()
+        self.timestamps = list(Transaction.objects.order_by('pk').values_list('timestamp', flat=True))
+
+    def test_running_balance_ends_at_current_balance(self):
+        rows = list(statement_rows(self.account))
+        self.assertEqual([row['type'] for row in rows], ['deposit', 'transfer', 'transfer'])
+        self.assertEqual([row['balance'] for row in rows], ['150.00', '-11.00', '39.00'])
+        self.assertEqual(rows[1]['overdraft_fee'], '1.00')
+        self.assertEqual(rows[1]['counterparty'], '20000000001')
+        self.assertEqual(Decimal(rows[-1]['balance']), self.account.balance)
+
+    def test_range_starts_from_balance_at_start(self):
+        rows = list(statement_rows(self.account, start=self.timestamps[1]))
+        self.assertEqual([row['balance'] for row in rows], ['-11.00', '39.00'])
+
+    def test_legacy_rows_are_converted_with_historical_rates(self):
+        Transaction.objects.update(source_amount=None, destination_amount=None)
+        CurrencyRateHistory.objects.create(currency='EUR', valid_date=date(2000, 1, 1), amount=1, rate=25)
+        rows = list(statement_rows(self.account))
+        self.assertEqual(rows[0]['change'], '50.00')
+
+    def test_streaming_csv_endpoint(self):
+        verified_login(self.client, self.user)
+        response = self.client.get(reverse('bank:statement', args=[self.account.pk]), {'format': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'timestamp,id,type,amount,currency,change,overdraft_fee,balance,counterparty')
+        self.assertEqual(len(lines), 4)
+        self.assertFalse(response.is_async)
+
+    async def test_statement_streams_asynchronously_under_asgi(self):
+        await sync_to_async(verified_login)(self.async_client, self.user)
+        response = await self.async_client.get(reverse('bank:statement', args=[self.account.pk]), {'format': 'jsonl'})
+        self.assertTrue(response.is_async)
+        rows = [json.loads(line) async for line in response.streaming_content]
+        self.assertEqual([row['balance'] for row in rows], ['150.00', '-11.00', '39.00'])
+
+    def test_command_writes_jsonl(self):
+        out = io.StringIO()
+        call_command('export_statement', '10000000001', format='jsonl', stdout=out)
+        self.assertEqual([json.loads(line)['balance'] for line in out.getvalue().splitlines()],
+                         ['150.00', '-11.00', '39.00'])
+
+
+class BalanceSnapshotTest(TestCase):
+    def setUp(self):
+        self.czk = CurrencyRate.objects.create(currency='CZK', rate=1.0)
+        self.account = BankAccount.objects.create(user_account=UserAccount.objects.create(user=User.objects.create(
+            username='pepa')), balance=Decimal('100.00'), currency=self.czk)
+        self.other = BankAccount.objects.create(user_account=UserAccount.objects.create(user=User.objects.create(
+            username='other')), balance=Decimal('100.00'), currency=self.czk)
+        self.on_day(1, transfer, self.account, self.other, Decimal('10'), Decimal('10'), Decimal('10'), self.czk)
+        self.on_day(1, deposit, self.account, Decimal('5'), Decimal('5'), self.czk)
+        self.on_day(3, transfer, self.other, self.account, Decimal('20'), Decimal('20'), Decimal('20'), self.czk)
+
+    def on_day(self, day, operation, *args):
+        transaction = operation(*args)
+        Transaction.objects.filter(pk=transaction.pk).update(timestamp=datetime(2023, 5, day, 12,
+                                                                                tzinfo=dt_timezone.utc))
+
+    def test_snapshots_hold_closing_balances(self):
+        self.assertEqual(take_snapshots(until=date(2023, 5, 3)), 4)
+        snapshots = DailyBalanceSnapshot.objects.filter(account=self.account).order_by('date')
+        self.assertEqual([(snapshot.date.day, snapshot.balance) for snapshot in snapshots],
+                         [(1, Decimal('95.00')), (3, Decimal('115.00'))])
+
+    def test_snapshots_are_incremental(self):
+        take_snapshots(until=date(2023, 5, 2))
+        self.assertEqual(take_snapshots(until=date(2023, 5, 2)), 0)
+        self.on_day(4, withdraw, self.account, Decimal('15'), Decimal('15'), self.czk)
+        self.assertEqual(take_snapshots(until=date(2023, 5, 4)), 3)
+        self.assertEqual(DailyBalanceSnapshot.objects.get(account=self.account, date=date(2023, 5, 4)).balance,
+                         Decimal('100.00'))
+
+    def test_balance_as_of(self):
+        take_snapshots(until=date(2023, 5, 1))
+        self.on_day(5, withdraw, self.account, Decimal('15'), Decimal('15'), self.czk)
+        self.account.refresh_from_db()
+
+        with self.assertNumQueries(4):
+            self.assertEqual(balance_as_of(self.account, date(2023, 5, 2)), Decimal('95.00'))
+        self.assertEqual(balance_as_of(self.account, date(2023, 4, 30)), Decimal('100.00'))
+        self.assertEqual(balance_as_of(self.account, date(2023, 5, 3)), Decimal('115.00'))
+        self.assertEqual(balance_as_of(self.account, date(2023, 5, 5)), Decimal('100.00'))
+        self.assertEqual(balance_as_of(self.other, date(2023, 4, 30)), Decimal('100.00'))
+
+    def test_snapshot_agrees_with_statement_on_legacy_rows(self):
+        eur = CurrencyRate.objects.create(currency='EUR', rate=25.0)
+        CurrencyRateHistory.objects.create(currency='EUR', valid_date=date(2023, 1, 2), amount=1, rate=25)
+        self.on_day(2, deposit, self.account, Decimal('50'), Decimal('2'), eur)
+        # Written before the account amounts were recorded: 2 EUR entered, 50 CZK credited.
+        Transaction.objects.filter(currency=eur).update(source_amount=None, destination_amount=None)
+        self.account.refresh_from_db()
+
+        take_snapshots(until=date(2023, 5, 3))
+        statement = [row for row in statement_rows(self.account) if row['timestamp'] < '2023-05-03']
+        snapshot = DailyBalanceSnapshot.objects.get(account=self.account, date=date(2023, 5, 2))
+        self.assertEqual(snapshot.balance, Decimal('145.00'))
+        self.assertEqual(Decimal(statement[-1]['balance']), snapshot.balance)
+        self.assertEqual(balance_as_of(self.account, date(2023, 5, 2)), snapshot.balance)
+
+    def test_balance_endpoint(self):
+        self.account.user_account.otp_enabled = True
+        self.account.user_account.save()
+        verified_login(self.client, self.account.user_account.user)
+        take_snapshots(until=date(2023, 5, 1))
+
+        response = self.client.get(reverse('bank:balance', args=[self.account.pk]), {'date': '2023-05-02'})
+        self.assertEqual(response.json(), {'account': self.account.account_number, 'currency': 'CZK',
+                                           'date': '2023-05-02', 'balance': '95.00'})
+        self.assertEqual(self.client.get(reverse('bank:balance', args=[self.account.pk])).json()['balance'],
+                         '115.00')
+        self.assertEqual(self.client.get(reverse('bank:balance', args=[self.account.pk]),
+                                         {'date': '2.5.2023'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('bank:balance', args=[self.other.pk])).status_code, 404)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,30 +1,94 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
 from django.shortcuts import redirect
 from django.urls import reverse
 
+# The URLs that don't require 2FA
+EXEMPT_URL_NAMES = (
+    'bank:login',
+    'bank:setup_otp',
+    'bank:verify_otp',
+    'bank:register',
+    'bank:check_otp_setup',
+    'accounts:login',
+    'accounts:logout',
+    # Add more URLs to exclude as necessary
+)
+
+OTP_ENABLED_SESSION_KEY = 'otp_enabled'
+OTP_VERIFIED_SESSION_KEY = 'otp_verified_at'
+
+
+def otp_enabled(request):
+    """Return whether the user has set up 2FA, reading the database only once per session."""
+    session = getattr(request, 'session', None)
+    if session is not None and OTP_ENABLED_SESSION_KEY in session:
+        return session[OTP_ENABLED_SESSION_KEY]
+    enabled = request.user.useraccount.otp_enabled
+    remember_otp_enabled(request, enabled)
+    return enabled
+
+
+def remember_otp_enabled(request, enabled):
+    session = getattr(request, 'session', None)
+    if session is not None:
+        session[OTP_ENABLED_SESSION_KEY] = enabled
+
+
+def otp_verified(request):
+    """Return whether this session passed an OTP check within ``OTP_REVERIFY_SECONDS``."""
+    verified_at = getattr(request, 'session', {}).get(OTP_VERIFIED_SESSION_KEY)
+    if verified_at is None:
+        return False
+    return settings.OTP_REVERIFY_SECONDS is None or time.time() - verified_at < settings.OTP_REVERIFY_SECONDS
+
+
+def mark_otp_verified(request):
+    request.session[OTP_VERIFIED_SESSION_KEY] = time.time()
+
+
+def forget_otp_state(sender, request, user, **kwargs):
+    """``user_logged_in`` receiver: a new login has to pass the OTP check again."""
+    request.session.pop(OTP_VERIFIED_SESSION_KEY, None)
+    request.session.pop(OTP_ENABLED_SESSION_KEY, None)
+
 
 class TwoFactorAuthMiddleware:
+    # Async under ASGI, so async views are not pushed onto a thread; process_view still runs in one.
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self._exempt_paths = None
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         response = self.get_response(request)
         return response
 
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    @property
+    def exempt_paths(self):
+        # Reversed on first use rather than in __init__, the URLconf may not be loaded yet at that point.
+        if self._exempt_paths is None:
+            self._exempt_paths = frozenset(reverse(name) for name in EXEMPT_URL_NAMES)
+        return self._exempt_paths
+
     def process_view(self, request, view_func, view_args, view_kwargs):
-        # Exclude the URLs that don't require 2FA
-        exclude_urls = [
-            reverse('bank:login'),
-            reverse('bank:setup_otp'),
-            reverse('bank:verify_otp'),
-            reverse('bank:register'),
-            reverse('bank:check_otp_setup'),
-            reverse('accounts:login'),
-            # Add more URLs to exclude as necessary
-        ]
-
-        if request.path not in exclude_urls:
+        if request.path not in self.exempt_paths:
             # If user is authenticated
             if request.user.is_authenticated:
                 # If user hasn't setup 2FA
-                if not request.user.useraccount.otp_enabled:
+                if not otp_enabled(request):
                     return redirect('bank:setup_otp')
+                # If this session hasn't passed the OTP check yet, or passed it too long ago
+                if not otp_verified(request):
+                    return redirect('bank:verify_otp')
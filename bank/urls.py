@@ -12,6 +12,12 @@ urlpatterns = [
     path('transaction/', views.TransactionView.as_view(), name='transaction'),
     path('withdraw/', views.WithdrawalView.as_view(), name='withdraw'),
     path('recharge/', views.RechargeView.as_view(), name='recharge'),
+    path('search_accounts/', views.RecipientSearchView.as_view(), name='search_accounts'),
+    path('bulk_transfer/', views.BulkTransferView.as_view(), name='bulk_transfer'),
+    path('transactions/', views.TransactionHistoryView.as_view(), name='transactions'),
+    path('valuation/', views.ValuationView.as_view(), name='valuation'),
+    path('statement/<int:account_id>/', views.StatementView.as_view(), name='statement'),
+    path('balance/<int:account_id>/', views.BalanceView.as_view(), name='balance'),
     path('setup_otp/', views.setup_otp, name='setup_otp'),
     path('verify_otp/', views.verify_otp, name='verify_otp'),
     path('register/', RegisterUserView.as_view(), name='register'),
@@ -0,0 +1,95 @@
+"""
+Allocation of account numbers.
+
+An account number is a 10-digit body followed by a Luhn check digit. Bodies come from the
+single ``AccountNumberCounter`` row, which a worker advances by a whole block at a time, so
+handing out a number costs no query until the block runs out. Numbers already taken in a new
+block, e.g. the random ones given out before, are skipped with one range query per block.
+"""
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+
+from bank.models import AccountNumberCounter, BankAccount
+
+FIRST_BODY = 10 ** 9
+LAST_BODY = 10 ** 10 - 1
+ACCOUNT_NUMBER_LENGTH = 11
+
+
+class AccountNumbersExhausted(Exception):
+    pass
+
+
+def luhn_check_digit(body):
+    """Return the Luhn check digit of a string of digits."""
+    total = 0
+    for position, digit in enumerate(reversed(body)):
+        digit = int(digit)
+        if position % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return str((10 - total % 10) % 10)
+
+
+def is_valid_account_number(number):
+    number = str(number)
+    return len(number) == ACCOUNT_NUMBER_LENGTH and number.isdigit() and luhn_check_digit(number[:-1]) == number[-1]
+
+
+def reserve_block(size):
+    """
+    Advance the counter by ``size`` and return the reserved bodies.
+
+    Call it outside other transactions: a reservation rolled back with the caller's
+    transaction would be handed out again while this process still holds it.
+    """
+    with transaction.atomic():
+        counter, _ = AccountNumberCounter.objects.select_for_update().get_or_create(
+            pk=1, defaults={'next_body': FIRST_BODY})
+        start = counter.next_body
+        if start + size - 1 > LAST_BODY:
+            raise AccountNumbersExhausted
+        counter.next_body = start + size
+        counter.save(update_fields=['next_body'])
+    return range(start, start + size)
+
+
+def numbers_in_block(bodies):
+    """Return the account numbers of the reserved bodies that no account uses yet."""
+    numbers = [f'{body}{luhn_check_digit(str(body))}' for body in bodies]
+    taken = set(BankAccount.objects.filter(account_number__range=(f'{bodies[0]}0', f'{bodies[-1]}9'))
+                .values_list('account_number', flat=True))
+    return [number for number in numbers if number not in taken]
+
+
+class AccountNumberAllocator:
+    """Hands out numbers from blocks reserved by this process."""
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size
+        self._numbers = deque()
+        self._lock = threading.Lock()
+
+    def allocate(self, count=1):
+        """Return ``count`` unused account numbers."""
+        with self._lock:
+            while len(self._numbers) < count:
+                block_size = max(self.block_size or settings.ACCOUNT_NUMBER_BLOCK_SIZE, count - len(self._numbers))
+                self._numbers.extend(numbers_in_block(reserve_block(block_size)))
+            return [self._numbers.popleft() for _ in range(count)]
+
+
+_allocator = AccountNumberAllocator()
+
+
+def allocate_account_number():
+    return _allocator.allocate()[0]
+
+
+def allocate_account_numbers(count):
+    return _allocator.allocate(count)
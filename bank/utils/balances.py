@@ -0,0 +1,188 @@
+"""
+Balance changes derived from ``Transaction`` rows.
+
+A transaction takes ``source_amount`` plus ``overdraft_fee`` from the source account and adds
+``destination_amount`` to the destination account. Deposits and withdrawals have the same
+account on both sides, and only their credit or their debit applies. Rows written before
+these amounts were recorded fall back to the entered ``amount``, converted with the rates
+valid on their day. Aggregates sum the other rows in SQL and convert these few one by one,
+so snapshots, statements and reconciliation agree on every row.
+
+``DailyBalanceSnapshot`` rows hold the closing balance of every day on which an account
+changed, so a past balance is one snapshot plus the few transactions after it.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import F, Max, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from bank.models import BankAccount, DailyBalanceSnapshot, Transaction, TypeOfTransaction
+from bank.utils.rateHistory import rate_as_of
+
+ZERO = Decimal('0')
+BATCH_SIZE = 1000
+
+CREDITED = Coalesce('destination_amount', 'amount')
+DEBITED = Coalesce('source_amount', 'amount') + F('overdraft_fee')
+
+# Rows whose change of some account can only be computed with the rates of their day.
+NEEDS_CONVERSION = (
+    (Q(source_amount__isnull=True) & ~Q(type=TypeOfTransaction.DEP) & ~Q(currency=F('source_account__currency')))
+    | (Q(destination_amount__isnull=True) & ~Q(type=TypeOfTransaction.WIT)
+       & ~Q(currency=F('destination_account__currency')))
+)
+
+
+def balance_change(account, since=None, until=None):
+    """Return the total change of the account's balance from transactions in ``[since, until)``."""
+    transactions = Transaction.objects.all()
+    if since is not None:
+        transactions = transactions.filter(timestamp__gte=since)
+    if until is not None:
+        transactions = transactions.filter(timestamp__lt=until)
+    return changes_by_account(transactions, account_ids=[account.pk]).get(account.pk, ZERO)
+
+
+def changes_by_account(transactions, by_day=False, account_range=None, account_ids=None):
+    """
+    Sum the balance changes caused by ``transactions`` per account id, or per
+    ``(account id, date)`` with ``by_day``, using two grouped queries and one for the rows
+    that need converting.
+
+    ``account_range`` is an optional ``(first, last)`` pair of account ids and ``account_ids``
+    an optional list of them to limit the sums to.
+    """
+    keys = ('account', 'day') if by_day else ('account',)
+    recorded = transactions.exclude(NEEDS_CONVERSION)
+    sides = (
+        ('destination_account', recorded.exclude(type=TypeOfTransaction.WIT), CREDITED, 1),
+        ('source_account', recorded.exclude(type=TypeOfTransaction.DEP), DEBITED, -1),
+    )
+    changes = defaultdict(Decimal)
+    for field, side, amount, sign in sides:
+        side = side.filter(_accounts(field, account_range, account_ids)).annotate(account=F(field))
+        if by_day:
+            side = side.annotate(day=TruncDate('timestamp'))
+        for row in side.order_by().values(*keys).annotate(total=Sum(amount)):
+            changes[tuple(row[key] for key in keys) if by_day else row['account']] += sign * row['total']
+
+    legacy = (transactions.filter(NEEDS_CONVERSION)
+              .filter(_accounts('source_account', account_range, account_ids)
+                      | _accounts('destination_account', account_range, account_ids))
+              .select_related('currency', 'source_account__currency', 'destination_account__currency'))
+    wanted = set(account_ids) if account_ids is not None else None
+    for item in legacy.iterator():
+        for account in {item.source_account, item.destination_account}:
+            if account_range is not None and not account_range[0] <= account.pk <= account_range[1]:
+                continue
+            if wanted is not None and account.pk not in wanted:
+                continue
+            key = (account.pk, timezone.localtime(item.timestamp).date()) if by_day else account.pk
+            changes[key] += transaction_change(item, account)
+    return changes
+
+
+def _accounts(field, account_range, account_ids):
+    condition = Q()
+    if account_range is not None:
+        condition &= Q(**{f'{field}__gte': account_range[0], f'{field}__lte': account_range[1]})
+    if account_ids is not None:
+        condition &= Q(**{f'{field}__in': account_ids})
+    return condition
+
+
+def transaction_change(transaction, account):
+    """Return how much ``transaction`` changed the balance of ``account``."""
+    change = ZERO
+    if transaction.destination_account_id == account.pk and transaction.type != TypeOfTransaction.WIT:
+        change += _account_amount(transaction, transaction.destination_amount, account)
+    if transaction.source_account_id == account.pk and transaction.type != TypeOfTransaction.DEP:
+        change -= _account_amount(transaction, transaction.source_amount, account) + transaction.overdraft_fee
+    return change
+
+
+def _account_amount(transaction, recorded, account):
+    if recorded is not None:
+        return recorded
+    if transaction.currency_id == account.currency_id:
+        return transaction.amount
+    on_date = transaction.timestamp.date()
+    rate_from = rate_as_of(transaction.currency.currency, on_date)
+    rate_to = rate_as_of(account.currency.currency, on_date)
+    if rate_from is None or rate_to is None:
+        return transaction.amount
+    unit_from = Decimal(str(rate_from.rate)) / rate_from.amount
+    unit_to = Decimal(str(rate_to.rate)) / rate_to.amount
+    return (transaction.amount * unit_from / unit_to).quantize(Decimal('0.01'))
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def take_snapshots(until=None):
+    """
+    Store closing balances for the days after the latest snapshot up to ``until``.
+
+    ``until`` defaults to yesterday, the last day that can no longer change. Only the
+    transactions since the latest snapshot are read. Returns the number of snapshots written.
+    """
+    until = until or timezone.localdate() - timedelta(days=1)
+    latest = DailyBalanceSnapshot.objects.aggregate(latest=Max('date'))['latest']
+    if latest is not None and latest >= until:
+        return 0
+    since = day_start(latest + timedelta(days=1)) if latest is not None else None
+
+    window = Transaction.objects.filter(timestamp__lt=day_start(until + timedelta(days=1)))
+    if since is not None:
+        window = window.filter(timestamp__gte=since)
+    daily_changes = changes_by_account(window, by_day=True)
+    balances = _balances_before(sorted({account_id for account_id, _ in daily_changes}), since)
+
+    snapshots = []
+    for account_id, day in sorted(daily_changes):
+        balances[account_id] += daily_changes[account_id, day]
+        snapshots.append(DailyBalanceSnapshot(account_id=account_id, date=day, balance=balances[account_id]))
+    DailyBalanceSnapshot.objects.bulk_create(snapshots, batch_size=BATCH_SIZE, update_conflicts=True,
+                                             unique_fields=['account', 'date'], update_fields=['balance'])
+    return len(snapshots)
+
+
+def _balances_before(account_ids, since):
+    """Balances at ``since``: the latest snapshot, or for new accounts the current balance minus later changes."""
+    balances = {}
+    latest_snapshot = DailyBalanceSnapshot.objects.filter(account=OuterRef('pk')).order_by('-date').values('balance')
+    for start in range(0, len(account_ids), BATCH_SIZE):
+        accounts = BankAccount.objects.filter(pk__in=account_ids[start:start + BATCH_SIZE])
+        balances.update((pk, (balance, snapshot)) for pk, balance, snapshot in accounts.annotate(
+            snapshot=Subquery(latest_snapshot[:1])).values_list('pk', 'balance', 'snapshot'))
+
+    new_accounts = [pk for pk, (_, snapshot) in balances.items() if snapshot is None]
+    later = Transaction.objects.filter(timestamp__gte=since) if since is not None else Transaction.objects.all()
+    later_changes = {}
+    for start in range(0, len(new_accounts), BATCH_SIZE):
+        later_changes.update(changes_by_account(later, account_ids=new_accounts[start:start + BATCH_SIZE]))
+    return {pk: snapshot if snapshot is not None else balance - later_changes.get(pk, ZERO)
+            for pk, (balance, snapshot) in balances.items()}
+
+
+def balance_as_of(account, on_date):
+    """
+    Return the balance of the account at the end of ``on_date``.
+
+    Reads the nearest snapshot and applies the transactions between it and the date.
+    """
+    end = day_start(on_date + timedelta(days=1))
+    snapshots = account.balance_snapshots.all()
+    previous = snapshots.filter(date__lte=on_date).order_by('-date').first()
+    if previous is not None:
+        return previous.balance + balance_change(account, since=day_start(previous.date + timedelta(days=1)),
+                                                 until=end)
+    following = snapshots.filter(date__gt=on_date).order_by('date').first()
+    if following is not None:
+        return following.balance - balance_change(account, since=end,
+                                                  until=day_start(following.date + timedelta(days=1)))
+    return account.balance - balance_change(account, since=end)
@@ -0,0 +1,296 @@
+"""
+Helpers for the benchmark management commands.
+
+Benchmarks seed their own data, so the commands run them inside a throwaway test database
+created next to the configured one and never touch real accounts.
+"""
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.handlers import StaticFilesHandler
+from django.db import connection, connections, OperationalError
+from django.test import Client
+from django.test.testcases import LiveServerThread
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from bank.models import BankAccount, CurrencyRate, Transaction, UserAccount, TypeOfTransaction
+from bank.twoFactorMiddleWare import OTP_ENABLED_SESSION_KEY, OTP_VERIFIED_SESSION_KEY
+from bank.utils.accountNumbers import allocate_account_numbers
+from bank.utils.cnbCurrencies import Currency, ingestRates
+from bank.utils.rateCache import store_rates
+from bank.utils.transfers import transfer
+
+MAX_RETRIES = 50
+
+BENCH_RATES = (Currency('EMU', 'euro', 1, 'EUR', 24.525), Currency('USA', 'dolar', 1, 'USD', 22.681),
+               Currency('Japonsko', 'jen', 100, 'JPY', 15.112))
+ENDPOINTS = ('dashboard', 'transaction', 'withdraw', 'recharge')
+
+
+@contextmanager
+def temporary_database(verbosity=0):
+    """Run the block against a freshly created test database and destroy it afterwards."""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+
+
+@contextmanager
+def isolated_cache():
+    """Keep the seeded rates and fragment versions out of the configured cache."""
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                               'LOCATION': 'benchmark'}}):
+        yield
+
+
+def run_transfer_stress(writers=8, transfers=100, accounts=4, seed=0):
+    """
+    Run ``writers`` threads that each make ``transfers`` random transfers of 1 CZK between
+    ``accounts`` accounts, then compare every balance with the transfers that succeeded.
+
+    Returns a report; ``lost_updates`` is the number of accounts whose balance does not match.
+    """
+    czk, _ = CurrencyRate.objects.get_or_create(currency='CZK', defaults={'rate': 1})
+    user = User.objects.create(username=f'stress-{seed}-{time.time_ns()}')
+    user_account = UserAccount.objects.create(user=user)
+    initial_balance = Decimal(writers * transfers)
+    account_ids = [BankAccount.objects.create(user_account=user_account, balance=initial_balance, currency=czk).pk
+                   for _ in range(accounts)]
+
+    results = []
+    threads = [threading.Thread(target=_stress_writer, args=(index, account_ids, transfers, seed, czk, results))
+               for index in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    expected = Counter({account_id: initial_balance for account_id in account_ids})
+    for result in results:
+        expected.update(result['deltas'])
+    balances = dict(BankAccount.objects.filter(pk__in=account_ids).values_list('pk', 'balance'))
+    succeeded = sum(result['succeeded'] for result in results)
+
+    return {
+        'writers': writers,
+        'transfers': writers * transfers,
+        'succeeded': succeeded,
+        'failed': sum(result['failed'] for result in results),
+        'retries': sum(result['retries'] for result in results),
+        'seconds': round(elapsed, 3),
+        'transfers_per_second': round(succeeded / elapsed, 1) if elapsed else None,
+        'recorded_transactions': Transaction.objects.filter(source_account__in=account_ids).count(),
+        'lost_updates': sum(1 for account_id in account_ids if balances[account_id] != expected[account_id]),
+    }
+
+
+def _stress_writer(index, account_ids, transfers, seed, currency, results):
+    rng = random.Random(seed * 1000 + index)
+    one = Decimal('1.00')
+    result = {'deltas': Counter(), 'succeeded': 0, 'failed': 0, 'retries': 0}
+    try:
+        for _ in range(transfers):
+            source_id, target_id = rng.sample(account_ids, 2)
+            for _ in range(MAX_RETRIES):
+                try:
+                    transfer(BankAccount(pk=source_id), BankAccount(pk=target_id), one, one, one, currency)
+                    break
+                except OperationalError:
+                    # Deadlock or, on SQLite, a locked database: the transaction was rolled back.
+                    result['retries'] += 1
+                    time.sleep(rng.uniform(0, 0.01))
+            else:
+                result['failed'] += 1
+                continue
+            result['deltas'][source_id] -= one
+            result['deltas'][target_id] += one
+            result['succeeded'] += 1
+    finally:
+        connection.close()
+        results.append(result)
+
+
+def seed_dataset(users=100, accounts_per_user=2, transactions=10000, seed=0):
+    """
+    Create ``users`` customers with 2FA set up, ``accounts_per_user`` accounts each (the first
+    in CZK and primary) and ``transactions`` random transfers between them.
+
+    Returns the ids of the users. The same seed always gives the same dataset.
+    """
+    rng = random.Random(seed)
+    ingestRates(BENCH_RATES)
+    store_rates(BENCH_RATES)
+    currencies = list(CurrencyRate.objects.order_by('currency'))
+    czk = next(currency for currency in currencies if currency.currency == 'CZK')
+    others = [currency for currency in currencies if currency != czk]
+
+    password = make_password('benchmark')
+    created = User.objects.bulk_create([User(username=f'bench-{seed}-{index}', password=password)
+                                        for index in range(users)])
+    user_accounts = UserAccount.objects.bulk_create([UserAccount(user=user, otp_enabled=True,
+                                                                 secret_key='JBSWY3DPEHPK3PXP') for user in created])
+    numbers = iter(allocate_account_numbers(users * accounts_per_user))
+    accounts = BankAccount.objects.bulk_create([
+        BankAccount(user_account=user_account, currency=czk if index == 0 else others[(index - 1) % len(others)],
+                    balance=Decimal(rng.randint(10 ** 5, 10 ** 7)), account_number=next(numbers))
+        for user_account in user_accounts for index in range(accounts_per_user)])
+    for user_account, account in zip(user_accounts, accounts[::accounts_per_user]):
+        user_account.primary_bank_account = account
+    UserAccount.objects.bulk_update(user_accounts, ['primary_bank_account'])
+
+    batch = []
+    for _ in range(transactions):
+        source, target = rng.sample(accounts, 2)
+        amount = Decimal(rng.randint(1, 10 ** 5)) / 100
+        batch.append(Transaction(source_account=source, destination_account=target, amount=amount,
+                                 currency=source.currency, type=TypeOfTransaction.TRA, source_amount=amount,
+                                 destination_amount=amount))
+    Transaction.objects.bulk_create(batch, batch_size=1000)
+    return [user.pk for user in created]
+
+
+def verified_client(user):
+    """Return a test client logged in as ``user`` with a session that passed the OTP check."""
+    client = Client()
+    client.force_login(user)
+    session = client.session
+    session[OTP_ENABLED_SESSION_KEY] = True
+    session[OTP_VERIFIED_SESSION_KEY] = time.time()
+    session.save()
+    return client
+
+
+def endpoint_requests(user_ids, count, seed=0):
+    """Return ``count`` deterministic ``(user_id, endpoint, method, data)`` requests for every endpoint."""
+    rng = random.Random(seed)
+    czk = CurrencyRate.objects.get(currency='CZK')
+    numbers = dict(BankAccount.objects.filter(user_account__user__in=user_ids, currency=czk).values_list(
+        'user_account__user', 'account_number'))
+    planned = {}
+    for endpoint in ENDPOINTS:
+        planned[endpoint] = []
+        for _ in range(count):
+            user_id, other_id = rng.sample(user_ids, 2)
+            data = {'amount': f'{rng.randint(1, 500)}.00', 'currency': czk.pk}
+            if endpoint == 'transaction':
+                data['target_account'] = numbers[other_id]
+            planned[endpoint].append((user_id, 'get' if endpoint == 'dashboard' else 'post', data))
+    return planned
+
+
+def summarize(latencies, elapsed, queries=None):
+    """Latency percentiles in milliseconds and throughput of one endpoint."""
+    ordered = sorted(latencies)
+
+    def percentile(share):
+        return round(ordered[min(len(ordered) - 1, int(share * len(ordered)))] * 1000, 2)
+
+    summary = {
+        'requests': len(ordered),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'requests_per_second': round(len(ordered) / elapsed, 1) if elapsed else None,
+    }
+    if queries is not None:
+        summary['queries_per_request'] = round(sum(queries) / len(queries), 2)
+    return summary
+
+
+def run_client_benchmark(planned):
+    """Drive the views in-process with the test client, counting the queries of every request."""
+    clients = {}
+    report = {}
+    for endpoint, calls in planned.items():
+        url = reverse(f'bank:{endpoint}')
+        latencies, queries = [], []
+        started = time.perf_counter()
+        for user_id, method, data in calls:
+            if user_id not in clients:
+                clients[user_id] = verified_client(User.objects.get(pk=user_id))
+            request = getattr(clients[user_id], method)
+            with CaptureQueriesContext(connection) as captured:
+                began = time.perf_counter()
+                request(url, data if method == 'post' else None)
+                latencies.append(time.perf_counter() - began)
+            queries.append(len(captured))
+        report[endpoint] = summarize(latencies, time.perf_counter() - started, queries)
+    return report
+
+
+@contextmanager
+def live_server():
+    """Serve the project over HTTP from a background thread, like ``LiveServerTestCase``."""
+    # An in-memory SQLite database only exists in this connection, the server thread has to share it.
+    shared = {conn.alias: conn for conn in connections.all()
+              if conn.vendor == 'sqlite' and conn.is_in_memory_db()}
+    for conn in shared.values():
+        conn.inc_thread_sharing()
+    server = LiveServerThread('localhost', StaticFilesHandler, connections_override=shared)
+    server.daemon = True
+    server.start()
+    server.is_ready.wait()
+    try:
+        if server.error:
+            raise server.error
+        yield f'http://localhost:{server.port}', bool(shared)
+    finally:
+        server.terminate()
+        for conn in shared.values():
+            conn.dec_thread_sharing()
+
+
+def run_http_benchmark(planned, concurrency=8):
+    """
+    Send the planned requests over HTTP from ``concurrency`` threads, one endpoint after another.
+
+    With an in-memory SQLite database every request goes through one shared connection, so
+    the requests are sent one at a time.
+    """
+    users = {user.pk: user for user in User.objects.filter(pk__in={call[0] for calls in planned.values()
+                                                                   for call in calls})}
+    cookies = {user_id: verified_client(user).cookies[settings.SESSION_COOKIE_NAME].value
+               for user_id, user in users.items()}
+    with live_server() as (base_url, serialized):
+        concurrency = 1 if serialized else concurrency
+        local = threading.local()
+
+        def send(url, call):
+            user_id, method, data = call
+            if not hasattr(local, 'sessions'):
+                local.sessions = {}
+            session = local.sessions.get(user_id)
+            if session is None:
+                session = local.sessions[user_id] = requests.Session()
+                session.cookies.set(settings.SESSION_COOKIE_NAME, cookies[user_id])
+                # The dashboard sets the CSRF cookie the forms are posted with.
+                session.get(base_url + reverse('bank:dashboard'))
+            began = time.perf_counter()
+            response = session.request(method, url, data=data,
+                                       headers={'X-CSRFToken': session.cookies.get('csrftoken', '')})
+            return time.perf_counter() - began, response.status_code
+
+        report = {'concurrency': concurrency}
+        with ThreadPoolExecutor(concurrency) as pool:
+            for endpoint, calls in planned.items():
+                url = base_url + reverse(f'bank:{endpoint}')
+                started = time.perf_counter()
+                results = list(pool.map(lambda call: send(url, call), calls))
+                report[endpoint] = summarize([latency for latency, _ in results], time.perf_counter() - started)
+                report[endpoint]['errors'] = sum(1 for _, status in results if status >= 400)
+    return report
@@ -0,0 +1,169 @@
+"""
+Batches of transfers, e.g. payroll payouts.
+
+A batch is validated in one pass against accounts and rates loaded once for the whole batch.
+The valid rows are then applied in a single database transaction: all involved accounts are
+locked in primary-key order, balances are written back with one ``bulk_update`` and the
+``Transaction`` rows and their ledger postings are inserted with ``bulk_create``.
+"""
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from bank.models import BankAccount, CurrencyRate, Transaction, TypeOfTransaction
+from bank.utils.accountNumbers import is_valid_account_number
+from bank.utils.conversion import rate_matrix
+from bank.utils.fragmentCache import bump_account_versions
+from bank.utils.ledger import record
+from bank.utils.transfers import CENT, fits_balance, is_valid_amount, calculate_overdraft_fee
+
+LOCK_BATCH_SIZE = 500
+WRITE_BATCH_SIZE = 1000
+
+FIELDS = ('source_account', 'target_account', 'amount', 'currency')
+
+
+class BatchError(Exception):
+    pass
+
+
+def parse_batch(data, fmt):
+    """Parse a CSV or JSON batch (a list of rows or ``{"transfers": [...]}``) into a list of dicts."""
+    if isinstance(data, bytes):
+        try:
+            data = data.decode('utf-8')
+        except UnicodeDecodeError:
+            raise BatchError('The batch must be UTF-8 encoded.')
+    if fmt == 'csv':
+        try:
+            return list(csv.DictReader(io.StringIO(data)))
+        except csv.Error as e:
+            raise BatchError(f'Invalid CSV: {e}')
+    try:
+        rows = json.loads(data)
+    except ValueError as e:
+        raise BatchError(f'Invalid JSON: {e}')
+    if isinstance(rows, dict):
+        rows = rows.get('transfers')
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise BatchError('Expected a list of transfers.')
+    return rows
+
+
+def execute_batch(rows, user_account=None):
+    """
+    Validate and apply a batch of transfers and return one result per row.
+
+    Rows reference accounts by ``account_number`` and give the amount in ``currency``. When
+    ``user_account`` is set, every source account must belong to it. Invalid rows are
+    reported and skipped, the rest are applied.
+    """
+    results = [{'row': index, 'status': 'ok'} for index in range(1, len(rows) + 1)]
+    transfers = _clean_rows(rows, results)
+
+    numbers = {number for transfer in transfers.values() for number in (transfer['source'], transfer['target'])}
+    accounts = BankAccount.objects.select_related('currency').in_bulk(numbers, field_name='account_number')
+    rates = {rate.currency: rate for rate in CurrencyRate.objects.all()}
+
+    for index, transfer in list(transfers.items()):
+        error = _check_references(transfer, accounts, rates, user_account)
+        if error:
+            _fail(results, transfers, index, error)
+
+    if transfers:
+        _apply(transfers, accounts, rates, results)
+    return results
+
+
+def _clean_rows(rows, results):
+    transfers = {}
+    for index, row in enumerate(rows, start=1):
+        missing = [field for field in FIELDS if row.get(field) is None or not str(row[field]).strip()]
+        if missing:
+            results[index - 1].update(status='error', error=f'Missing {", ".join(missing)}.')
+            continue
+        try:
+            amount = Decimal(str(row['amount']).strip())
+            valid = amount > 0 and fits_balance(amount)
+        except InvalidOperation:
+            valid = False
+        if not valid:
+            results[index - 1].update(status='error', error='Invalid amount.')
+            continue
+        transfers[index] = {
+            'source': str(row['source_account']).strip(),
+            'target': str(row['target_account']).strip(),
+            'amount': amount,
+            'currency': str(row['currency']).strip().upper(),
+        }
+    return transfers
+
+
+def _check_references(transfer, accounts, rates, user_account):
+    source, target = accounts.get(transfer['source']), accounts.get(transfer['target'])
+    # A number not found is a typo when it fails the check digit; older numbers have none and are only looked up.
+    if source is None and not is_valid_account_number(transfer['source']):
+        return 'Wrong source account number.'
+    if source is None or (user_account is not None and source.user_account_id != user_account.pk):
+        return 'Unknown source account.'
+    if target is None and not is_valid_account_number(transfer['target']):
+        return 'Wrong target account number.'
+    if target is None:
+        return 'Unknown target account.'
+    if source.pk == target.pk:
+        return 'Source and target account are the same.'
+    if transfer['currency'] not in rates:
+        return 'Unknown currency.'
+    return None
+
+
+def _fail(results, transfers, index, error):
+    results[index - 1].update(status='error', error=error)
+    del transfers[index]
+
+
+def _apply(transfers, accounts, rates, results):
+    account_ids = sorted({accounts[transfer[side]].pk for transfer in transfers.values()
+                          for side in ('source', 'target')})
+    matrix = rate_matrix()
+    with transaction.atomic():
+        locked = {}
+        for start in range(0, len(account_ids), LOCK_BATCH_SIZE):
+            batch = account_ids[start:start + LOCK_BATCH_SIZE]
+            locked.update((account.pk, account) for account in
+                          BankAccount.objects.select_for_update().filter(pk__in=batch).order_by('pk'))
+
+        changed = {}
+        new_transactions = []
+        for index, transfer in list(transfers.items()):
+            source = locked[accounts[transfer['source']].pk]
+            target = locked[accounts[transfer['target']].pk]
+            currency = rates[transfer['currency']]
+            # The locked rows come without their currency, read it from the accounts loaded with select_related.
+            debit = matrix.convert(transfer['amount'], currency.currency,
+                                   accounts[transfer['source']].currency.currency)
+            credit = matrix.convert(transfer['amount'], currency.currency,
+                                    accounts[transfer['target']].currency.currency)
+
+            if not is_valid_amount(source, debit):
+                _fail(results, transfers, index, 'Insufficient funds.')
+                continue
+            overdraft_fee = calculate_overdraft_fee(source, debit).quantize(CENT)
+            source.balance -= debit + overdraft_fee
+            target.balance += credit
+            changed[source.pk], changed[target.pk] = source, target
+            new_transactions.append(Transaction(source_account=source, destination_account=target,
+                                                amount=transfer['amount'], currency=currency,
+                                                type=TypeOfTransaction.TRA, overdraft_fee=overdraft_fee,
+                                                source_amount=debit, destination_amount=credit))
+
+        BankAccount.objects.bulk_update(changed.values(), ['balance'], batch_size=WRITE_BATCH_SIZE)
+        created = Transaction.objects.bulk_create(new_transactions, batch_size=WRITE_BATCH_SIZE)
+        record(created)
+        bump_account_versions(*changed)
+
+    for index, new_transaction in zip(transfers, created):
+        results[index - 1]['transaction'] = new_transaction.pk
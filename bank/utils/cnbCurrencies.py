@@ -1,56 +1,244 @@
+import threading
 import time
+from datetime import datetime
+from xml.etree import ElementTree
 
+import httpx
 import requests
 import schedule as schedule
-from django.db import IntegrityError
+from django.conf import settings
 
 from bank.models import CurrencyRate
+from bank.utils.conversion import invalidate_rate_matrix
 
 
 class Currency:
     objects = None
 
-    def __init__(self, country: str, currency: str, amount: int, code: str, rate: float):
+    def __init__(self, country: str, currency: str, amount: int, code: str, rate: float, valid_date=None):
         self.country = country
         self.currency = currency
         self.amount = amount
         self.code = code
         self.rate = rate
+        self.valid_date = valid_date
 
     def __str__(self) -> str:
         return f'{self.currency} ({self.code})'
 
 
-def getRates():
-    url = 'https://www.cnb.cz/cs/financni-trhy/devizovy-trh/kurzy-devizoveho-trhu/kurzy-devizoveho-trhu/denni_kurz.txt'
+CNB_RATES_URL = 'https://www.cnb.cz/cs/financni-trhy/devizovy-trh/kurzy-devizoveho-trhu/kurzy-devizoveho-trhu/denni_kurz.txt'
+CNB_XML_RATES_URL = 'https://www.cnb.cz/cs/financni-trhy/devizovy-trh/kurzy-devizoveho-trhu/kurzy-devizoveho-trhu/denni_kurz.xml'
+
+
+class MalformedTable(ValueError):
+    pass
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """cnb.cz failed too many times in a row, so no request was sent."""
+
+
+def parseRates(text):
+    """
+    Parse a CNB daily table. Lines that are not a rate, like the column names or a damaged
+    line, are skipped; a table without a single rate raises ``MalformedTable``.
+    """
+    lines = text.splitlines()
+    valid_date = parseRatesDate(lines[0]) if lines else None
+    rates = tuple(rate for rate in (parseRate(line, valid_date) for line in lines[1:]) if rate is not None)
+    if not rates:
+        raise MalformedTable('The CNB table contains no rates.')
+    return rates
+
+
+def parseXmlRates(text):
+    """
+    Parse the XML version of the CNB daily table, ``<kurzy datum="..."><tabulka><radek .../>``,
+    into the same ``Currency`` tuple as ``parseRates``.
+    """
     try:
-        response = requests.get(url)
-        rates = []
-        for line in response.text.split('\n')[2:-1]:
-            data = line.split('|')
-            rates.append(Currency(data[0], data[1], int(data[2]), data[3], float(data[4].replace(',', '.'))))
-        return tuple(rates)
-    except requests.exceptions.ConnectionError:
-        return tuple()
+        root = ElementTree.fromstring(text)
+    except ElementTree.ParseError as error:
+        raise MalformedTable(f'The CNB table is not valid XML: {error}')
+    valid_date = parseRatesDate(root.get('datum', ''))
+    rows = ((row.get('zeme', ''), row.get('mena', ''), row.get('mnozstvi', ''), row.get('kod', ''),
+             row.get('kurz', '')) for row in root.iter('radek'))
+    rates = tuple(rate for rate in (toCurrency(*row, valid_date) for row in rows) if rate is not None)
+    if not rates:
+        raise MalformedTable('The CNB table contains no rates.')
+    return rates
 
 
-def saveRates():
+def parseRate(line, valid_date=None):
+    """Return the ``Currency`` of a ``country|currency|amount|code|rate`` line, or None."""
+    data = [field.strip() for field in line.split('|')]
+    if len(data) != 5:
+        return None
+    return toCurrency(*data, valid_date)
+
+
+def toCurrency(country, currency, amount, code, rate, valid_date=None):
+    """Return a ``Currency`` from the fields of a table row, or None if the code, amount or rate is not valid."""
+    if len(code) != 3:
+        return None
     try:
-        for data in getRates():
-            currency = data.code
-            rate = data.rate
-            try:
-                obj, created = CurrencyRate.objects.update_or_create(
-                    currency=currency,
-                    defaults={'rate': rate}
-                )
-            except IntegrityError as e:
-                print(f"Error updating or creating CurrencyRate for currency {currency}: {e}")
-    except requests.exceptions.ConnectionError:
-        pass
-
-    czk_rate, _ = CurrencyRate.objects.get_or_create(currency='CZK', defaults={'rate': 1})
-    if czk_rate.rate != 1:
-        czk_rate.rate = 1
-        czk_rate.save()
+        amount, rate = int(amount), float(rate.replace(',', '.'))
+    except ValueError:
+        return None
+    if amount <= 0 or not 0 < rate < float('inf'):
+        return None
+    return Currency(country, currency, amount, code, rate, valid_date)
+
+
+def parseRatesDate(header):
+    """Return the date of a table from its header line (``30.05.2023 #103``), or None."""
+    try:
+        return datetime.strptime(header.split(' ')[0], '%d.%m.%Y').date()
+    except ValueError:
+        return None
+
+
+class CnbClient:
+    """
+    Client for the CNB daily table, shared by the threads of a process.
+
+    Requests go through one pooled session with connect and read timeouts and are conditional
+    on the ``ETag`` and ``Last-Modified`` of the last table, which cnb.cz answers with a ``304``
+    while the table is unchanged. After ``failure_threshold`` failures in a row the circuit opens:
+    requests fail at once for ``reset_seconds``, then a single request probes cnb.cz again.
+
+    ``get`` and ``aget`` never raise. While cnb.cz fails they return the last good table and
+    set ``stale``, or an empty tuple if there is none. ``parse`` turns the response into rates,
+    ``parseXmlRates`` for the XML table.
+    """
+
+    def __init__(self, url=CNB_RATES_URL, connect_timeout=None, read_timeout=None, failure_threshold=None,
+                 reset_seconds=None, parse=parseRates):
+        self.url = url
+        self.parse = parse
+        self.connect_timeout = connect_timeout or settings.CNB_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.CNB_READ_TIMEOUT
+        self.failure_threshold = failure_threshold or settings.CNB_BREAKER_FAILURES
+        self.reset_seconds = reset_seconds or settings.CNB_BREAKER_RESET_SECONDS
+        self.session = requests.Session()
+        self.rates = tuple()
+        self.stale = False
+        self._etag = None
+        self._last_modified = None
+        self._failures = 0
+        self._opened_until = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        """Return the current table, raising ``requests`` errors and ``MalformedTable``."""
+        headers = self._start()
+        try:
+            response = self.session.get(self.url, headers=headers, timeout=(self.connect_timeout, self.read_timeout))
+            if response.status_code != 304:
+                response.raise_for_status()
+            return self._finish(response.status_code, response.headers, response.text)
+        except (requests.exceptions.RequestException, MalformedTable):
+            self._fail()
+            raise
+        except BaseException:
+            # Cancelled, e.g. because another rate source won the race: let the next call probe again.
+            self._abandon()
+            raise
+
+    def get(self):
+        try:
+            return self.fetch()
+        except (requests.exceptions.RequestException, MalformedTable):
+            return self._fallback()
+
+    async def afetch(self):
+        """Async ``fetch``, raising ``httpx`` errors, ``CircuitOpen`` and ``MalformedTable``."""
+        headers = self._start()
+        try:
+            # A client per call: tables are fetched once per publication, and a pooled client would be
+            # bound to the event loop it was created on.
+            async with httpx.AsyncClient(timeout=httpx.Timeout(self.read_timeout,
+                                                               connect=self.connect_timeout)) as client:
+                response = await client.get(self.url, headers=headers)
+            if response.status_code != 304:
+                response.raise_for_status()
+            return self._finish(response.status_code, response.headers, response.text)
+        except (httpx.HTTPError, MalformedTable):
+            self._fail()
+            raise
+        except BaseException:
+            # Cancelled, e.g. because another rate source won the race: let the next call probe again.
+            self._abandon()
+            raise
+
+    async def aget(self):
+        try:
+            return await self.afetch()
+        except (httpx.HTTPError, CircuitOpen, MalformedTable):
+            return self._fallback()
+
+    def _start(self):
+        with self._lock:
+            if self._opened_until is not None:
+                if self._probing or time.monotonic() < self._opened_until:
+                    raise CircuitOpen('cnb.cz is failing, not asking again yet.')
+                self._probing = True
+            headers = {}
+            if self.rates and self._etag:
+                headers['If-None-Match'] = self._etag
+            if self.rates and self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
+            return headers
+
+    def _finish(self, status_code, headers, text):
+        with self._lock:
+            if status_code == 304:
+                if not self.rates:
+                    raise MalformedTable('Not modified, but there is no table yet.')
+            else:
+                self.rates = self.parse(text)
+                self._etag, self._last_modified = headers.get('ETag'), headers.get('Last-Modified')
+            self.stale = False
+            self._failures = 0
+            self._opened_until = None
+            self._probing = False
+            return self.rates
+
+    def _fail(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.failure_threshold:
+                self._opened_until = time.monotonic() + self.reset_seconds
+
+    def _abandon(self):
+        with self._lock:
+            self._probing = False
+
+    def _fallback(self):
+        with self._lock:
+            self.stale = bool(self.rates)
+            return self.rates
+
+
+def ingestRates(rates):
+    """
+    Write the rates that differ from the stored ones in a single upsert.
+
+    Returns the number of ``CurrencyRate`` rows inserted or updated, so running it twice
+    with the same table changes nothing the second time.
+    """
+    stored = {code: (amount, rate) for code, amount, rate in CurrencyRate.objects.values_list('currency', 'amount',
+                                                                                                'rate')}
+    new_rates = {data.code: (data.amount, data.rate) for data in rates}
+    new_rates['CZK'] = (1, 1)
 
+    changed = [CurrencyRate(currency=code, amount=amount, rate=rate) for code, (amount, rate) in new_rates.items()
+               if stored.get(code) != (amount, rate)]
+    if changed:
+        CurrencyRate.objects.bulk_create(changed, update_conflicts=True, unique_fields=['currency'],
+                                         update_fields=['amount', 'rate', 'updated_at'])
+        invalidate_rate_matrix()
+    return len(changed)
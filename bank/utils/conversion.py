@@ -0,0 +1,91 @@
+"""
+Currency conversion with exact decimal arithmetic.
+
+CNB quotes a rate in CZK per ``amount`` units of a currency (e.g. CZK per 100 JPY). The
+``RateMatrix`` turns a rate table into the cross rate of every currency pair once, using the
+decimal string of each rate, so a conversion is one dictionary lookup and one multiplication,
+rounded half up to cents. Each process keeps the current matrix in memory; the version in the
+shared cache tells it when the stored rates have changed and the matrix has to be rebuilt.
+"""
+import hashlib
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+from types import MappingProxyType
+
+from django.core.cache import cache
+
+from bank.models import CurrencyRate
+
+CENT = Decimal('0.01')
+ROUNDING = ROUND_HALF_UP
+BASE_CURRENCY = 'CZK'
+
+RATE_MATRIX_VERSION_KEY = 'rates:matrix:version'
+
+_current = {'matrix': None}
+_lock = threading.Lock()
+
+
+class UnknownCurrency(Exception):
+    pass
+
+
+class RateMatrix:
+    """Immutable cross rates between all currencies of one rate table."""
+
+    __slots__ = ('version', 'units', '_cross')
+
+    def __init__(self, rates):
+        """``rates`` are ``(code, amount, rate)`` triples, the rate being CZK per ``amount`` units."""
+        units = {code: Decimal(str(rate)) / amount for code, amount, rate in rates}
+        units.setdefault(BASE_CURRENCY, Decimal(1))
+        table = ';'.join(f'{code}:{units[code]}' for code in sorted(units))
+        object.__setattr__(self, 'version', hashlib.sha1(table.encode()).hexdigest()[:12])
+        object.__setattr__(self, 'units', MappingProxyType(units))
+        object.__setattr__(self, '_cross', MappingProxyType(
+            {(source, target): units[source] / units[target] for source in units for target in units}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('RateMatrix is immutable.')
+
+    def __contains__(self, code):
+        return code in self.units
+
+    def rate(self, source, target):
+        """Return how many units of ``target`` one unit of ``source`` is worth."""
+        try:
+            return self._cross[source, target]
+        except KeyError:
+            raise UnknownCurrency(source if source not in self.units else target)
+
+    def convert(self, amount, source, target):
+        """Convert ``amount`` from ``source`` to ``target``, rounded half up to cents."""
+        if source == target:
+            return Decimal(amount).quantize(CENT, rounding=ROUNDING)
+        return (Decimal(amount) * self.rate(source, target)).quantize(CENT, rounding=ROUNDING)
+
+    def convert_many(self, amounts, source, target):
+        """Convert a sequence of amounts between one pair of currencies with a single lookup."""
+        factor = self.rate(source, target)
+        return [(Decimal(amount) * factor).quantize(CENT, rounding=ROUNDING) for amount in amounts]
+
+
+def rate_matrix():
+    """Return the matrix of the stored ``CurrencyRate`` table, rebuilding it only after the rates changed."""
+    version = cache.get(RATE_MATRIX_VERSION_KEY)
+    matrix = _current['matrix']
+    if matrix is not None and matrix.version == version:
+        return matrix
+    with _lock:
+        matrix = RateMatrix(CurrencyRate.objects.values_list('currency', 'amount', 'rate'))
+        _current['matrix'] = matrix
+        if version is None:
+            cache.add(RATE_MATRIX_VERSION_KEY, matrix.version, timeout=None)
+        elif version != matrix.version:
+            cache.set(RATE_MATRIX_VERSION_KEY, matrix.version, timeout=None)
+    return matrix
+
+
+def invalidate_rate_matrix(*args, **kwargs):
+    """Make every process rebuild its matrix on next use. Also a ``CurrencyRate`` save/delete receiver."""
+    cache.delete(RATE_MATRIX_VERSION_KEY)
@@ -0,0 +1,170 @@
+"""
+Onboarding of an existing customer book.
+
+Customers are read one at a time from CSV or JSON Lines and handled in batches: passwords
+are hashed in a process pool, since PBKDF2 takes far longer than the inserts, and each batch
+is written with one ``bulk_create`` per table and one ``bulk_update`` for the primary
+accounts. Account numbers for a batch are reserved as one block before its transaction.
+Imported balances are recorded in the ledger as opening postings.
+
+A CSV row has ``username``, ``email``, ``password`` and ``accounts`` columns, the accounts
+written as ``CZK:1500.00;EUR:20.00``. A JSON line has the same keys, with ``accounts`` a
+list of ``{"currency": ..., "balance": ...}``. The first account becomes the primary one.
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from bank.models import BankAccount, CurrencyRate, LedgerPosting, UserAccount
+from bank.utils.accountNumbers import allocate_account_numbers
+from bank.utils.ledger import opening_postings
+from bank.utils.transfers import fits_balance
+
+BATCH_SIZE = 1000
+
+
+def read_customers(lines, fmt):
+    """Yield one dict per customer from CSV or JSON Lines text lines, None for a line that is not JSON."""
+    if fmt == 'csv':
+        for row in csv.DictReader(lines):
+            accounts = [account.split(':', 1) for account in (row.get('accounts') or '').split(';') if account]
+            row['accounts'] = [{'currency': currency, 'balance': balance} for currency, balance in
+                               (account if len(account) == 2 else (account[0], '0') for account in accounts)]
+            yield row
+        return
+    for line in lines:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None
+
+
+def import_customers(rows, batch_size=BATCH_SIZE, workers=None, progress=None):
+    """
+    Create the users, user accounts and bank accounts of ``rows`` and return a report.
+
+    ``progress`` is called after each batch with the number of rows read and the report.
+    Invalid rows and existing usernames are skipped and listed under ``errors``.
+    """
+    currencies = {currency.currency: currency for currency in CurrencyRate.objects.all()}
+    report = {'customers': 0, 'accounts': 0, 'errors': [], 'seconds': 0.0}
+    started = time.perf_counter()
+    rows = enumerate(rows, start=1)
+    read = 0
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+        while batch := list(islice(rows, batch_size)):
+            read += len(batch)
+            customers = _clean(batch, currencies, report['errors'])
+            if customers:
+                hashes = pool.map(make_password, [customer['password'] for customer in customers],
+                                  chunksize=max(1, len(customers) // (4 * workers)))
+                for customer, password in zip(customers, hashes):
+                    customer['password'] = password
+                report['accounts'] += _insert(customers)
+                report['customers'] += len(customers)
+            report['seconds'] = time.perf_counter() - started
+            if progress:
+                progress(read, report)
+    report['errors'].sort(key=lambda error: error['row'])
+    return report
+
+
+def _clean(batch, currencies, errors):
+    customers = []
+    for line, row in batch:
+        error = None
+        if not isinstance(row, dict):
+            error = 'Invalid row.'
+        elif not str(row.get('username') or '').strip():
+            error = 'Missing username.'
+        elif not _valid_user_field('username', str(row['username']).strip()):
+            error = 'Invalid username.'
+        elif row.get('email') and not _valid_user_field('email', str(row['email']).strip()):
+            error = 'Invalid email.'
+        elif not isinstance(row.get('accounts') or [], list):
+            error = 'Invalid accounts.'
+        else:
+            accounts = []
+            for account in row.get('accounts') or []:
+                if not isinstance(account, dict):
+                    error = 'Invalid account.'
+                    continue
+                currency = currencies.get(str(account.get('currency', '')).strip().upper())
+                try:
+                    balance = Decimal(str(account.get('balance', '0')).strip())
+                    valid = balance >= 0 and fits_balance(balance)
+                except InvalidOperation:
+                    balance, valid = None, False
+                if currency is None:
+                    error = 'Unknown currency.'
+                elif not valid:
+                    error = 'Invalid balance.'
+                accounts.append((currency, balance))
+            if len({currency for currency, _ in accounts}) != len(accounts):
+                error = error or 'Two accounts in the same currency.'
+        if error:
+            errors.append({'row': line, 'error': error})
+            continue
+        customers.append({'line': line, 'username': str(row['username']).strip(),
+                          'email': str(row.get('email') or '').strip(), 'password': row.get('password') or None,
+                          'accounts': accounts})
+
+    # Existing and repeated usernames are found with one query per batch.
+    usernames = [customer['username'] for customer in customers]
+    taken = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+    unique = []
+    for customer in customers:
+        if customer['username'] in taken:
+            errors.append({'row': customer['line'], 'error': 'Username already exists.'})
+            continue
+        taken.add(customer['username'])
+        unique.append(customer)
+    return unique
+
+
+def _valid_user_field(name, value):
+    """Check a value with the validators of the ``User`` field, as the signup form does."""
+    try:
+        User._meta.get_field(name).run_validators(value)
+    except ValidationError:
+        return False
+    return True
+
+
+def _insert(customers):
+    numbers = iter(allocate_account_numbers(sum(len(customer['accounts']) for customer in customers)))
+    with transaction.atomic():
+        users = User.objects.bulk_create([User(username=customer['username'], email=customer['email'],
+                                               password=customer['password']) for customer in customers])
+        user_accounts = UserAccount.objects.bulk_create([UserAccount(user=user) for user in users])
+
+        accounts = []
+        primary = {}
+        for customer, user_account in zip(customers, user_accounts):
+            for currency, balance in customer['accounts']:
+                account = BankAccount(user_account=user_account, currency=currency, balance=balance,
+                                      account_number=next(numbers))
+                accounts.append(account)
+                primary.setdefault(user_account.pk, account)
+        BankAccount.objects.bulk_create(accounts, batch_size=BATCH_SIZE)
+        LedgerPosting.objects.bulk_create([posting for account in accounts if account.balance
+                                           for posting in opening_postings(account, account.balance)],
+                                          batch_size=BATCH_SIZE)
+
+        for user_account in user_accounts:
+            user_account.primary_bank_account = primary.get(user_account.pk)
+        UserAccount.objects.bulk_update([account for account in user_accounts if account.primary_bank_account],
+                                        ['primary_bank_account'], batch_size=BATCH_SIZE)
+    return len(accounts)
@@ -0,0 +1,40 @@
+"""
+Version counters for the cached dashboard fragments.
+
+The recent transactions of an account are rendered once per version of the account and
+kept in the Django cache. Every write that adds a transaction bumps the version of the
+accounts involved after its database transaction commits, so the next dashboard load
+renders the list again and older fragments simply expire.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+ACCOUNT_VERSION_KEY = 'account:{}:version'
+
+
+def account_version(account_id):
+    """Return the current version of the account, starting a counter if there is none."""
+    key = ACCOUNT_VERSION_KEY.format(account_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock, so an evicted counter never repeats a version rendered before.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_account_versions(*account_ids):
+    """Invalidate the cached fragments of the accounts once the current transaction commits."""
+    account_ids = set(account_ids)
+    transaction.on_commit(lambda: _bump(account_ids))
+
+
+def _bump(account_ids):
+    for account_id in account_ids:
+        key = ACCOUNT_VERSION_KEY.format(account_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
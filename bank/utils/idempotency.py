@@ -0,0 +1,114 @@
+"""
+``Idempotency-Key`` support for the JSON endpoints that move money.
+
+The first request with a key stores its response in the same database transaction as the
+balance changes. A retry with the same key gets the stored response back after a single
+indexed lookup and nothing is written again. A concurrent duplicate blocks on the unique
+index until the first request commits and then replays its response. A key reused with a
+different request body is refused with a 422 instead of replaying a response for another request.
+"""
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from bank.models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+FORM_CONTENT_TYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+CSRF_FIELD = 'csrfmiddlewaretoken'
+
+
+class _KeyInUse(Exception):
+    pass
+
+
+def idempotent(view):
+    """
+    Replay the stored response for requests repeating an ``Idempotency-Key`` header.
+
+    An async view called with a key runs in a thread, inside the transaction that stores the key.
+    """
+    if iscoroutinefunction(view):
+        sync_view = async_to_sync(view)
+
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not request.META.get(IDEMPOTENCY_HEADER):
+                return await view(request, *args, **kwargs)
+            return await sync_to_async(_respond_once)(sync_view, request, *args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.META.get(IDEMPOTENCY_HEADER):
+            return view(request, *args, **kwargs)
+        return _respond_once(view, request, *args, **kwargs)
+
+    return wrapper
+
+
+def _respond_once(view, request, *args, **kwargs):
+    header = request.META[IDEMPOTENCY_HEADER]
+    if len(header) > MAX_KEY_LENGTH:
+        return JsonResponse({"error": "Invalid Idempotency-Key."}, status=400)
+
+    key = hashlib.sha256(f'{request.user.pk}:{request.path}:{header}'.encode()).hexdigest()
+    request_hash = _request_hash(request)
+    stored = IdempotencyKey.objects.filter(key=key).first()
+    if stored is not None:
+        if stored.created_at >= expiry_cutoff():
+            return _replay(stored, request_hash)
+        stored.delete()
+
+    try:
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(key=key, request_hash=request_hash)
+            except IntegrityError:
+                raise _KeyInUse
+            response = view(request, *args, **kwargs)
+            record.status_code = response.status_code
+            record.response = response.content.decode()
+            record.save(update_fields=['status_code', 'response'])
+    except _KeyInUse:
+        return _replay(IdempotencyKey.objects.filter(key=key).first(), request_hash)
+    return response
+
+
+def _request_hash(request):
+    if request.content_type not in FORM_CONTENT_TYPES:
+        return hashlib.sha256(request.body).hexdigest()
+    # Forms are hashed by their fields: the CSRF token changes between retries of the same request.
+    fields = sorted((name, values) for name, values in request.POST.lists() if name != CSRF_FIELD)
+    files = sorted((name, upload.name, upload.size) for name, upload in request.FILES.items())
+    return hashlib.sha256(repr((fields, files)).encode()).hexdigest()
+
+
+def expiry_cutoff():
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def purge_expired_keys():
+    """Delete the keys older than ``IDEMPOTENCY_KEY_TTL`` and return how many were deleted."""
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=expiry_cutoff()).delete()
+    return deleted
+
+
+def _replay(stored, request_hash):
+    # Keys stored before the request hash was recorded have none to compare.
+    if stored is not None and stored.request_hash and stored.request_hash != request_hash:
+        return JsonResponse({"error": "This Idempotency-Key was used for a different request."}, status=422)
+    if stored is None or stored.status_code is None:
+        return JsonResponse({"error": "A request with this Idempotency-Key is still being processed."}, status=409)
+    response = HttpResponse(stored.response, status=stored.status_code, content_type='application/json')
+    response['Idempotent-Replayed'] = 'true'
+    return response
@@ -0,0 +1,157 @@
+"""
+Double-entry ledger of all balance changes.
+
+Every transfer, withdrawal and deposit is written as ``LedgerPosting`` rows in the same
+database transaction as the balance change. A posting is the change of one account: a
+customer's bank account or a system account of the bank (cash, fee income, FX clearing,
+opening balances). The postings of a transaction add up to zero in every currency, so a
+transfer between currencies goes through the FX clearing account of each currency.
+
+Postings are only ever inserted. ``BankAccount.balance`` is a projection of them that can
+be verified and rebuilt in batches of accounts.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Max, Min, Sum
+
+from bank.models import BankAccount, LedgerPosting, LedgerSystemAccount, Transaction, TypeOfTransaction
+from bank.utils.balances import ZERO, _account_amount
+
+BATCH_SIZE = 1000
+
+
+def postings_for(entry, debit=None, credit=None):
+    """
+    Return the unsaved postings of the ``Transaction`` ``entry``.
+
+    ``debit`` and ``credit`` are the amounts in the source and destination account currencies,
+    ``source_amount`` and ``destination_amount`` by default.
+    """
+    debit = entry.source_amount if debit is None else debit
+    credit = entry.destination_amount if credit is None else credit
+    source, target = entry.source_account, entry.destination_account
+
+    def posting(amount, account=None, system_account=None, currency_id=None):
+        return LedgerPosting(transaction=entry, account=account, system_account=system_account,
+                             currency_id=currency_id or account.currency_id, amount=amount)
+
+    if entry.type == TypeOfTransaction.WIT:
+        return [posting(-debit, source), posting(debit, system_account=LedgerSystemAccount.CASH,
+                                                 currency_id=source.currency_id)]
+    if entry.type == TypeOfTransaction.DEP:
+        return [posting(credit, target), posting(-credit, system_account=LedgerSystemAccount.CASH,
+                                                 currency_id=target.currency_id)]
+
+    postings = [posting(-(debit + entry.overdraft_fee), source), posting(credit, target)]
+    if entry.overdraft_fee:
+        postings.append(posting(entry.overdraft_fee, system_account=LedgerSystemAccount.FEES,
+                                currency_id=source.currency_id))
+    if source.currency_id != target.currency_id or debit != credit:
+        postings += [posting(debit, system_account=LedgerSystemAccount.FX, currency_id=source.currency_id),
+                     posting(-credit, system_account=LedgerSystemAccount.FX, currency_id=target.currency_id)]
+    return postings
+
+
+def record(transactions):
+    """Insert the postings of already saved transactions."""
+    LedgerPosting.objects.bulk_create([posting for item in transactions for posting in postings_for(item)],
+                                      batch_size=BATCH_SIZE)
+
+
+def opening_postings(account, amount):
+    """Postings that bring an account without history to ``amount``, e.g. for imported balances."""
+    return [LedgerPosting(account=account, currency_id=account.currency_id, amount=amount),
+            LedgerPosting(system_account=LedgerSystemAccount.OPENING, currency_id=account.currency_id,
+                          amount=-amount)]
+
+
+def backfill():
+    """
+    Write postings for the transactions that have none, then opening postings for the
+    difference between each account's balance and its postings. Returns the number of
+    transactions and accounts backfilled.
+    """
+    missing = (Transaction.objects.filter(postings__isnull=True)
+               .select_related('currency', 'source_account__currency', 'destination_account__currency')
+               .order_by('pk'))
+    transactions = 0
+    batch = []
+    for item in missing.iterator(chunk_size=BATCH_SIZE):
+        # Rows written before the account amounts were recorded get them converted at that day's rates.
+        debit = credit = None
+        if item.type != TypeOfTransaction.DEP:
+            debit = _account_amount(item, item.source_amount, item.source_account)
+        if item.type != TypeOfTransaction.WIT:
+            credit = _account_amount(item, item.destination_amount, item.destination_account)
+        batch += postings_for(item, debit, credit)
+        transactions += 1
+        if len(batch) >= BATCH_SIZE:
+            LedgerPosting.objects.bulk_create(batch)
+            batch = []
+    LedgerPosting.objects.bulk_create(batch)
+
+    accounts = 0
+    for differences in _differences():
+        LedgerPosting.objects.bulk_create([posting for account, difference in differences
+                                           for posting in opening_postings(account, difference)])
+        accounts += len(differences)
+    return transactions, accounts
+
+
+def rebuild():
+    """Set every balance to the sum of its postings, one locked batch of accounts at a time."""
+    updated = 0
+    for start, end in _id_ranges():
+        with transaction.atomic():
+            accounts = list(BankAccount.objects.select_for_update().filter(pk__gte=start, pk__lt=end).order_by('pk'))
+            sums = _posting_sums(start, end)
+            changed = []
+            for account in accounts:
+                balance = sums.get(account.pk, ZERO)
+                if account.balance != balance:
+                    account.balance = balance
+                    changed.append(account)
+            BankAccount.objects.bulk_update(changed, ['balance'])
+            updated += len(changed)
+    return updated
+
+
+def verify():
+    """
+    Check the ledger and the projection. Returns the ids of transactions whose postings do not
+    add up to zero in some currency and ``(account id, balance, postings)`` of mismatched accounts.
+    """
+    unbalanced = sorted({row['transaction'] for row in LedgerPosting.objects.filter(transaction__isnull=False)
+                        .order_by().values('transaction', 'currency').annotate(total=Sum('amount'))
+                        .exclude(total=0)})
+    mismatched = [(account.pk, account.balance, account.balance - difference)
+                  for differences in _differences() for account, difference in differences]
+    return unbalanced, mismatched
+
+
+def _id_ranges():
+    bounds = BankAccount.objects.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        return
+    for start in range(bounds['first'], bounds['last'] + 1, BATCH_SIZE):
+        yield start, start + BATCH_SIZE
+
+
+def _posting_sums(start, end):
+    sums = defaultdict(lambda: ZERO)
+    for account_id, total in (LedgerPosting.objects.filter(account__gte=start, account__lt=end).order_by()
+                              .values_list('account').annotate(total=Sum('amount'))):
+        sums[account_id] = total
+    return sums
+
+
+def _differences():
+    """Yield, per batch of accounts, the accounts whose balance differs from their postings and by how much."""
+    for start, end in _id_ranges():
+        sums = _posting_sums(start, end)
+        accounts = BankAccount.objects.filter(pk__gte=start, pk__lt=end).order_by('pk')
+        differences = [(account, account.balance - sums.get(account.pk, ZERO)) for account in accounts
+                       if account.balance != sums.get(account.pk, ZERO)]
+        if differences:
+            yield differences
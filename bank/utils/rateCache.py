@@ -0,0 +1,149 @@
+"""
+Two-level cache for the CNB exchange-rate table.
+
+CNB publishes a new table once per business day shortly after 14:30 Prague time, so the
+table is valid until the next publication. Each process keeps its own copy in memory and
+falls back to the shared Django cache; the rate sources are only asked when both are empty.
+"""
+import asyncio
+import hashlib
+import threading
+import weakref
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from bank.utils.cnbCurrencies import ingestRates
+from bank.utils.rateSources import rate_provider
+
+CNB_TIMEZONE = ZoneInfo('Europe/Prague')
+# CNB publishes at 14:30, leave a few minutes for the new file to appear.
+CNB_PUBLICATION_TIME = time(14, 35)
+
+RATES_CACHE_KEY = 'cnb:rates'
+
+_local = {'rates': None, 'expires': None}
+_lock = threading.Lock()
+# Single-flight locks of aget_rates, one per event loop because an asyncio.Lock is bound to its loop.
+_async_locks = weakref.WeakKeyDictionary()
+
+
+def cnb_today(now=None):
+    """Return the date in Prague, the date a table published on that day is valid from."""
+    return (now or timezone.now()).astimezone(CNB_TIMEZONE).date()
+
+
+def next_publication(now=None):
+    """Return the moment of the next CNB publication after ``now``."""
+    now = (now or timezone.now()).astimezone(CNB_TIMEZONE)
+    publication = datetime.combine(now.date(), CNB_PUBLICATION_TIME, tzinfo=CNB_TIMEZONE)
+    if now >= publication:
+        publication += timedelta(days=1)
+    while publication.weekday() >= 5:
+        publication += timedelta(days=1)
+    return publication
+
+
+def get_rates():
+    """
+    Return the current rate table, fetching it from the rate sources only when no cache holds it.
+
+    A freshly fetched table is also written to ``CurrencyRate`` once, so the database is
+    updated once per publication instead of on every page view.
+    """
+    now = timezone.now()
+    with _lock:
+        if _local['rates'] is not None and now < _local['expires']:
+            return _local['rates']
+
+        rates = cache.get(RATES_CACHE_KEY)
+        if rates is None:
+            provider = rate_provider()
+            rates = provider.get()
+            if not rates or provider.stale:
+                # No source answered, try again shortly instead of caching an empty or old table.
+                _local['rates'] = rates
+                _local['expires'] = now + timedelta(seconds=settings.RATES_RETRY_SECONDS)
+                return rates
+            ingestRates(rates)
+            cache.set(RATES_CACHE_KEY, rates, timeout=(next_publication(now) - now).total_seconds())
+
+        _remember(rates, now)
+        return rates
+
+
+async def aget_rates():
+    """
+    Async ``get_rates``: a missing table is downloaded with a non-blocking client.
+
+    Concurrent requests of an event loop wait for a single download. The thread lock is not
+    taken, a sync caller holds it while it downloads; the process copy is replaced in one update.
+    """
+    rates = _fresh_local_rates(timezone.now())
+    if rates is not None:
+        return rates
+
+    async with _async_lock():
+        # Another request may have fetched the table while this one waited.
+        now = timezone.now()
+        rates = _fresh_local_rates(now)
+        if rates is not None:
+            return rates
+
+        rates = await cache.aget(RATES_CACHE_KEY)
+        if rates is None:
+            provider = rate_provider()
+            rates = await provider.aget()
+            if not rates or provider.stale:
+                _local.update(rates=rates, expires=now + timedelta(seconds=settings.RATES_RETRY_SECONDS))
+                return rates
+            await sync_to_async(ingestRates)(rates)
+            await cache.aset(RATES_CACHE_KEY, rates, timeout=(next_publication(now) - now).total_seconds())
+
+        _remember(rates, now)
+        return rates
+
+
+def _fresh_local_rates(now):
+    rates, expires = _local['rates'], _local['expires']
+    if rates is not None and expires is not None and now < expires:
+        return rates
+    return None
+
+
+def _async_lock():
+    loop = asyncio.get_running_loop()
+    lock = _async_locks.get(loop)
+    if lock is None:
+        lock = _async_locks[loop] = asyncio.Lock()
+    return lock
+
+
+def store_rates(rates):
+    """Publish a freshly ingested table to the shared cache and to this process."""
+    now = timezone.now()
+    with _lock:
+        cache.set(RATES_CACHE_KEY, rates, timeout=(next_publication(now) - now).total_seconds())
+        _remember(rates, now)
+
+
+def _remember(rates, now):
+    _local.update(rates=rates, expires=min(next_publication(now), now + timedelta(seconds=settings.RATES_LOCAL_TTL)))
+
+
+def clear_rates_cache():
+    """Drop the cached table from this process and from the shared cache."""
+    with _lock:
+        _local['rates'] = None
+        _local['expires'] = None
+    cache.delete(RATES_CACHE_KEY)
+
+
+def rates_version(rates):
+    """Return a short fingerprint of a rate table, changing whenever any rate in it changes."""
+    table = ';'.join(f'{rate.code}:{rate.amount}:{rate.rate}' for rate in rates)
+    return hashlib.sha1(table.encode()).hexdigest()[:12]
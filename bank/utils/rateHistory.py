@@ -0,0 +1,97 @@
+"""
+Historical CNB exchange rates.
+
+CNB publishes a yearly file (``rok.txt``) with one line per business day. Its header lines
+list the currencies as ``<amount> <code>`` columns and are repeated whenever the set of
+currencies changes during the year.
+"""
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+
+from django.utils import timezone
+
+from bank.models import CurrencyRateHistory
+
+CNB_YEARLY_RATES_URL = 'https://www.cnb.cz/cs/financni-trhy/devizovy-trh/kurzy-devizoveho-trhu/kurzy-devizoveho-trhu/rok.txt?rok={year}'
+
+
+class _NoRate(Exception):
+    pass
+
+
+def parse_yearly_rates(lines):
+    """Yield an unsaved ``CurrencyRateHistory`` for every value in a CNB yearly file."""
+    columns = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        data = line.split('|')
+        if data[0] == 'Datum':
+            columns = [column.split(' ') for column in data[1:]]
+            continue
+
+        valid_date = datetime.strptime(data[0], '%d.%m.%Y').date()
+        for (amount, code), value in zip(columns, data[1:]):
+            if value:
+                yield CurrencyRateHistory(currency=code, valid_date=valid_date, amount=int(amount),
+                                          rate=float(value.replace(',', '.')))
+
+
+def backfill_rates(lines, batch_size=1000):
+    """
+    Store the rates from a yearly file in batches, skipping days that are already stored.
+
+    Returns the number of rates read from the file.
+    """
+    rates = parse_yearly_rates(lines)
+    count = 0
+    while batch := list(islice(rates, batch_size)):
+        CurrencyRateHistory.objects.bulk_create(batch, ignore_conflicts=True)
+        count += len(batch)
+    _rate_as_of.cache_clear()
+    return count
+
+
+def record_rate_history(rates):
+    """Store a daily table (``Currency`` objects with ``valid_date`` set) in the history."""
+    history = [CurrencyRateHistory(currency=data.code, valid_date=data.valid_date, amount=data.amount, rate=data.rate)
+               for data in rates if data.valid_date]
+    CurrencyRateHistory.objects.bulk_create(history, update_conflicts=True, unique_fields=['currency', 'valid_date'],
+                                            update_fields=['amount', 'rate'])
+    _rate_as_of.cache_clear()
+    return len(history)
+
+
+def rate_as_of(currency, on_date):
+    """
+    Return the ``CurrencyRateHistory`` valid on ``on_date`` or None if there is none.
+
+    CNB does not publish on weekends and holidays, so the latest rate published on or before
+    the date is used. Rates found for past dates cannot change any more and are answered from
+    an LRU cache; a date without a rate is looked up again, a backfill may still add it.
+    """
+    if currency == 'CZK':
+        return CurrencyRateHistory(currency='CZK', valid_date=on_date, amount=1, rate=1)
+    if on_date < timezone.localdate():
+        try:
+            return _rate_as_of(currency, on_date)
+        except _NoRate:
+            return None
+    return _lookup(currency, on_date)
+
+
+@lru_cache(maxsize=4096)
+def _rate_as_of(currency, on_date):
+    rate = _lookup(currency, on_date)
+    if rate is None:
+        # lru_cache does not store exceptions, so misses are not cached.
+        raise _NoRate
+    return rate
+
+
+def _lookup(currency, on_date):
+    # A single descending range scan on the (currency, valid_date) index.
+    history = CurrencyRateHistory.objects.filter(currency=currency, valid_date__lte=on_date)
+    return history.order_by('-valid_date').first()
@@ -0,0 +1,180 @@
+"""
+Sources of the exchange-rate table and a provider that queries them concurrently.
+
+``RATE_SOURCES`` lists the sources in order of preference. The provider asks the first one
+and, when it has not answered within ``RATE_HEDGE_DELAY`` seconds or has failed, the next one
+as well, without giving up on the earlier requests. The first valid table wins, so a slow
+source costs at most the hedge delay and a failing one nothing. Every source returns the
+table as ``Currency`` tuples, whatever its format.
+"""
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from bank.utils.cnbCurrencies import CNB_XML_RATES_URL, CnbClient, parseRates, parseXmlRates
+
+
+class NoRatesAvailable(Exception):
+    pass
+
+
+class RateSource:
+    """A place to get the current rate table from. ``fetch`` raises an exception on failure."""
+
+    def fetch(self):
+        raise NotImplementedError
+
+    async def afetch(self):
+        return await sync_to_async(self.fetch)()
+
+
+class CnbTextSource(RateSource):
+    """The text table on cnb.cz, ``denni_kurz.txt``. Options are those of ``CnbClient``."""
+
+    def __init__(self, **options):
+        self.client = CnbClient(**options)
+
+    def fetch(self):
+        return self.client.fetch()
+
+    async def afetch(self):
+        return await self.client.afetch()
+
+
+class CnbXmlSource(CnbTextSource):
+    """The same table on cnb.cz in XML, ``denni_kurz.xml``."""
+
+    def __init__(self, url=CNB_XML_RATES_URL, **options):
+        super().__init__(url=url, parse=parseXmlRates, **options)
+
+
+class FileRateSource(RateSource):
+    """A table saved in a file, in the text format or in XML if the name ends with ``.xml``."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.parse = parseXmlRates if self.path.endswith('.xml') else parseRates
+
+    def fetch(self):
+        with open(self.path, encoding='utf-8') as file:
+            return self.parse(file.read())
+
+
+class HedgedRateProvider:
+    """
+    Returns the first table any of ``sources`` returns, asking the next source after ``hedge_delay``
+    seconds or as soon as one fails.
+
+    Like ``CnbClient``, ``get`` and ``aget`` never raise: when every source fails they return the
+    last good table and set ``stale``, or an empty tuple if there is none.
+    """
+
+    def __init__(self, sources, hedge_delay):
+        if not sources:
+            raise ValueError('At least one rate source is needed.')
+        self.sources = list(sources)
+        self.hedge_delay = hedge_delay
+        self.rates = tuple()
+        self.stale = False
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        """Return the first valid table, raising ``NoRatesAvailable`` if every source fails."""
+        errors = []
+        remaining = iter(self.sources)
+        # A pool per call: the slower requests finish in the background once a table has won.
+        pool = ThreadPoolExecutor(len(self.sources), thread_name_prefix='rate-source')
+        try:
+            pending = {pool.submit(next(remaining).fetch)}
+            launched = 1
+            while pending:
+                timeout = self.hedge_delay if launched < len(self.sources) else None
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                rates = self._first_table(done, errors)
+                if rates:
+                    return rates
+                source = next(remaining, None)
+                if source is not None:
+                    pending.add(pool.submit(source.fetch))
+                    launched += 1
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise NoRatesAvailable(self._describe(errors))
+
+    def get(self):
+        try:
+            return self.fetch()
+        except NoRatesAvailable:
+            return self._fallback()
+
+    async def afetch(self):
+        """Async ``fetch``; the requests that lose are cancelled."""
+        errors = []
+        remaining = iter(self.sources)
+        pending = {asyncio.ensure_future(next(remaining).afetch())}
+        launched = 1
+        try:
+            while pending:
+                timeout = self.hedge_delay if launched < len(self.sources) else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                rates = self._first_table(done, errors)
+                if rates:
+                    return rates
+                source = next(remaining, None)
+                if source is not None:
+                    pending.add(asyncio.ensure_future(source.afetch()))
+                    launched += 1
+        finally:
+            for task in pending:
+                task.cancel()
+        raise NoRatesAvailable(self._describe(errors))
+
+    async def aget(self):
+        try:
+            return await self.afetch()
+        except NoRatesAvailable:
+            return self._fallback()
+
+    def _first_table(self, done, errors):
+        """Return the table of the first successful request in ``done``, collecting the errors of the others."""
+        winner = None
+        for future in done:
+            try:
+                rates = future.result()
+            except Exception as error:
+                # Any error of one source, a damaged file as much as a timeout, is a reason to try the others.
+                errors.append(error)
+                continue
+            if rates and winner is None:
+                winner = rates
+        if winner:
+            with self._lock:
+                self.rates = winner
+                self.stale = False
+        return winner
+
+    def _describe(self, errors):
+        return 'No rate source answered: ' + '; '.join(f'{type(error).__name__}: {error}' for error in errors)
+
+    def _fallback(self):
+        with self._lock:
+            self.stale = bool(self.rates)
+            return self.rates
+
+
+@lru_cache(maxsize=None)
+def rate_provider():
+    """The provider configured by ``RATE_SOURCES`` and ``RATE_HEDGE_DELAY``, one per process."""
+    sources = [import_string(source['BACKEND'])(**source.get('OPTIONS', {})) for source in settings.RATE_SOURCES]
+    return HedgedRateProvider(sources, settings.RATE_HEDGE_DELAY)
+
+
+def reset_rate_provider(setting, **kwargs):
+    """Forget the configured provider when its settings change, e.g. under ``override_settings``."""
+    if setting in ('RATE_SOURCES', 'RATE_HEDGE_DELAY'):
+        rate_provider.cache_clear()
@@ -0,0 +1,86 @@
+"""
+Reconciliation of stored balances with the transaction history.
+
+The expected balance of an account is its opening balance from the ledger plus the changes of
+all its transactions, the overdraft fees included. Accounts are split into shards of primary-key
+ranges and each shard is summed with grouped SQL queries, the shards in parallel in a process
+pool. Rows written before the account amounts were recorded and entered in another currency
+than the account's are few; ``changes_by_account`` converts them one by one at the rates of their day.
+"""
+import csv
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import connections
+from django.db.models import Max, Min, Sum
+
+from bank.models import BankAccount, LedgerPosting, Transaction
+from bank.utils.balances import ZERO, changes_by_account
+from bank.utils.conversion import CENT
+
+SHARD_SIZE = 10000
+
+REPORT_FIELDS = ('account_id', 'account_number', 'currency', 'balance', 'expected', 'difference')
+
+
+def shards(shard_size=SHARD_SIZE):
+    """Return ``(first, last)`` account id ranges covering all accounts."""
+    bounds = BankAccount.objects.aggregate(first=Min('pk'), last=Max('pk'))
+    if bounds['first'] is None:
+        return []
+    return [(start, min(start + shard_size - 1, bounds['last']))
+            for start in range(bounds['first'], bounds['last'] + 1, shard_size)]
+
+
+def reconcile_shard(account_range):
+    """Return the number of accounts in the range and a report row for every account that does not match."""
+    first, last = account_range
+    expected = changes_by_account(Transaction.objects.all(), account_range=account_range)
+    openings = LedgerPosting.objects.filter(account__gte=first, account__lte=last, transaction__isnull=True)
+    for account_id, opening in openings.order_by().values_list('account').annotate(total=Sum('amount')):
+        expected[account_id] += opening
+
+    checked = 0
+    discrepancies = []
+    for account_id, number, currency, balance in (BankAccount.objects.filter(pk__range=account_range)
+                                                  .order_by('pk')
+                                                  .values_list('pk', 'account_number', 'currency__currency',
+                                                               'balance')):
+        checked += 1
+        total = expected.get(account_id, ZERO).quantize(CENT)
+        if balance != total:
+            discrepancies.append((account_id, number, currency, balance, total, balance - total))
+    return checked, discrepancies
+
+
+def reconcile(output, shard_size=SHARD_SIZE, workers=None):
+    """
+    Check every account and write the ones that do not match to ``output`` as CSV.
+
+    With one worker the shards run in this process. Returns a summary.
+    """
+    started = time.perf_counter()
+    ranges = shards(shard_size)
+    workers = workers or os.cpu_count() or 1
+    writer = csv.writer(output)
+    writer.writerow(REPORT_FIELDS)
+    summary = {'accounts': 0, 'discrepancies': 0, 'shards': len(ranges)}
+
+    if workers == 1:
+        _collect(map(reconcile_shard, ranges), writer, summary)
+    else:
+        # Forked workers must open their own connections instead of sharing the parent's.
+        connections.close_all()
+        with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+            _collect(pool.map(reconcile_shard, ranges), writer, summary)
+    summary['seconds'] = round(time.perf_counter() - started, 3)
+    return summary
+
+
+def _collect(results, writer, summary):
+    for checked, rows in results:
+        summary['accounts'] += checked
+        summary['discrepancies'] += len(rows)
+        writer.writerows(rows)
@@ -0,0 +1,83 @@
+"""
+Transaction history of an account, newest first, with keyset pagination.
+
+An account appears in a transaction either as the source or as the destination. Each side
+is read separately through its (account, timestamp, id) index, limited to one page and
+merged in Python. A page costs the same two index range scans however long the history is,
+unlike OFFSET pagination or a sorted UNION.
+"""
+import base64
+import heapq
+from datetime import datetime
+
+from django.db.models import Q
+
+from bank.models import Transaction, TypeOfTransaction
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(transaction):
+    value = f'{transaction.timestamp.isoformat()}|{transaction.pk}'
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the ``(timestamp, id)`` of a cursor, raising ``ValueError`` for an invalid one."""
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except ValueError:
+        raise ValueError('Invalid cursor.')
+
+
+def account_transactions(account, limit=PAGE_SIZE, cursor=None, types=None, currency=None):
+    """
+    Return up to ``limit`` transactions of the account older than ``cursor``, newest first.
+
+    ``types`` is a list of ``TypeOfTransaction`` values and ``currency`` a currency code.
+    """
+    sides = [
+        Transaction.objects.filter(source_account=account),
+        # Deposits and withdrawals have the account on both sides, read them from the source side only.
+        Transaction.objects.filter(destination_account=account).exclude(source_account=account),
+    ]
+    pages = []
+    for transactions in sides:
+        if types:
+            transactions = transactions.filter(type__in=types)
+        if currency:
+            transactions = transactions.filter(currency__currency=currency)
+        if cursor:
+            timestamp, pk = cursor
+            transactions = transactions.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk))
+        pages.append(transactions.select_related(
+            'currency', 'source_account__user_account__user', 'destination_account__user_account__user'
+        ).order_by('-timestamp', '-pk')[:limit])
+
+    merged = heapq.merge(*pages, key=lambda transaction: (transaction.timestamp, transaction.pk), reverse=True)
+    return [transaction for transaction, _ in zip(merged, range(limit))]
+
+
+def history_page(account, limit=PAGE_SIZE, cursor=None, types=None, currency=None):
+    """Return ``(transactions, next_cursor)``, where ``next_cursor`` is None on the last page."""
+    transactions = account_transactions(account, limit + 1, cursor, types, currency)
+    if len(transactions) > limit:
+        return transactions[:limit], encode_cursor(transactions[limit - 1])
+    return transactions, None
+
+
+def serialize_transaction(transaction, account):
+    outgoing = transaction.source_account_id == account.pk and transaction.type != TypeOfTransaction.DEP
+    counterparty = transaction.destination_account if outgoing else transaction.source_account
+    return {
+        'id': transaction.pk,
+        'timestamp': transaction.timestamp.isoformat(),
+        'type': TypeOfTransaction(transaction.type).label,
+        'direction': 'out' if outgoing else 'in',
+        'amount': str(transaction.amount),
+        'currency': transaction.currency.currency,
+        'overdraft_fee': str(transaction.overdraft_fee),
+        'counterparty': counterparty.account_number if counterparty.pk != account.pk else None,
+    }
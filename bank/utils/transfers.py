@@ -0,0 +1,106 @@
+"""
+Balance changes for transfers, withdrawals and deposits.
+
+Every operation runs in one database transaction. Accounts are locked in primary-key order,
+so two opposite transfers cannot deadlock, and balances are changed with conditional
+``UPDATE ... SET balance = balance - x WHERE balance >= y`` statements, so a concurrent writer
+is never overwritten by a stale value read into Python. The ledger postings of every
+``Transaction`` are inserted in the same transaction.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+
+from bank.models import BankAccount, Transaction, TypeOfTransaction
+from bank.utils.fragmentCache import bump_account_versions
+from bank.utils.ledger import record
+
+OVERDRAFT_LIMIT = Decimal('0.1')
+OVERDRAFT_FEE = Decimal('0.1')
+CENT = Decimal('0.01')
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+def is_valid_amount(account, amount):
+    return Decimal('0') <= amount <= account.balance + account.balance * OVERDRAFT_LIMIT
+
+
+def fits_balance(amount):
+    """Whether ``amount`` is whole cents and has no more digits than ``BankAccount.balance`` can store."""
+    field = BankAccount._meta.get_field('balance')
+    return (amount.is_finite() and abs(amount) < Decimal(10) ** (field.max_digits - field.decimal_places)
+            and amount == amount.quantize(CENT))
+
+
+def calculate_overdraft_fee(account, amount):
+    return max(Decimal('0'), amount - account.balance) * OVERDRAFT_FEE
+
+
+def lock_accounts(*account_ids):
+    """Lock the accounts with ``SELECT ... FOR UPDATE`` in primary-key order and return them by id."""
+    accounts = BankAccount.objects.select_for_update().filter(pk__in=set(account_ids)).order_by('pk')
+    return {account.pk: account for account in accounts}
+
+
+def change_balance(account_id, delta, minimum_balance=None):
+    """Add ``delta`` to the balance, only if the balance is at least ``minimum_balance``."""
+    accounts = BankAccount.objects.filter(pk=account_id)
+    if minimum_balance is not None:
+        accounts = accounts.filter(balance__gte=minimum_balance)
+    if not accounts.update(balance=F('balance') + delta):
+        raise InsufficientFunds
+
+
+def transfer(source_account, target_account, debit, credit, amount, currency):
+    """
+    Move money between two accounts and record the transfer.
+
+    ``debit`` is taken from the source account in its currency, together with the overdraft
+    fee, and ``credit`` is added to the target account. ``amount`` and ``currency`` are
+    what the user entered and are stored on the ``Transaction``.
+    """
+    debit, credit = debit.quantize(CENT), credit.quantize(CENT)
+    with transaction.atomic():
+        locked = lock_accounts(source_account.pk, target_account.pk)
+        source_account, target_account = locked[source_account.pk], locked[target_account.pk]
+        if not is_valid_amount(source_account, debit):
+            raise InsufficientFunds
+        overdraft_fee = calculate_overdraft_fee(source_account, debit).quantize(CENT)
+
+        change_balance(source_account.pk, -(debit + overdraft_fee), debit / (1 + OVERDRAFT_LIMIT))
+        change_balance(target_account.pk, credit)
+        bump_account_versions(source_account.pk, target_account.pk)
+        created = Transaction.objects.create(source_account=source_account, destination_account=target_account,
+                                             amount=amount, currency=currency, type=TypeOfTransaction.TRA,
+                                             overdraft_fee=overdraft_fee, source_amount=debit,
+                                             destination_amount=credit)
+        record([created])
+        return created
+
+
+def withdraw(account, debit, amount, currency):
+    """Take ``debit`` from the account, without overdraft, and record the withdrawal."""
+    debit = debit.quantize(CENT)
+    with transaction.atomic():
+        change_balance(account.pk, -debit, debit)
+        bump_account_versions(account.pk)
+        created = Transaction.objects.create(source_account=account, destination_account=account, amount=amount,
+                                             currency=currency, type=TypeOfTransaction.WIT, source_amount=debit)
+        record([created])
+        return created
+
+
+def deposit(account, credit, amount, currency):
+    """Add ``credit`` to the account and record the deposit."""
+    credit = credit.quantize(CENT)
+    with transaction.atomic():
+        change_balance(account.pk, credit)
+        bump_account_versions(account.pk)
+        created = Transaction.objects.create(source_account=account, destination_account=account, amount=amount,
+                                             currency=currency, type=TypeOfTransaction.DEP, destination_amount=credit)
+        record([created])
+        return created
@@ -0,0 +1,61 @@
+"""
+Total value of a customer's accounts in one currency.
+
+Balances are read in a single query and converted with the in-memory rate matrix, so a
+valuation costs the same one query however many accounts and currencies a customer holds.
+The bank-wide report sums balances per customer and currency in SQL and converts the
+grouped totals with NumPy arrays, one vectorized pass for all customers.
+"""
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import Sum
+
+from bank.models import BankAccount
+from bank.utils.conversion import CENT, ROUNDING, rate_matrix
+
+ZERO = Decimal('0')
+
+
+def user_valuation(user_account, currency):
+    """Return each account of the user and the total, valued in ``currency``."""
+    matrix = rate_matrix()
+    accounts = []
+    total = ZERO
+    for account in user_account.bank_accounts.select_related('currency').order_by('pk'):
+        value = matrix.convert(account.balance, account.currency.currency, currency)
+        total += value
+        accounts.append({
+            'account_number': account.account_number,
+            'currency': account.currency.currency,
+            'balance': str(account.balance),
+            'value': str(value),
+        })
+    return {'currency': currency, 'total': str(total.quantize(CENT, rounding=ROUNDING)), 'accounts': accounts}
+
+
+def bank_valuation(currency):
+    """
+    Value every customer's accounts in ``currency``.
+
+    Returns ``(user_account_ids, totals)``, two aligned NumPy arrays with totals in cents.
+    Customers without accounts are left out. Meant for reporting: the conversion runs in
+    float64, so a total can differ by a cent from ``user_valuation`` on half-cent ties.
+    """
+    matrix = rate_matrix()
+    rows = BankAccount.objects.order_by().values_list('user_account_id', 'currency__currency').annotate(
+        total=Sum('balance'))
+    if not rows:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    user_ids, codes, totals = zip(*rows)
+
+    code_list = sorted(set(codes))
+    code_index = {code: index for index, code in enumerate(code_list)}
+    factors = np.array([float(matrix.rate(code, currency)) for code in code_list])
+    cents = np.array([int(total * 100) for total in totals], dtype=np.int64)
+    values = cents * factors[np.array([code_index[code] for code in codes])]
+    # Round each converted total half up to a cent, like RateMatrix.convert (np.round would round half to even).
+    values = np.trunc(values + np.copysign(0.5, values)).astype(np.int64)
+
+    customers, positions = np.unique(np.array(user_ids, dtype=np.int64), return_inverse=True)
+    return customers, np.bincount(positions, weights=values).astype(np.int64)
@@ -1,11 +1,17 @@
-from decimal import Decimal
+from datetime import date
+from functools import partial
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponseRedirect
+from django.contrib.auth.mixins import AccessMixin, LoginRequiredMixin
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseRedirect, Http404, StreamingHttpResponse
 from django.urls import reverse, reverse_lazy
+from django.utils import timezone
+from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.generic import TemplateView, CreateView
 import pyotp
@@ -14,86 +20,129 @@ from django_otp.views import LoginView
 from pyotp import TOTP
 from bank.forms import ChangePrimaryBankAccountForm, TransactionForm, WithdrawalForm, RechargeForm, NewUserForm, \
     BankAccountForm
-from bank.models import BankAccount, UserAccount, TypeOfTransaction, Transaction, CurrencyRate
-from bank.utils.cnbCurrencies import getRates, saveRates
+from bank.models import BankAccount, UserAccount, CurrencyRate, TypeOfTransaction
+from bank.utils.accountNumbers import ACCOUNT_NUMBER_LENGTH, is_valid_account_number
+from bank.utils.balances import balance_as_of
+from bank.utils.bulkTransfers import BatchError, parse_batch, execute_batch
+from bank.utils.conversion import rate_matrix
+from bank.utils.idempotency import idempotent
+from bank.utils.fragmentCache import account_version
+from bank.utils.rateCache import aget_rates, rates_version
+from bank.utils.statements import FORMATS, async_stream, parse_date_range, statement_rows
+from bank.utils.transactionHistory import MAX_PAGE_SIZE, PAGE_SIZE, account_transactions, decode_cursor, \
+    history_page, serialize_transaction
+from bank.twoFactorMiddleWare import mark_otp_verified, remember_otp_enabled
+from bank.utils.transfers import InsufficientFunds, transfer, withdraw, deposit
+from bank.utils.valuation import user_valuation
 from django.http import JsonResponse
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 import qrcode
 import io
 import base64
+import hashlib
+
+
+OTP_QR_CACHE_KEY = 'otp:qr:{}'
+# Long enough for an enrollment, short enough not to keep rendered secrets around.
+OTP_QR_CACHE_TIMEOUT = 60 * 60
 
 
 def get_recent_transactions(user_account, num_transactions=10):
     primary_account = user_account.primary_bank_account
-    transactions = Transaction.objects.filter(
-        source_account=primary_account
-    ).union(
-        Transaction.objects.filter(destination_account=primary_account)
-    ).order_by('-timestamp')[:num_transactions]  # Change this line
-    return transactions
+    if primary_account is None:
+        return []
+    return account_transactions(primary_account, num_transactions)
+
+
+def share_currency_choices(forms, currencies):
+    """Render the ``currency`` field of every form from the same, already evaluated currencies."""
+    for form in forms:
+        field = form.fields['currency']
+        field.choices = [('', field.empty_label)] + [(currency.pk, str(currency)) for currency in currencies]
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    """
+    ``LoginRequiredMixin`` for views with async handlers.
 
+    The user is loaded from the session in a thread, afterwards ``request.user`` can be read
+    from async code.
+    """
+    # method_decorator() wraps async handlers in sync functions, which hides them from View before Django 5.0.
+    view_is_async = True
 
-class HomeView(LoginRequiredMixin, TemplateView):
+    async def dispatch(self, request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class HomeView(AsyncLoginRequiredMixin, TemplateView):
     template_name = "index.html"
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        user_account = UserAccount.objects.get(user=self.request.user)
-        target_accounts = BankAccount.objects.exclude(user_account=user_account)
+    async def get(self, request, *args, **kwargs):
+        # The template is rendered after the view returns, on a thread, so it may still read lazily.
+        return self.render_to_response(await self.aget_context_data(**kwargs))
+
+    async def aget_context_data(self, **kwargs):
+        context = self.get_context_data(**kwargs)
+        # One query for the user account, its user and its primary account, reused for the whole page.
+        user_account = await UserAccount.objects.select_related('user', 'primary_bank_account__currency').aget(
+            user=self.request.user)
 
         # Generate a secret key if the user doesn't have one yet
         if not user_account.secret_key:
             user_account.secret_key = pyotp.random_base32()
-            user_account.save()
+            await user_account.asave()
 
-        context['form_tr'] = TransactionForm(target_accounts=target_accounts)
+        context['form_tr'] = TransactionForm(user_account=user_account)
         context['form_withdrawal'] = WithdrawalForm()
         context['form_recharge'] = RechargeForm()
-        bank_accounts = BankAccount.objects.filter(user_account__user=self.request.user)
+        context['form_bank_account'] = BankAccountForm()
+        # The four currency dropdowns share one list instead of each evaluating its own queryset.
+        share_currency_choices([context['form_tr'], context['form_withdrawal'], context['form_recharge'],
+                                context['form_bank_account']], [currency async for currency in
+                                                                CurrencyRate.objects.all()])
 
-        if bank_accounts.exists():
-            context['bank_accounts'] = bank_accounts
-        else:
-            context['bank_accounts'] = None
-        try:
-            context['account'] = UserAccount.objects.get(user=self.request.user).primary_bank_account
-        except ObjectDoesNotExist:
-            context['account'] = None
+        bank_accounts = [account async for account in user_account.bank_accounts.select_related('currency')]
+        context['bank_accounts'] = bank_accounts or None
+        context['account'] = user_account.primary_bank_account
 
         form = ChangePrimaryBankAccountForm()
-        form.fields['bank_account'].choices = [(account.id, f'{account.user_account} - {account.currency}') for account
+        form.fields['bank_account'].choices = [(account.id, f'{user_account} - {account.currency}') for account
                                                in bank_accounts]
         context['form'] = form
 
-        # Add BankAccountForm to the context
-        context['form_bank_account'] = BankAccountForm()
-
-        context['rates'] = getRates()
-        saveRates()
+        context['rates'] = await aget_rates()
+        context['rates_version'] = rates_version(context['rates'])
 
-        context['transactions'] = get_recent_transactions(user_account)
+        # The list is only read when its cached fragment is missing; the template calls the partial lazily.
+        context['transactions'] = partial(get_recent_transactions, user_account)
+        primary_account = user_account.primary_bank_account
+        context['transactions_version'] = (await sync_to_async(account_version)(primary_account.pk)
+                                           if primary_account else None)
 
         return context
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         form = BankAccountForm(request.POST)
-        if form.is_valid():
+        if await sync_to_async(form.is_valid)():
             currency = form.cleaned_data['currency']
-            user_account = request.user.useraccount
-            if BankAccount.objects.filter(user_account=user_account, currency=currency).exists():
+            user_account = await UserAccount.objects.aget(user=request.user)
+            if await BankAccount.objects.filter(user_account=user_account, currency=currency).aexists():
                 messages.error(request, 'A bank account with this currency already exists.')
-                return self.get(request, *args, **kwargs)
+                return await self.get(request, *args, **kwargs)
             else:
-                bank_account = form.save(commit=False)
+                bank_account = await sync_to_async(form.save)(commit=False)
                 bank_account.user_account = user_account
                 bank_account.balance = 0  # Set the initial balance to 0
-                bank_account.save()
+                await bank_account.asave()
                 messages.success(request, 'Bank account created successfully.')
                 return redirect('bank:dashboard')
         else:
             # If the form isn't valid, still return the page with the same context data
-            return self.get(request, *args, **kwargs)
+            return await self.get(request, *args, **kwargs)
 
 
 class ChangePrimaryBankAccountView(LoginRequiredMixin, View):
@@ -110,68 +159,45 @@ class ChangePrimaryBankAccountView(LoginRequiredMixin, View):
         return HttpResponseRedirect(reverse('bank:dashboard'))
 
 
-def is_valid_amount(account, amount):
-    return Decimal('0') <= amount <= account.balance + account.balance * Decimal('0.1')
-
-
-def calculate_overdraft_fee(account, amount):
-    return max(Decimal('0'), amount - account.balance) * Decimal('0.1')
-
-
-class TransactionView(LoginRequiredMixin, TemplateView):
+@method_decorator(idempotent, name='post')
+class TransactionView(AsyncLoginRequiredMixin, TemplateView):
     template_name = "transaction.html"
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        user_account = UserAccount.objects.get(user=self.request.user)
-        context['form'] = TransactionForm(user=user_account)
-        return context
+    async def get(self, request, *args, **kwargs):
+        user_account = await UserAccount.objects.aget(user=request.user)
+        return self.render_to_response(self.get_context_data(form=TransactionForm(user_account=user_account),
+                                                             **kwargs))
 
-    def post(self, request, *args, **kwargs):
-        user_account = UserAccount.objects.get(user=request.user)
-        target_accounts = BankAccount.objects.exclude(user_account=user_account)
-        form = TransactionForm(request.POST, target_accounts=target_accounts)
+    async def post(self, request, *args, **kwargs):
+        user_account = await UserAccount.objects.select_related('primary_bank_account__currency').aget(
+            user=request.user)
+        form = TransactionForm(request.POST, user_account=user_account)
 
-        if form.is_valid():
+        if await sync_to_async(form.is_valid)():
             target_account = form.cleaned_data['target_account']
             amount_in_chosen_currency = form.cleaned_data['amount']
             chosen_currency = form.cleaned_data['currency']
+            rates = await sync_to_async(rate_matrix)()
 
-            source_account_in_chosen_currency = BankAccount.objects.filter(user_account=user_account,
-                                                                           currency=chosen_currency).first()
+            source_account_in_chosen_currency = await BankAccount.objects.filter(user_account=user_account,
+                                                                                 currency=chosen_currency).afirst()
 
             if source_account_in_chosen_currency and source_account_in_chosen_currency.balance >= amount_in_chosen_currency:
                 source_account = source_account_in_chosen_currency
                 amount_to_deduct = amount_in_chosen_currency
             else:
                 source_account = user_account.primary_bank_account
-
-                source_currency_rate = CurrencyRate.objects.get(currency=source_account.currency.currency)
-                chosen_currency_rate = CurrencyRate.objects.get(currency=chosen_currency.currency)
-
-                amount_in_czk = amount_in_chosen_currency * Decimal(chosen_currency_rate.rate)
-                amount_to_deduct = amount_in_czk / Decimal(source_currency_rate.rate)
-
-                if not is_valid_amount(source_account, amount_to_deduct):
-                    return JsonResponse({"error": "Insufficient funds."})
-
-            overdraft_fee = calculate_overdraft_fee(source_account, amount_to_deduct)
-
-            source_account.balance -= amount_to_deduct + overdraft_fee
-            source_account.save()
-
-            target_account.balance += amount_in_chosen_currency
-            target_account.save()
-
-            transaction = Transaction(
-                source_account=source_account,
-                destination_account=target_account,
-                amount=amount_in_chosen_currency,
-                currency=chosen_currency,
-                type=TypeOfTransaction.TRA,
-                overdraft_fee=overdraft_fee
-            )
-            transaction.save()
+                amount_to_deduct = rates.convert(amount_in_chosen_currency, chosen_currency.currency,
+                                                 source_account.currency.currency)
+            # The target account is credited in its own currency.
+            amount_to_credit = rates.convert(amount_in_chosen_currency, chosen_currency.currency,
+                                             target_account.currency.currency)
+
+            try:
+                await sync_to_async(transfer)(source_account, target_account, amount_to_deduct, amount_to_credit,
+                                              amount_in_chosen_currency, chosen_currency)
+            except InsufficientFunds:
+                return JsonResponse({"error": "Insufficient funds."})
 
             return JsonResponse({"success": "Transaction complete."})
 
@@ -179,72 +205,190 @@ class TransactionView(LoginRequiredMixin, TemplateView):
             return JsonResponse({"error": "Failed to complete the transaction. Please try again."})
 
 
-class WithdrawalView(LoginRequiredMixin, View):
-    def post(self, request, *args, **kwargs):
+@method_decorator(idempotent, name='post')
+class WithdrawalView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
         form = WithdrawalForm(request.POST)
-        if form.is_valid():
+        if await sync_to_async(form.is_valid)():
             amount_in_chosen_currency = form.cleaned_data['amount']
             chosen_currency = form.cleaned_data['currency']
-            user_account = UserAccount.objects.get(user=request.user)
+            user_account = await UserAccount.objects.select_related('primary_bank_account__currency').aget(
+                user=request.user)
             source_account = user_account.primary_bank_account
 
-            chosen_currency_rate = CurrencyRate.objects.get(currency=chosen_currency.currency)
-            source_currency_rate = CurrencyRate.objects.get(currency=source_account.currency.currency)
-
-            amount_in_czk = amount_in_chosen_currency * Decimal(chosen_currency_rate.rate)
-            amount_to_deduct = amount_in_czk / Decimal(source_currency_rate.rate)
+            amount_to_deduct = (await sync_to_async(rate_matrix)()).convert(
+                amount_in_chosen_currency, chosen_currency.currency, source_account.currency.currency)
 
-            if source_account.balance < amount_to_deduct:
+            try:
+                await sync_to_async(withdraw)(source_account, amount_to_deduct, amount_in_chosen_currency,
+                                              chosen_currency)
+            except InsufficientFunds:
                 return JsonResponse({"error": "Insufficient funds."})
-            else:
-                source_account.balance -= amount_to_deduct
-                source_account.save()
-
-                transaction = Transaction(
-                    source_account=source_account,
-                    destination_account=source_account,
-                    amount=amount_in_chosen_currency,
-                    currency=chosen_currency,
-                    type=TypeOfTransaction.WIT
-                )
-                transaction.save()
         else:
             return JsonResponse({"error": "Failed to complete the withdrawal. Please try again."})
         return JsonResponse({"success": "Withdrawal was successful."})
 
 
-class RechargeView(LoginRequiredMixin, View):
-    def post(self, request, *args, **kwargs):
+@method_decorator(idempotent, name='post')
+class RechargeView(AsyncLoginRequiredMixin, View):
+    async def post(self, request, *args, **kwargs):
         form = RechargeForm(request.POST)
-        if form.is_valid():
+        if await sync_to_async(form.is_valid)():
             amount_in_chosen_currency = form.cleaned_data['amount']
             chosen_currency = form.cleaned_data['currency']
-            user_account = UserAccount.objects.get(user=request.user)
+            user_account = await UserAccount.objects.select_related('primary_bank_account__currency').aget(
+                user=request.user)
             source_account = user_account.primary_bank_account
 
-            chosen_currency_rate = CurrencyRate.objects.get(currency=chosen_currency.currency)
-            source_currency_rate = CurrencyRate.objects.get(currency=source_account.currency.currency)
-
-            amount_in_czk = amount_in_chosen_currency * Decimal(chosen_currency_rate.rate)
-            amount_to_add = amount_in_czk / Decimal(source_currency_rate.rate)
+            amount_to_add = (await sync_to_async(rate_matrix)()).convert(
+                amount_in_chosen_currency, chosen_currency.currency, source_account.currency.currency)
 
-            source_account.balance += amount_to_add
-            source_account.save()
-
-            transaction = Transaction(
-                source_account=source_account,
-                destination_account=source_account,
-                amount=amount_in_chosen_currency,
-                currency=chosen_currency,
-                type=TypeOfTransaction.DEP
-            )
-            transaction.save()
+            await sync_to_async(deposit)(source_account, amount_to_add, amount_in_chosen_currency, chosen_currency)
 
             return JsonResponse({"success": "Recharge successful."})
         else:
             return JsonResponse({"error": "Failed to complete the recharge. Please try again."})
 
 
+class RecipientSearchView(LoginRequiredMixin, View):
+    """Autocomplete other customers' accounts by account number prefix."""
+    min_length = 3
+    limit = 10
+
+    def get(self, request, *args, **kwargs):
+        prefix = request.GET.get('q', '').strip()
+        if len(prefix) < self.min_length or not prefix.isdigit():
+            return JsonResponse({"results": []})
+
+        # A prefix range scan on the unique account_number index, stopped after ``limit`` rows.
+        accounts = BankAccount.objects.filter(account_number__startswith=prefix).exclude(
+            user_account__user=request.user).select_related('user_account__user', 'currency').order_by(
+            'account_number')[:self.limit]
+        results = [{
+            "account_number": account.account_number,
+            "owner": account.user_account.user.username,
+            "currency": account.currency.currency,
+        } for account in accounts]
+        if not results and len(prefix) == ACCOUNT_NUMBER_LENGTH and not is_valid_account_number(prefix):
+            return JsonResponse({"results": [], "error": "Wrong account number."})
+        return JsonResponse({"results": results})
+
+
+class ValuationView(LoginRequiredMixin, View):
+    """Total value of all the user's accounts in ``?currency=`` (CZK by default)."""
+
+    def get(self, request, *args, **kwargs):
+        currency = request.GET.get('currency', 'CZK').upper()
+        if currency not in rate_matrix():
+            return JsonResponse({"error": "Unknown currency."}, status=400)
+        return JsonResponse(user_valuation(request.user.useraccount, currency))
+
+
+@method_decorator(idempotent, name='post')
+class BulkTransferView(LoginRequiredMixin, View):
+    """Accept a CSV (``text/csv``) or JSON batch of transfers from the user's own accounts."""
+
+    def post(self, request, *args, **kwargs):
+        fmt = 'csv' if request.content_type == 'text/csv' else 'json'
+        try:
+            rows = parse_batch(request.body, fmt)
+        except BatchError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        if len(rows) > settings.BULK_TRANSFER_MAX_ROWS:
+            return JsonResponse({"error": f"A batch can contain at most {settings.BULK_TRANSFER_MAX_ROWS} transfers."},
+                                status=400)
+
+        results = execute_batch(rows, user_account=request.user.useraccount)
+        succeeded = sum(1 for result in results if result['status'] == 'ok')
+        return JsonResponse({"succeeded": succeeded, "failed": len(results) - succeeded, "results": results})
+
+
+class TransactionHistoryView(LoginRequiredMixin, View):
+    """
+    JSON history of one of the user's accounts (the primary one by default), newest first.
+
+    Query parameters: ``account`` (id), ``limit``, ``cursor`` from the previous page's
+    ``next_cursor``, ``type`` (deposit/withdrawal/transfer, repeatable) and ``currency``.
+    """
+
+    def get(self, request, *args, **kwargs):
+        user_account = request.user.useraccount
+        account_id = request.GET.get('account') or user_account.primary_bank_account_id
+        try:
+            account = BankAccount.objects.get(pk=account_id, user_account=user_account)
+        except (BankAccount.DoesNotExist, ValueError):
+            raise Http404('Bank account not found.')
+
+        labels = {label: value for value, label in TypeOfTransaction.choices}
+        try:
+            limit = min(int(request.GET.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+            cursor = decode_cursor(request.GET['cursor']) if request.GET.get('cursor') else None
+            types = [labels[name] for name in request.GET.getlist('type')]
+        except (ValueError, KeyError):
+            return JsonResponse({"error": "Invalid parameters."}, status=400)
+        if limit < 1:
+            return JsonResponse({"error": "Invalid parameters."}, status=400)
+
+        transactions, next_cursor = history_page(account, limit, cursor, types, request.GET.get('currency'))
+        return JsonResponse({
+            "results": [serialize_transaction(transaction, account) for transaction in transactions],
+            "next_cursor": next_cursor,
+        })
+
+
+class StatementView(LoginRequiredMixin, View):
+    """
+    Stream the statement of one of the user's accounts as ``format=csv`` or ``format=jsonl``.
+
+    ``start`` and ``end`` are optional dates (YYYY-MM-DD); both days are included.
+    """
+
+    def get(self, request, account_id, *args, **kwargs):
+        try:
+            account = BankAccount.objects.select_related('currency').get(pk=account_id,
+                                                                         user_account__user=request.user)
+        except BankAccount.DoesNotExist:
+            raise Http404('Bank account not found.')
+
+        fmt = request.GET.get('format', 'csv')
+        try:
+            start, end = parse_date_range(request.GET.get('start'), request.GET.get('end'))
+        except ValueError:
+            return JsonResponse({"error": "Invalid date."}, status=400)
+        if fmt not in FORMATS:
+            return JsonResponse({"error": "Unknown format."}, status=400)
+
+        render_rows, content_type = FORMATS[fmt]
+        content = render_rows(statement_rows(account, start, end))
+        if isinstance(request, ASGIRequest):
+            content = async_stream(content)
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="statement-{account.account_number}.{fmt}"'
+        return response
+
+
+class BalanceView(LoginRequiredMixin, View):
+    """Return the balance of one of the user's accounts at the end of ``date`` (YYYY-MM-DD), today by default."""
+
+    def get(self, request, account_id, *args, **kwargs):
+        try:
+            account = BankAccount.objects.select_related('currency').get(pk=account_id,
+                                                                         user_account__user=request.user)
+        except BankAccount.DoesNotExist:
+            raise Http404('Bank account not found.')
+        try:
+            on_date = date.fromisoformat(request.GET['date']) if request.GET.get('date') else timezone.localdate()
+        except ValueError:
+            return JsonResponse({"error": "Invalid date."}, status=400)
+
+        return JsonResponse({
+            "account": account.account_number,
+            "currency": account.currency.currency,
+            "date": on_date.isoformat(),
+            "balance": str(balance_as_of(account, on_date)),
+        })
+
+
 class CustomLoginView(LoginView):
     @property
     def authentication_form(self):
@@ -275,14 +419,40 @@ class CustomLoginView(LoginView):
             return self.form_invalid(form)
 
 
+def otp_qr_code(otp_auth_url):
+    """
+    Return the QR code of the provisioning URI as a base64 PNG, rendered once per secret.
+
+    The cache key is a hash of the URI, so the secret itself never appears in a key.
+    """
+    key = OTP_QR_CACHE_KEY.format(hashlib.sha256(otp_auth_url.encode()).hexdigest())
+    img_b64 = cache.get(key)
+    if img_b64 is None:
+        # Generate QR code
+        qr_img = qrcode.make(otp_auth_url)
+        img = io.BytesIO()
+
+        # Save the qr_img (which is already a PIL Image object) directly as PNG
+        qr_img.save(img, 'PNG')
+
+        img_b64 = base64.b64encode(img.getvalue()).decode()
+        cache.set(key, img_b64, timeout=OTP_QR_CACHE_TIMEOUT)
+    return img_b64
+
+
 @login_required
 def setup_otp(request):
+    if request.user.useraccount.otp_enabled:
+        # The secret is only shown once; an existing 2FA setup has to be verified, not set up again.
+        return redirect('bank:verify_otp')
     if request.method == 'POST':
         otp_attempt = request.POST.get('otp')
         otp = pyotp.TOTP(request.user.useraccount.secret_key)
         if otp.verify(otp_attempt):
             request.user.useraccount.otp_enabled = True
             request.user.useraccount.save()
+            remember_otp_enabled(request, True)
+            mark_otp_verified(request)
             messages.success(request, '2FA is set up successfully.')
             return redirect('bank:dashboard')
         else:
@@ -295,15 +465,7 @@ def setup_otp(request):
             issuer_name='YourAppName'  # your app name
         )
 
-        # Generate QR code
-        qr_img = qrcode.make(otp_auth_url)
-        img = io.BytesIO()
-
-        # Save the qr_img (which is already a PIL Image object) directly as PNG
-        qr_img.save(img, 'PNG')
-
-        img.seek(0)
-        img_b64 = base64.b64encode(img.read()).decode()
+        img_b64 = otp_qr_code(otp_auth_url)
 
         context = {'qr_code': img_b64}
 
@@ -317,6 +479,7 @@ def verify_otp(request):
         otp = TOTP(request.user.useraccount.secret_key)
 
         if otp.verify(otp_attempt):
+            mark_otp_verified(request)
             return redirect('bank:dashboard')
         else:
             return redirect('accounts:login')